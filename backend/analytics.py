@@ -0,0 +1,216 @@
+import asyncio
+import logging
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from pymongo import UpdateOne
+
+from archive import unpack
+from message_store import bucket_messages
+
+logger = logging.getLogger(__name__)
+
+GRANULARITIES = {
+    "hour": timedelta(hours=1),
+    "day": timedelta(days=1),
+}
+
+# Counters kept on every rollup document
+FIELDS = (
+    "conversations_started",
+    "conversations_ended",
+    "participant_messages",
+    "avatar_messages",
+    # Sums over the conversations ended in the period, for the averages
+    "ended_message_count",
+    "ended_duration_seconds",
+)
+
+
+def period_start(moment: datetime, granularity: str) -> datetime:
+    if granularity == "hour":
+        return moment.replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _with_averages(counters: dict) -> dict:
+    ended = counters["conversations_ended"]
+    return {
+        **counters,
+        "average_messages_per_conversation": counters["ended_message_count"] / ended if ended else None,
+        "average_duration_seconds": counters["ended_duration_seconds"] / ended if ended else None,
+    }
+
+
+class AnalyticsRollups:
+    """Per-avatar counters pre-aggregated into hourly and daily documents.
+
+    Every event is one ``bulk_write`` of ``$inc`` upserts, one per
+    granularity and period it touches, so the dashboard reads a handful of
+    small documents for any time range instead of scanning conversations
+    and messages. Conversation-level counts are attributed to the period
+    the event happened in: starts to the start time, lengths and durations
+    to the end time.
+
+    Message counts arrive with every append, so they are summed in memory
+    and written together ``delay`` seconds after the first one, keeping the
+    write off the message path. Counts not yet written are lost if the
+    process dies; ``drain`` writes them on shutdown.
+    """
+
+    def __init__(self, collection, delay: float = 1.0):
+        self._collection = collection
+        self.delay = delay
+        self._pending: Dict[Tuple[str, datetime], Counter] = defaultdict(Counter)
+        self._timer: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def _operations(avatar_id: str, moment: datetime, counters: Counter) -> List[UpdateOne]:
+        return [
+            UpdateOne(
+                {"avatar_id": avatar_id, "granularity": granularity, "period_start": period_start(moment, granularity)},
+                {"$inc": dict(counters)},
+                upsert=True,
+            )
+            for granularity in GRANULARITIES
+        ]
+
+    async def _increment(self, avatar_id: str, increments: Dict[datetime, Counter]):
+        operations = [
+            operation for moment, counters in increments.items() for operation in self._operations(avatar_id, moment, counters)
+        ]
+        if operations:
+            await self._collection.bulk_write(operations, ordered=False)
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.delay)
+        self._timer = None
+        await self.flush()
+
+    async def flush(self):
+        """Write the message counts summed since the last flush."""
+        pending, self._pending = self._pending, defaultdict(Counter)
+        if not pending:
+            return
+        operations = [
+            operation for (avatar_id, moment), counters in pending.items()
+            for operation in self._operations(avatar_id, moment, counters)
+        ]
+        try:
+            await self._collection.bulk_write(operations, ordered=False)
+        except Exception:
+            # Summed back into whatever arrived meanwhile, so the next timer writes both
+            for key, counters in pending.items():
+                self._pending[key].update(counters)
+            logger.exception("Writing message counts of %d periods failed", len(pending))
+
+    async def drain(self):
+        """Write the counts still waiting for their timer, so stopping the process loses none."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        await self.flush()
+
+    async def conversation_started(self, avatar_id: str, started_at: datetime):
+        await self._increment(avatar_id, {started_at: Counter(conversations_started=1)})
+
+    async def conversation_ended(self, avatar_id: str, started_at: datetime, ended_at: datetime, message_count: int):
+        await self._increment(avatar_id, {ended_at: Counter(
+            conversations_ended=1,
+            ended_message_count=message_count,
+            ended_duration_seconds=(ended_at - started_at).total_seconds(),
+        )})
+
+    async def messages_added(self, conversation: dict, messages: List[dict]):
+        # Bulk imports can span periods, so bucket by each message's own hour
+        for message in messages:
+            field = "avatar_messages" if message["sender"] == "avatar" else "participant_messages"
+            self._pending[(conversation["avatar_id"], period_start(message["timestamp"], "hour"))][field] += 1
+        if self._timer is None:
+            self._timer = asyncio.create_task(self._flush_later())
+
+    async def backfill(self, db, cutover: datetime, batch_size: int = 1000):
+        """Count everything that happened before ``cutover`` from the stored conversations and messages.
+
+        Live counting only sees events after the rollups were deployed, so
+        older ones are recomputed from conversations, message buckets and
+        archives into a separate ``backfill`` counter set that ``series``
+        adds in. It is written with ``$set``, so running it again for the
+        same ``cutover`` gives the same result.
+        """
+        hourly: Dict[Tuple[str, datetime], Counter] = defaultdict(Counter)
+        async for conversation in db.conversations.find(
+            {"started_at": {"$lt": cutover}},
+            {"_id": 0, "avatar_id": 1, "started_at": 1, "ended_at": 1, "message_count": 1},
+        ):
+            avatar_id = conversation["avatar_id"]
+            hourly[(avatar_id, period_start(conversation["started_at"], "hour"))]["conversations_started"] += 1
+            ended_at = conversation.get("ended_at")
+            if ended_at is not None and ended_at < cutover:
+                hourly[(avatar_id, period_start(ended_at, "hour"))].update(
+                    conversations_ended=1,
+                    ended_message_count=conversation.get("message_count", 0),
+                    ended_duration_seconds=(ended_at - conversation["started_at"]).total_seconds(),
+                )
+
+        def count_messages(avatar_id: str, messages: List[dict]):
+            for message in messages:
+                if message["timestamp"] < cutover:
+                    field = "avatar_messages" if message["sender"] == "avatar" else "participant_messages"
+                    hourly[(avatar_id, period_start(message["timestamp"], "hour"))][field] += 1
+
+        # An archive holds seq 0 up to its message_count; buckets may still hold copies of those
+        archived_counts = {}
+        async for archived in db.conversation_archive.find({}, {"_id": 0, "conversation_id": 1, "avatar_id": 1, "payload": 1}):
+            messages = unpack(archived["payload"])
+            archived_counts[archived["conversation_id"]] = len(messages)
+            count_messages(archived["avatar_id"], messages)
+        async for bucket in db.message_buckets.find(
+            {}, {"_id": 0, "conversation_id": 1, "avatar_id": 1, "start": 1, "messages.sender": 1, "messages.timestamp": 1}
+        ):
+            if bucket.get("avatar_id") is None:
+                continue
+            archived = archived_counts.get(bucket["conversation_id"], 0)
+            count_messages(bucket["avatar_id"], [message for message in bucket_messages(bucket) if message["seq"] >= archived])
+
+        rollups: Dict[Tuple[str, str, datetime], Counter] = defaultdict(Counter)
+        for (avatar_id, hour), counters in hourly.items():
+            for granularity in GRANULARITIES:
+                rollups[(avatar_id, granularity, period_start(hour, granularity))].update(counters)
+        operations = [
+            UpdateOne(
+                {"avatar_id": avatar_id, "granularity": granularity, "period_start": moment},
+                {"$set": {"backfill": dict(counters)}},
+                upsert=True,
+            )
+            for (avatar_id, granularity, moment), counters in rollups.items()
+        ]
+        for start in range(0, len(operations), batch_size):
+            await self._collection.bulk_write(operations[start:start + batch_size], ordered=False)
+
+    async def series(self, avatar_ids: Sequence[str], granularity: str, start: datetime, end: datetime) -> dict:
+        """Per-period counters summed over ``avatar_ids`` for periods starting in [start, end), plus totals."""
+        if self._pending:
+            await self.flush()
+        periods: Dict[datetime, Counter] = defaultdict(Counter)
+        cursor = self._collection.find(
+            {
+                "avatar_id": {"$in": list(avatar_ids)},
+                "granularity": granularity,
+                "period_start": {"$gte": period_start(start, granularity), "$lt": end},
+            },
+            {"_id": 0, "avatar_id": 0, "granularity": 0},
+        )
+        async for rollup in cursor:
+            moment = rollup.pop("period_start")
+            periods[moment].update(rollup.pop("backfill", {}))
+            periods[moment].update(rollup)
+
+        totals = Counter()
+        series = []
+        for moment in sorted(periods):
+            counters = {field: periods[moment].get(field, 0) for field in FIELDS}
+            totals.update(counters)
+            series.append({"period_start": moment, **_with_averages(counters)})
+        return {"totals": _with_averages({field: totals.get(field, 0) for field in FIELDS}), "series": series}
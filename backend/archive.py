@@ -0,0 +1,177 @@
+import asyncio
+import gzip
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+import bson
+from bson.binary import Binary
+
+from message_store import MessageStore, bucket_messages
+
+logger = logging.getLogger(__name__)
+
+ENCODING = "bson+gzip"
+
+
+def pack(messages: List[dict], level: int = 6) -> bytes:
+    # BSON keeps datetimes as datetimes, which JSON would not
+    return gzip.compress(bson.encode({"messages": messages}), compresslevel=level, mtime=0)
+
+
+def unpack(payload: bytes) -> List[dict]:
+    return bson.decode(gzip.decompress(payload))["messages"]
+
+
+def merge_messages(archived: List[dict], hot: List[dict]) -> List[dict]:
+    """Archived and hot messages of one conversation in ``seq`` order, each sequence number once."""
+    by_seq = {message["seq"]: message for message in archived}
+    by_seq.update((message["seq"], message) for message in hot)
+    return [by_seq[seq] for seq in sorted(by_seq)]
+
+
+class ConversationArchive:
+    """Moves the messages of old, summarized conversations out of the hot buckets.
+
+    A conversation ended more than ``after`` ago whose summary covers all of
+    its messages has its buckets packed into one compressed document in
+    ``conversation_archive`` and deleted. The conversation document stays as
+    the stub, marked with ``archived_at``, so listings and lookups are
+    unchanged and readers merge in the archived messages on demand. Messages
+    appended after archiving land in ordinary buckets and are merged by
+    ``seq``. The newest bucket is emptied and kept, sealed, so new appends
+    go on numbering after it; bucket deletes are guarded by their count, so
+    a message that races with archiving stays hot rather than being lost.
+    Only the compressed payload is stored; search reaches archived messages
+    through the conversation's summary (see ``ConversationSearch``).
+    """
+
+    def __init__(self, db, store: MessageStore, after: timedelta = timedelta(days=30),
+                 batch_size: int = 100, level: int = 6):
+        self.conversations = db.conversations
+        self.summaries = db.summaries
+        self.collection = db.conversation_archive
+        self.store = store
+        self.after = after
+        self.batch_size = batch_size
+        self.level = level
+        self._task: Optional[asyncio.Task] = None
+        self._archived = 0
+        self._raw_bytes = 0
+        self._stored_bytes = 0
+
+    async def start(self, interval: float):
+        self._task = asyncio.create_task(self._run(interval))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self, interval: float):
+        while True:
+            try:
+                await self.archive_due()
+            except Exception:
+                logger.exception("Conversation archival pass failed")
+            await asyncio.sleep(interval)
+
+    async def archive_due(self) -> int:
+        """Archive every eligible conversation, ``batch_size`` at a time; returns how many were archived."""
+        cutoff = datetime.utcnow() - self.after
+        cursor = self.conversations.find(
+            {"status": "ended", "archived_at": None, "ended_at": {"$lt": cutoff}},
+            {"_id": 0, "id": 1, "avatar_id": 1, "message_count": 1},
+        ).sort("ended_at", 1).batch_size(self.batch_size)
+        archived = 0
+        batch = []
+        async for conversation in cursor:
+            batch.append(conversation)
+            if len(batch) == self.batch_size:
+                archived += await self._archive_batch(batch)
+                batch = []
+        if batch:
+            archived += await self._archive_batch(batch)
+        if archived:
+            logger.info("Archived %d conversations", archived)
+        return archived
+
+    async def _archive_batch(self, conversations: List[dict]) -> int:
+        summarized = {}
+        async for summary in self.summaries.find(
+            {"conversation_id": {"$in": [conversation["id"] for conversation in conversations]}},
+            {"_id": 0, "conversation_id": 1, "message_count": 1},
+        ):
+            summarized[summary["conversation_id"]] = summary.get("message_count", 0)
+
+        archived = 0
+        for conversation in conversations:
+            # Only once the summary has seen every message, so summaries never need to read the archive
+            if summarized.get(conversation["id"], -1) >= conversation.get("message_count", 0):
+                archived += await self._archive(conversation)
+        return archived
+
+    async def _archive(self, conversation: dict) -> bool:
+        conversation_id = conversation["id"]
+        buckets = await self.store.buckets.find(
+            {"conversation_id": conversation_id}, {"_id": 0, "bucket": 1, "start": 1, "count": 1, "messages": 1}
+        ).sort("bucket", 1).to_list(None)
+        messages = [message for bucket in buckets for message in bucket_messages(bucket)]
+        if len(messages) < conversation.get("message_count", 0):
+            # message_count is ahead of the buckets only if they were lost; never archive over that
+            return False
+
+        payload = pack(messages, self.level)
+        await self.collection.replace_one(
+            {"conversation_id": conversation_id},
+            {
+                "conversation_id": conversation_id,
+                "avatar_id": conversation["avatar_id"],
+                "encoding": ENCODING,
+                "message_count": len(messages),
+                "payload": Binary(payload),
+                "archived_at": datetime.utcnow(),
+            },
+            upsert=True,
+        )
+        result = await self.conversations.update_one(
+            {"id": conversation_id, "archived_at": None}, {"$set": {"archived_at": datetime.utcnow()}}
+        )
+        if result.modified_count == 0:
+            return False
+        for bucket in buckets[:-1]:
+            await self.store.buckets.delete_one(
+                {"conversation_id": conversation_id, "bucket": bucket["bucket"], "count": bucket["count"]}
+            )
+        if buckets:
+            await self.store.buckets.update_one(
+                {"conversation_id": conversation_id, "bucket": buckets[-1]["bucket"], "count": buckets[-1]["count"]},
+                {"$set": {"messages": [], "sealed": True}},
+            )
+        self._archived += 1
+        self._raw_bytes += sum(len(bson.encode(message)) for message in messages)
+        self._stored_bytes += len(payload)
+        return True
+
+    async def drop_search_contents(self):
+        """Remove the uncompressed ``contents`` copy, and its text index, from archives written with one."""
+        await self.collection.update_many({"contents": {"$exists": True}}, {"$unset": {"contents": ""}})
+        if "avatar_text" in await self.collection.index_information():
+            await self.collection.drop_index("avatar_text")
+
+    async def read_many(self, conversation_ids: List[str]) -> Dict[str, List[dict]]:
+        """Archived messages of each conversation that has an archive, in ``seq`` order."""
+        archived = {}
+        async for document in self.collection.find(
+            {"conversation_id": {"$in": conversation_ids}}, {"_id": 0, "conversation_id": 1, "payload": 1}
+        ):
+            archived[document["conversation_id"]] = unpack(document["payload"])
+        return archived
+
+    def stats(self) -> dict:
+        return {
+            "archived": self._archived,
+            "raw_bytes": self._raw_bytes,
+            "stored_bytes": self._stored_bytes,
+        }
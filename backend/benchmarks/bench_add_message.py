@@ -0,0 +1,111 @@
+"""Compare the original four-round-trip add_message against the current one.
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_add_message --requests 2000 --concurrency 1,4,16 --latency-ms 2
+
+Uses the in-memory fake by default; pass --mongo-url to measure against a real
+mongod (the benchmark drops and refills the DB_NAME database it points at).
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks import mongo_harness  # noqa: E402
+
+
+async def legacy_add_message(db, conversation_id, message):
+    # The pre-bucketing hot path: read, push, read avatar, push again
+    conversation = await db.legacy_conversations.find_one({"id": conversation_id})
+    message_dict = message.dict()
+    await db.legacy_conversations.update_one({"id": conversation_id}, {"$push": {"messages": message_dict}})
+    avatar = await db.avatars.find_one({"id": conversation["avatar_id"]})
+    reply = f"As {avatar['name']}, I understand your message about '{message.content[:50]}...'. Let me respond based on my personality: {avatar['personality'][:100]}..."
+    await db.legacy_conversations.update_one(
+        {"id": conversation_id}, {"$push": {"messages": {"sender": "avatar", "content": reply}}}
+    )
+
+
+async def run(name, call, conversation_ids, requests, concurrency, recorder):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(index):
+        async with semaphore:
+            started = time.perf_counter()
+            await call(conversation_ids[index % len(conversation_ids)], index)
+            latencies.append(time.perf_counter() - started)
+
+    recorder.reset()
+    started = time.perf_counter()
+    await asyncio.gather(*(one(index) for index in range(requests)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    print(
+        f"{name:<8} trips/req={recorder.total / requests:5.2f}  "
+        f"mean={statistics.mean(latencies) * 1000:7.2f}ms  "
+        f"p50={latencies[len(latencies) // 2] * 1000:7.2f}ms  "
+        f"p95={latencies[int(len(latencies) * 0.95)] * 1000:7.2f}ms  "
+        f"throughput={requests / elapsed:8.1f} req/s"
+    )
+
+
+async def main(args):
+    if args.mongo_url:
+        recorder = mongo_harness.install_real(args.mongo_url)
+    else:
+        recorder = mongo_harness.install_fake(latency=args.latency_ms / 1000)
+    os.environ["DB_NAME"] = args.db_name
+    os.environ.setdefault("BCRYPT_ROUNDS", "4")
+    import server
+
+    await server.client.drop_database(args.db_name)
+    await server.ensure_indexes(server.db)
+    await server.db.legacy_conversations.create_index("id", unique=True)
+    avatar = server.Avatar(name="Bench", personality="Patient and precise", description="Benchmark avatar", owner_id="bench")
+    await server.db.avatars.insert_one(avatar.dict())
+
+    conversation_ids = []
+    for index in range(args.conversations):
+        conversation = await server.create_conversation(
+            server.ConversationCreate(avatar_id=avatar.id, participant_name=f"participant-{index}")
+        )
+        await server.db.legacy_conversations.insert_one({**conversation.dict(), "messages": []})
+        conversation_ids.append(conversation.id)
+
+    def message(index):
+        return server.Message(sender="participant", content=f"Benchmark message {index}")
+
+    backend = args.mongo_url or f"in-memory fake, {args.latency_ms}ms per round trip"
+    for concurrency in args.concurrency:
+        print(f"{args.requests} requests, concurrency {concurrency}, {backend}")
+        await run(
+            "legacy",
+            lambda conversation_id, index: legacy_add_message(server.db, conversation_id, message(index)),
+            conversation_ids, args.requests, concurrency, recorder,
+        )
+        await run(
+            "current",
+            lambda conversation_id, index: server.add_message(conversation_id, message(index)),
+            conversation_ids, args.requests, concurrency, recorder,
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument(
+        "--concurrency", type=lambda value: [int(level) for level in value.split(",")], default=[1, 4, 16]
+    )
+    parser.add_argument("--conversations", type=int, default=100)
+    parser.add_argument("--latency-ms", type=float, default=2.0)
+    parser.add_argument("--mongo-url", default=None)
+    parser.add_argument("--db-name", default="zeny_ai_bench")
+    asyncio.run(main(parser.parse_args()))
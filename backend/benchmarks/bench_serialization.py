@@ -0,0 +1,129 @@
+"""Compare the validating response path against trusted construction plus orjson, per endpoint.
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_serialization --items 1000 --repeat 20
+
+Documents are generated in memory in the shape Mongo returns them, so only
+model construction, response_model handling and JSON rendering are timed.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks import mongo_harness  # noqa: E402
+
+
+def documents(kind, count, messages_per_conversation):
+    now = datetime.utcnow().replace(microsecond=123000)
+
+    def message(seq):
+        return {
+            "sender": "participant" if seq % 2 == 0 else "avatar",
+            "content": f"Message number {seq} with a few words of body text",
+            "timestamp": now + timedelta(seconds=seq),
+            "seq": seq,
+        }
+
+    def one(index):
+        base = {"id": str(uuid.uuid4())}
+        if kind == "avatar":
+            return {
+                **base, "name": f"Avatar {index}", "personality": "Patient and precise " * 5,
+                "description": "Benchmark avatar", "owner_id": "bench", "knowledge_base": "Facts. " * 40,
+                "avatar_image": None, "created_at": now, "is_active": True,
+            }
+        if kind == "list_item":
+            return {
+                **base, "avatar_id": "avatar", "participant_name": f"participant-{index}", "started_at": now,
+                "ended_at": None, "status": "active", "message_count": 12, "last_message_at": now,
+                "last_message_preview": "Last thing that was said",
+            }
+        if kind == "conversation":
+            return {
+                **base, "avatar_id": "avatar", "participant_name": f"participant-{index}", "started_at": now,
+                "ended_at": now, "status": "ended",
+                "messages": [message(seq) for seq in range(messages_per_conversation)],
+            }
+        if kind == "message":
+            return message(index)
+        if kind == "summary":
+            return {
+                **base, "avatar_id": "avatar", "owner_id": "bench", "conversation_id": str(uuid.uuid4()),
+                "summary_text": "Conversation between avatar and participant with 12 total messages.",
+                "key_points": ["First message: hello", "Last message: goodbye"], "generated_at": now,
+                "message_count": 12, "participant_message_count": 6, "avatar_message_count": 6,
+                "first_message_preview": "hello", "last_message_preview": "goodbye", "updated_at": now,
+            }
+        raise ValueError(kind)
+
+    return [one(index) for index in range(count)]
+
+
+def timed(call, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        call()
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples)
+
+
+def main(args):
+    mongo_harness.install_fake()
+    os.environ.setdefault("BCRYPT_ROUNDS", "4")
+    from fastapi.responses import JSONResponse
+    from fastapi.routing import serialize_response
+
+    import server
+    from serialization import respond, trusted_list
+
+    routes = {(route.path, tuple(route.methods)): route for route in server.app.routes if hasattr(route, "methods")}
+
+    def field(path):
+        return routes[(path, ("GET",))].response_field
+
+    cases = [
+        ("GET /api/avatars", field("/api/avatars"), server.Avatar, "avatar"),
+        ("GET /api/conversations?view=summary", field("/api/conversations"), server.ConversationListItem, "list_item"),
+        ("GET /api/conversations", field("/api/conversations"), server.Conversation, "conversation"),
+        ("GET /api/conversations/{id}/messages", field("/api/conversations/{conversation_id}/messages"),
+         server.StoredMessage, "message"),
+        ("GET /api/summaries", field("/api/summaries"), server.Summary, "summary"),
+    ]
+
+    loop = asyncio.new_event_loop()
+    print(f"{args.items} items per response, median of {args.repeat} runs")
+    for name, response_field, model, kind in cases:
+        docs = documents(kind, args.items, args.messages)
+
+        def legacy():
+            # What the handlers used to do: validate into models, then let FastAPI validate and encode again
+            items = [model(**doc) for doc in docs]
+            content = loop.run_until_complete(serialize_response(field=response_field, response_content=items))
+            return JSONResponse(content).body
+
+        def current():
+            return respond(trusted_list(model, docs)).body
+
+        if json.loads(legacy()) != json.loads(current()):
+            raise SystemExit(f"{name}: the two paths render different JSON")
+        before, after = timed(legacy, args.repeat), timed(current, args.repeat)
+        print(f"{name:<40} legacy={before * 1000:8.2f}ms  current={after * 1000:8.2f}ms  speedup={before / after:5.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--items", type=int, default=1000)
+    parser.add_argument("--messages", type=int, default=20, help="messages embedded per full conversation")
+    parser.add_argument("--repeat", type=int, default=20)
+    main(parser.parse_args())
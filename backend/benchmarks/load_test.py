@@ -0,0 +1,346 @@
+"""Scripted load against the app in-process, reporting latency percentiles per endpoint.
+
+Run from the backend directory:
+
+    python -m benchmarks.load_test --concurrency 16 --output baseline.json
+    python -m benchmarks.load_test --concurrency 16 --compare baseline.json --fail-on-regression 15
+
+Requests go through httpx's ASGI transport straight into ``server.app``, so
+routing, dependencies, validation and serialization are all exercised without
+a network hop. Mongo is the in-memory fake from ``mongo_harness`` unless
+--mongo-url points at a real mongod (its DB_NAME database is dropped first).
+Results are written as JSON so runs can be compared against a saved baseline.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks import mongo_harness  # noqa: E402
+
+# Percentiles compared against a baseline, plus throughput
+COMPARED = ("p50_ms", "p95_ms", "p99_ms")
+
+
+def percentile(ordered, fraction):
+    # Nearest rank on an already sorted list
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))]
+
+
+class Recorder:
+    """Latencies and status codes per endpoint label for one workload."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        # Labels timed by the workload itself rather than one HTTP request
+        self.derived = set()
+
+    async def call(self, label, send, expected=(200,)):
+        started = time.perf_counter()
+        response = await send()
+        self.latencies[label].append(time.perf_counter() - started)
+        self.statuses[label][response.status_code] += 1
+        if response.status_code not in expected:
+            self.errors[label] += 1
+        return response
+
+    def observe(self, label, seconds, outcome, ok):
+        self.derived.add(label)
+        self.latencies[label].append(seconds)
+        self.statuses[label][outcome] += 1
+        if not ok:
+            self.errors[label] += 1
+
+    def report(self, elapsed):
+        endpoints = {}
+        for label, samples in sorted(self.latencies.items()):
+            ordered = sorted(sample * 1000 for sample in samples)
+            endpoints[label] = {
+                "count": len(ordered),
+                "errors": self.errors[label],
+                "statuses": {str(code): count for code, count in sorted(self.statuses[label].items())},
+                "mean_ms": sum(ordered) / len(ordered),
+                "p50_ms": percentile(ordered, 0.50),
+                "p95_ms": percentile(ordered, 0.95),
+                "p99_ms": percentile(ordered, 0.99),
+                "max_ms": ordered[-1],
+                "throughput_rps": len(ordered) / elapsed if elapsed else 0.0,
+            }
+        total = sum(len(samples) for label, samples in self.latencies.items() if label not in self.derived)
+        return {
+            "elapsed_s": elapsed,
+            "requests": total,
+            "throughput_rps": total / elapsed if elapsed else 0.0,
+            "endpoints": endpoints,
+        }
+
+
+async def drive(operations, concurrency):
+    """Run the zero-argument coroutine factories in ``operations`` with at most ``concurrency`` in flight."""
+    pending = iter(operations)
+
+    async def worker():
+        for operation in pending:
+            await operation()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return time.perf_counter() - started
+
+
+class Fixture:
+    """Users, avatars and conversations created before any workload is timed."""
+
+    def __init__(self, client, args):
+        self.client = client
+        self.args = args
+        self.users = []
+        self.admin_headers = None
+        self.conversation_ids = []
+        self.avatar_ids = []
+
+    async def setup(self, admin_username, admin_password):
+        response = await self.client.post(
+            "/api/auth/login", json={"username": admin_username, "password": admin_password}
+        )
+        response.raise_for_status()
+        self.admin_headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+        for index in range(self.args.users):
+            user = {"username": f"load-user-{index}", "password": f"load-password-{index}"}
+            (await self.client.post("/api/auth/register", json=user)).raise_for_status()
+            self.users.append(user)
+
+        for index in range(self.args.avatars):
+            response = await self.client.post("/api/avatars", headers=self.admin_headers, json={
+                "name": f"Load avatar {index}",
+                "personality": "Calm, thorough and a little dry",
+                "description": "Created by the load test",
+            })
+            response.raise_for_status()
+            self.avatar_ids.append(response.json()["id"])
+
+        for index in range(self.args.conversations):
+            response = await self.client.post("/api/conversations", json={
+                "avatar_id": self.avatar_ids[index % len(self.avatar_ids)],
+                "participant_name": f"participant-{index}",
+            })
+            response.raise_for_status()
+            conversation_id = response.json()["id"]
+            self.conversation_ids.append(conversation_id)
+            for turn in range(self.args.seed_messages):
+                (await self.client.post(
+                    f"/api/conversations/{conversation_id}/messages",
+                    json={"sender": "participant", "content": f"Seed message {turn}"},
+                )).raise_for_status()
+
+
+def login_storm(fixture, recorder, requests):
+    def login(user):
+        return lambda: recorder.call(
+            "POST /api/auth/login", lambda: fixture.client.post("/api/auth/login", json=user)
+        )
+    return [login(random.choice(fixture.users)) for _ in range(requests)]
+
+
+def message_burst(fixture, recorder, requests):
+    def send(conversation_id, index):
+        return lambda: recorder.call(
+            "POST /api/conversations/{conversation_id}/messages",
+            lambda: fixture.client.post(
+                f"/api/conversations/{conversation_id}/messages",
+                json={"sender": "participant", "content": f"Burst message {index}"},
+            ),
+        )
+    return [send(random.choice(fixture.conversation_ids), index) for index in range(requests)]
+
+
+def list_polling(fixture, recorder, requests):
+    # What an open dashboard fetches on every refresh
+    client, headers = fixture.client, fixture.admin_headers
+    polls = [
+        ("GET /api/avatars", lambda: client.get("/api/avatars", headers=headers)),
+        ("GET /api/conversations?view=summary", lambda: client.get("/api/conversations", params={"view": "summary"})),
+        ("GET /api/summaries", lambda: client.get("/api/summaries", headers=headers)),
+        (
+            "GET /api/conversations/{conversation_id}/messages",
+            lambda: client.get(
+                f"/api/conversations/{random.choice(fixture.conversation_ids)}/messages", params={"last": 20}
+            ),
+        ),
+    ]
+
+    def poll(label, send):
+        return lambda: recorder.call(label, send)
+    return [poll(*polls[index % len(polls)]) for index in range(requests)]
+
+
+def summary_generation(fixture, recorder, requests):
+    client = fixture.client
+
+    async def summarize(conversation_id):
+        started = time.perf_counter()
+        response = await recorder.call(
+            "POST /api/conversations/{conversation_id}/summary",
+            lambda: client.post(f"/api/conversations/{conversation_id}/summary"),
+            expected=(202,),
+        )
+        job = response.json()
+        while job.get("status") in ("queued", "running"):
+            await asyncio.sleep(0.005)
+            response = await recorder.call(
+                "GET /api/summary-jobs/{job_id}", lambda: client.get(f"/api/summary-jobs/{job['id']}")
+            )
+            job = response.json()
+        # Time from request to finished summary, as a participant waiting on it would see it
+        recorder.observe(
+            "summary job (end to end)", time.perf_counter() - started, job.get("status"), job.get("status") == "completed"
+        )
+
+    def one(conversation_id):
+        return lambda: summarize(conversation_id)
+    return [one(fixture.conversation_ids[index % len(fixture.conversation_ids)]) for index in range(requests)]
+
+
+WORKLOADS = {
+    "login_storm": login_storm,
+    "message_burst": message_burst,
+    "list_polling": list_polling,
+    "summary_generation": summary_generation,
+}
+
+
+def compare(current, baseline, threshold):
+    """Print per-endpoint changes against ``baseline``; return the regressions beyond ``threshold`` percent."""
+    regressions = []
+    for workload, result in current["workloads"].items():
+        previous = baseline.get("workloads", {}).get(workload)
+        if not previous:
+            print(f"{workload}: not in baseline")
+            continue
+        print(f"{workload}:")
+        for label, stats in result["endpoints"].items():
+            before = previous["endpoints"].get(label)
+            if not before:
+                print(f"  {label}: not in baseline")
+                continue
+            changes = []
+            for metric in COMPARED:
+                change = (stats[metric] - before[metric]) / before[metric] * 100 if before[metric] else 0.0
+                changes.append(f"{metric[:-3]} {before[metric]:.2f}->{stats[metric]:.2f}ms ({change:+.1f}%)")
+                if change > threshold:
+                    regressions.append(f"{workload} {label} {metric[:-3]} {change:+.1f}%")
+            before_rps, rps = before["throughput_rps"], stats["throughput_rps"]
+            change = (rps - before_rps) / before_rps * 100 if before_rps else 0.0
+            changes.append(f"rps {before_rps:.1f}->{rps:.1f} ({change:+.1f}%)")
+            if -change > threshold:
+                regressions.append(f"{workload} {label} throughput {change:+.1f}%")
+            print(f"  {label}: " + "  ".join(changes))
+    return regressions
+
+
+def print_result(workload, result):
+    print(f"{workload}: {result['requests']} requests in {result['elapsed_s']:.2f}s ({result['throughput_rps']:.1f} req/s)")
+    for label, stats in result["endpoints"].items():
+        print(
+            f"  {label:<52} n={stats['count']:<6} err={stats['errors']:<4} "
+            f"p50={stats['p50_ms']:8.2f}ms  p95={stats['p95_ms']:8.2f}ms  p99={stats['p99_ms']:8.2f}ms  "
+            f"{stats['throughput_rps']:8.1f} req/s"
+        )
+
+
+async def main(args):
+    if args.mongo_url:
+        mongo_harness.install_real(args.mongo_url)
+    else:
+        mongo_harness.install_fake(latency=args.latency_ms / 1000)
+    os.environ["DB_NAME"] = args.db_name
+    os.environ["BCRYPT_ROUNDS"] = str(args.bcrypt_rounds)
+    import httpx
+    import server
+
+    random.seed(args.seed)
+    await server.client.drop_database(args.db_name)
+    await server.startup_event()
+    try:
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://load-test") as client:
+            fixture = Fixture(client, args)
+            await fixture.setup(server.ADMIN_USERNAME, server.ADMIN_PASSWORD)
+
+            results = {}
+            for workload in args.workloads:
+                recorder = Recorder()
+                operations = WORKLOADS[workload](fixture, recorder, args.requests)
+                elapsed = await drive(operations, args.concurrency)
+                results[workload] = recorder.report(elapsed)
+                print_result(workload, results[workload])
+    finally:
+        await server.shutdown_db_client()
+
+    report = {
+        "meta": {
+            "created_at": datetime.utcnow().isoformat(),
+            "python": platform.python_version(),
+            "backend": args.mongo_url or f"in-memory fake, {args.latency_ms}ms per round trip",
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "users": args.users,
+            "avatars": args.avatars,
+            "conversations": args.conversations,
+            "seed_messages": args.seed_messages,
+            "bcrypt_rounds": args.bcrypt_rounds,
+        },
+        "workloads": results,
+    }
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+        print(f"Wrote {args.output}")
+    if args.compare:
+        regressions = compare(report, json.loads(Path(args.compare).read_text()), args.fail_on_regression or 0.0)
+        if args.fail_on_regression is not None and regressions:
+            print("Regressions:\n  " + "\n  ".join(regressions))
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--workloads", type=lambda value: value.split(","), default=list(WORKLOADS),
+        help=f"comma-separated subset of {', '.join(WORKLOADS)}",
+    )
+    parser.add_argument("--requests", type=int, default=500, help="operations per workload")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--avatars", type=int, default=5)
+    parser.add_argument("--conversations", type=int, default=50)
+    parser.add_argument("--seed-messages", type=int, default=10, help="messages added to each conversation up front")
+    parser.add_argument("--bcrypt-rounds", type=int, default=12, help="lower it to keep login storms short")
+    parser.add_argument("--latency-ms", type=float, default=1.0)
+    parser.add_argument("--mongo-url", default=None)
+    parser.add_argument("--db-name", default="zeny_ai_load")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results as JSON to this path")
+    parser.add_argument("--compare", help="baseline JSON from an earlier --output to compare against")
+    parser.add_argument(
+        "--fail-on-regression", type=float, default=None, metavar="PERCENT",
+        help="with --compare, exit 1 if any percentile grows or throughput drops by more than PERCENT",
+    )
+    args = parser.parse_args()
+    unknown = set(args.workloads) - set(WORKLOADS)
+    if unknown:
+        parser.error(f"unknown workloads: {', '.join(sorted(unknown))}")
+    asyncio.run(main(args))
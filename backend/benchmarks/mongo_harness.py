@@ -0,0 +1,157 @@
+"""Mongo backends for benchmarks, each counting round trips per collection and operation.
+
+``install_fake()`` wraps mongomock-motor so every awaited operation counts as one
+round trip and sleeps for a simulated network latency. The fake runs its queries
+in-process, so its own CPU time is charged to the event loop; keep concurrency
+modest or use ``install_real()`` against a local mongod for latency numbers.
+
+Call either one before importing ``server`` so its ``AsyncIOMotorClient`` is replaced.
+"""
+import asyncio
+from collections import Counter
+
+import motor.motor_asyncio
+from pymongo import monitoring
+
+# Collection methods that cost one round trip when awaited
+ROUND_TRIP_METHODS = {
+    "aggregate_raw", "bulk_write", "count_documents", "create_index", "create_indexes",
+    "delete_many", "delete_one", "distinct", "drop", "estimated_document_count",
+    "find_one", "find_one_and_delete", "find_one_and_replace", "find_one_and_update",
+    "insert_many", "insert_one", "replace_one", "update_many", "update_one",
+}
+
+
+class RoundTripRecorder:
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.counts = Counter()
+
+    async def trip(self, collection: str, operation: str):
+        self.counts[(collection, operation)] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    @property
+    def total(self) -> int:
+        return sum(self.counts.values())
+
+    def reset(self):
+        self.counts.clear()
+
+
+class LatencyCursor:
+    def __init__(self, cursor, recorder: RoundTripRecorder, collection: str, operation: str):
+        self._cursor = cursor
+        self._recorder = recorder
+        self._collection = collection
+        self._operation = operation
+        self._started = False
+
+    def __getattr__(self, name):
+        attribute = getattr(self._cursor, name)
+        if not callable(attribute):
+            return attribute
+
+        def chained(*args, **kwargs):
+            result = attribute(*args, **kwargs)
+            return self if result is self._cursor else result
+        return chained
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self._started:
+            self._started = True
+            await self._recorder.trip(self._collection, self._operation)
+        return await self._cursor.__anext__()
+
+    async def to_list(self, length=None):
+        await self._recorder.trip(self._collection, self._operation)
+        return await self._cursor.to_list(length)
+
+
+class LatencyCollection:
+    def __init__(self, collection, recorder: RoundTripRecorder):
+        self._collection = collection
+        self._recorder = recorder
+
+    def __getattr__(self, name):
+        attribute = getattr(self._collection, name)
+        if name in ("find", "aggregate"):
+            return lambda *args, **kwargs: LatencyCursor(
+                attribute(*args, **kwargs), self._recorder, self._collection.name, name
+            )
+        if name not in ROUND_TRIP_METHODS:
+            return attribute
+
+        async def round_trip(*args, **kwargs):
+            await self._recorder.trip(self._collection.name, name)
+            return await attribute(*args, **kwargs)
+        return round_trip
+
+
+class LatencyDatabase:
+    def __init__(self, database, recorder: RoundTripRecorder):
+        self._database = database
+        self._recorder = recorder
+
+    def __getitem__(self, name):
+        return LatencyCollection(self._database[name], self._recorder)
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    async def command(self, *args, **kwargs):
+        await self._recorder.trip("$cmd", "command")
+        return await self._database.command(*args, **kwargs)
+
+
+class LatencyClient:
+    def __init__(self, recorder: RoundTripRecorder):
+        from mongomock_motor import AsyncMongoMockClient
+
+        self._client = AsyncMongoMockClient()
+        self._recorder = recorder
+
+    def __getitem__(self, name):
+        return LatencyDatabase(self._client[name], self._recorder)
+
+    async def drop_database(self, name):
+        return await self._client.drop_database(name)
+
+    def close(self):
+        pass
+
+
+class CommandCounter(monitoring.CommandListener):
+    def __init__(self, recorder: RoundTripRecorder):
+        self._recorder = recorder
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        self._recorder.counts[(collection if isinstance(collection, str) else "$cmd", event.command_name)] += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def install_fake(latency: float = 0.0) -> RoundTripRecorder:
+    recorder = RoundTripRecorder(latency)
+    motor.motor_asyncio.AsyncIOMotorClient = lambda *args, **kwargs: LatencyClient(recorder)
+    return recorder
+
+
+def install_real(mongo_url: str) -> RoundTripRecorder:
+    recorder = RoundTripRecorder()
+    real_client = motor.motor_asyncio.AsyncIOMotorClient
+    motor.motor_asyncio.AsyncIOMotorClient = lambda *args, **kwargs: real_client(
+        mongo_url, event_listeners=[*kwargs.get("event_listeners", []), CommandCounter(recorder)]
+    )
+    return recorder
@@ -0,0 +1,175 @@
+import asyncio
+import base64
+import binascii
+import contextlib
+import hashlib
+import os
+import re
+import tempfile
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Optional, Tuple
+
+DATA_URL_PATTERN = re.compile(r"^data:(?P<type>[\w.+-]+/[\w.+-]+)?(?P<params>(;[^;,]*)*),", re.ASCII)
+DIGEST_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def parse_data_url(value: str) -> Optional[Tuple[bytes, str]]:
+    """Decode a base64 ``data:`` URL into (bytes, content type); None if ``value`` is not a data URL.
+
+    Raises ValueError when it is one but does not decode.
+    """
+    match = DATA_URL_PATTERN.match(value)
+    if match is None:
+        return None
+    if ";base64" not in match.group("params"):
+        raise ValueError("Only base64 data URLs are supported")
+    try:
+        data = base64.b64decode(value[match.end():], validate=True)
+    except binascii.Error as error:
+        raise ValueError(f"Invalid base64 data: {error}")
+    return data, match.group("type") or "application/octet-stream"
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """The inclusive (start, end) of a single ``Range: bytes=`` header; None means the whole blob.
+
+    Raises ValueError when the range cannot be satisfied. Multi-range requests are
+    answered with the whole blob, which the spec allows.
+    """
+    match = RANGE_PATTERN.match(header.strip())
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        start, end = max(0, size - int(last)), size - 1
+    else:
+        start, end = int(first), min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError(f"Range {header!r} not satisfiable for {size} bytes")
+    return start, end
+
+
+class BlobStore(ABC):
+    """Immutable blobs addressed by the SHA-256 of their content.
+
+    Storing the same bytes twice yields the same digest and one copy, and a
+    digest's content never changes, so readers may cache it forever.
+    """
+
+    @staticmethod
+    def digest(data: bytes) -> str:
+        return hashlib.sha256(data).hexdigest()
+
+    @abstractmethod
+    async def put(self, data: bytes, content_type: str) -> str:
+        """Store ``data`` unless its digest is already there; returns the digest."""
+
+    @abstractmethod
+    async def stat(self, digest: str) -> Optional[dict]:
+        """``{"size", "content_type"}`` of a stored blob, or None if there is none."""
+
+    @abstractmethod
+    async def read(self, digest: str, start: int = 0, end: Optional[int] = None) -> bytes:
+        """Bytes ``start`` to ``end`` inclusive (to the end when ``end`` is None)."""
+
+
+class LocalBlobStore(BlobStore):
+    """Blobs as files under ``root``, fanned out by the first two hex digits of the digest.
+
+    The content type sits next to each blob in a ``.type`` file. Writes go
+    to a temporary file that is renamed into place, so a reader never sees
+    a partial blob.
+    """
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+
+    def _path(self, digest: str) -> Path:
+        return self.root / digest[:2] / digest
+
+    def _put(self, digest: str, data: bytes, content_type: str):
+        path = self._path(digest)
+        if path.exists():
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        for target, content in ((path.with_suffix(".type"), content_type.encode()), (path, data)):
+            # One temporary per writer; racing puts of a digest hold the same bytes, so the last rename wins
+            descriptor, temporary = tempfile.mkstemp(dir=path.parent, prefix=f"{target.name}.", suffix=".tmp")
+            try:
+                with os.fdopen(descriptor, "wb") as file:
+                    file.write(content)
+                # mkstemp creates files readable by the owner only
+                os.chmod(temporary, 0o644)
+                os.replace(temporary, target)
+            except BaseException:
+                with contextlib.suppress(FileNotFoundError):
+                    os.unlink(temporary)
+                raise
+
+    async def put(self, data: bytes, content_type: str) -> str:
+        digest = self.digest(data)
+        await asyncio.to_thread(self._put, digest, data, content_type)
+        return digest
+
+    def _stat(self, digest: str) -> Optional[dict]:
+        path = self._path(digest)
+        try:
+            return {"size": path.stat().st_size, "content_type": path.with_suffix(".type").read_text()}
+        except FileNotFoundError:
+            return None
+
+    async def stat(self, digest: str) -> Optional[dict]:
+        return await asyncio.to_thread(self._stat, digest)
+
+    def _read(self, digest: str, start: int, end: Optional[int]) -> bytes:
+        with open(self._path(digest), "rb") as blob:
+            blob.seek(start)
+            return blob.read() if end is None else blob.read(end - start + 1)
+
+    async def read(self, digest: str, start: int = 0, end: Optional[int] = None) -> bytes:
+        return await asyncio.to_thread(self._read, digest, start, end)
+
+
+class S3BlobStore(BlobStore):
+    """Blobs as objects in an S3 bucket; ``endpoint_url`` points it at an S3-compatible server such as MinIO."""
+
+    def __init__(self, bucket: str, prefix: str = "blobs/", endpoint_url: Optional[str] = None):
+        import boto3
+        from botocore.exceptions import ClientError
+
+        self._client = boto3.client("s3", endpoint_url=endpoint_url)
+        self._missing = ClientError
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def _key(self, digest: str) -> str:
+        return f"{self.prefix}{digest}"
+
+    async def put(self, data: bytes, content_type: str) -> str:
+        digest = self.digest(data)
+        if await self.stat(digest) is None:
+            await asyncio.to_thread(
+                self._client.put_object, Bucket=self.bucket, Key=self._key(digest), Body=data, ContentType=content_type
+            )
+        return digest
+
+    async def stat(self, digest: str) -> Optional[dict]:
+        try:
+            head = await asyncio.to_thread(self._client.head_object, Bucket=self.bucket, Key=self._key(digest))
+        except self._missing as error:
+            if error.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+        return {"size": head["ContentLength"], "content_type": head.get("ContentType", "application/octet-stream")}
+
+    async def read(self, digest: str, start: int = 0, end: Optional[int] = None) -> bytes:
+        byte_range = f"bytes={start}-{'' if end is None else end}"
+        response = await asyncio.to_thread(
+            self._client.get_object, Bucket=self.bucket, Key=self._key(digest), Range=byte_range
+        )
+        return await asyncio.to_thread(response["Body"].read)
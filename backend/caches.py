@@ -0,0 +1,177 @@
+import asyncio
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+from pymongo import CursorType
+from pymongo.errors import CollectionInvalid, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+
+class TTLCache:
+    """Small in-process LRU cache whose entries also expire after a TTL."""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        value, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0:
+            return
+        self._entries[key] = (value, time.monotonic() + ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key: Hashable):
+        self._entries.pop(key, None)
+
+    def invalidate_where(self, predicate: Callable[[Hashable, Any], bool]):
+        stale = [key for key, (value, _) in self._entries.items() if predicate(key, value)]
+        for key in stale:
+            del self._entries[key]
+
+    def clear(self):
+        self._entries.clear()
+
+    def values(self) -> list:
+        # Unexpired values, without touching recency or hit counts
+        now = time.monotonic()
+        return [value for value, expires_at in self._entries.values() if expires_at > now]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+class LocalInvalidationChannel:
+    """In-process stand-in for a cross-worker channel: only this process hears invalidations."""
+
+    def __init__(self):
+        self._subscribers = []
+
+    def subscribe(self, callback: Callable[[Hashable], None]):
+        self._subscribers.append(callback)
+
+    def _deliver(self, key: Hashable):
+        for callback in self._subscribers:
+            callback(key)
+
+    async def publish(self, key: Hashable):
+        self._deliver(key)
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+
+class MongoInvalidationChannel(LocalInvalidationChannel):
+    """Broadcasts invalidations to every worker through a tailed capped collection."""
+
+    def __init__(self, db, collection_name: str = "cache_invalidations", size: int = 1024 * 1024):
+        super().__init__()
+        self._db = db
+        self._collection_name = collection_name
+        self._size = size
+        self._origin = uuid.uuid4().hex
+        self._task: Optional[asyncio.Task] = None
+
+    async def publish(self, key: Hashable):
+        self._deliver(key)
+        await self._db[self._collection_name].insert_one({"key": key, "origin": self._origin})
+
+    async def start(self):
+        try:
+            await self._db.create_collection(self._collection_name, capped=True, size=self._size)
+        except CollectionInvalid:
+            pass
+        # Tail from a fresh marker so invalidations from before startup are not replayed
+        marker = await self._db[self._collection_name].insert_one({"key": None, "origin": self._origin})
+        self._task = asyncio.create_task(self._tail(marker.inserted_id))
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def _tail(self, last_id):
+        collection = self._db[self._collection_name]
+        while True:
+            try:
+                cursor = collection.find({"_id": {"$gt": last_id}}, cursor_type=CursorType.TAILABLE_AWAIT)
+                while cursor.alive:
+                    async for entry in cursor:
+                        last_id = entry["_id"]
+                        if entry["origin"] != self._origin and entry["key"] is not None:
+                            self._deliver(entry["key"])
+                    await asyncio.sleep(0.1)
+            except PyMongoError:
+                logger.warning("Cache invalidation tail failed, retrying", exc_info=True)
+            await asyncio.sleep(1)
+
+
+class AvatarCache:
+    """Read-through cache of avatar documents, kept consistent by an invalidation channel."""
+
+    def __init__(self, collection, cache: TTLCache, channel: LocalInvalidationChannel):
+        self._collection = collection
+        self._cache = cache
+        self.channel = channel
+        # Bumped by every invalidation, so a read that overlapped one does not cache what it read
+        self._generation = 0
+        channel.subscribe(self._drop)
+
+    def _drop(self, avatar_id: Hashable):
+        self._generation += 1
+        self._cache.invalidate(avatar_id)
+
+    async def get(self, avatar_id: str) -> Optional[dict]:
+        avatar = self._cache.get(avatar_id)
+        if avatar is None:
+            generation = self._generation
+            avatar = await self._collection.find_one({"id": avatar_id}, {"_id": 0})
+            if avatar and generation == self._generation:
+                self._cache.set(avatar_id, avatar)
+        return avatar
+
+    async def invalidate(self, avatar_id: str):
+        await self.channel.publish(avatar_id)
+
+    def stats(self) -> dict:
+        return {**self._cache.stats(), "channel": type(self.channel).__name__}
@@ -0,0 +1,51 @@
+import zlib
+from typing import AsyncIterator, Awaitable, Callable, List, Optional, Sequence
+
+import orjson
+
+from pagination import encode_cursor
+
+MEDIA_TYPE = "application/x-ndjson"
+
+# Every exported line carries the token that resumes the export right after it
+CURSOR_FIELD = "_cursor"
+
+
+async def ndjson_batches(
+    cursor,
+    sort_fields: Sequence[str],
+    expand: Optional[Callable[[List[dict]], Awaitable[List[dict]]]] = None,
+    batch_size: int = 100,
+) -> AsyncIterator[bytes]:
+    """Encode documents from a Motor cursor as NDJSON, one chunk per ``batch_size`` documents.
+
+    Only one batch is held at a time. ``expand`` may add data to a whole
+    batch at once, such as each conversation's messages, so that costs one
+    query per batch instead of one per document.
+    """
+    batch = []
+    async for document in cursor:
+        batch.append(document)
+        if len(batch) == batch_size:
+            yield await _encode(batch, sort_fields, expand)
+            batch = []
+    if batch:
+        yield await _encode(batch, sort_fields, expand)
+
+
+async def _encode(batch: List[dict], sort_fields: Sequence[str], expand) -> bytes:
+    if expand is not None:
+        batch = await expand(batch)
+    lines = []
+    for document in batch:
+        document[CURSOR_FIELD] = encode_cursor([document[field] for field in sort_fields])
+        lines.append(orjson.dumps(document))
+    return b"\n".join(lines) + b"\n"
+
+
+async def gzip_chunks(chunks: AsyncIterator[bytes], level: int = 6) -> AsyncIterator[bytes]:
+    """Gzip a byte stream incrementally, sync-flushing per chunk so the client sees steady progress."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    async for chunk in chunks:
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
@@ -0,0 +1,136 @@
+import logging
+
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel
+
+logger = logging.getLogger(__name__)
+
+
+# Indexes every collection needs, keyed by collection name. Names are fixed so
+# create_indexes stays idempotent across restarts.
+INDEXES = {
+    "users": [
+        IndexModel([("username", ASCENDING)], name="username_unique", unique=True),
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+    ],
+    "avatars": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel(
+            [("owner_id", ASCENDING), ("is_active", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)],
+            name="owner_active_created",
+        ),
+    ],
+    "conversations": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("avatar_id", ASCENDING), ("started_at", ASCENDING), ("id", ASCENDING)], name="avatar_started"),
+        IndexModel([("started_at", ASCENDING), ("id", ASCENDING)], name="started"),
+        IndexModel([("status", ASCENDING), ("archived_at", ASCENDING), ("ended_at", ASCENDING)], name="status_archived_ended"),
+    ],
+    "summaries": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("conversation_id", ASCENDING)], name="conversation_unique", unique=True),
+        IndexModel(
+            [("avatar_id", ASCENDING), ("generated_at", DESCENDING), ("id", DESCENDING)],
+            name="avatar_generated",
+        ),
+        IndexModel(
+            [("owner_id", ASCENDING), ("generated_at", DESCENDING), ("id", DESCENDING)],
+            name="owner_generated",
+        ),
+        # Full-text search, one avatar at a time (text queries need equality on avatar_id)
+        IndexModel(
+            [("avatar_id", ASCENDING), ("summary_text", TEXT), ("key_points", TEXT)],
+            name="avatar_text",
+            weights={"summary_text": 1, "key_points": 2},
+        ),
+    ],
+    "message_buckets": [
+        IndexModel([("conversation_id", ASCENDING), ("bucket", ASCENDING)], name="conversation_bucket", unique=True),
+        IndexModel([("avatar_id", ASCENDING), ("messages.content", TEXT)], name="avatar_text"),
+    ],
+    "summary_jobs": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        # Holds the conversation id while a job is live, so at most one per conversation
+        IndexModel([("dedupe_key", ASCENDING)], name="dedupe_key_unique", unique=True),
+        IndexModel([("status", ASCENDING), ("started_at", ASCENDING)], name="status_started"),
+    ],
+    "conversation_archive": [
+        IndexModel([("conversation_id", ASCENDING)], name="conversation_unique", unique=True),
+    ],
+    "analytics_rollups": [
+        # Rollup upserts match on the full key; range reads scan one avatar and granularity
+        IndexModel(
+            [("avatar_id", ASCENDING), ("granularity", ASCENDING), ("period_start", ASCENDING)],
+            name="avatar_granularity_period",
+            unique=True,
+        ),
+    ],
+    "status_checks": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("timestamp", ASCENDING), ("id", ASCENDING)], name="timestamp"),
+    ],
+}
+
+# Filtered query shapes issued by server.py, with placeholder values; range
+# filters stand in for keyset pagination. Each one must be answered from an index.
+QUERY_SHAPES = [
+    ("users", {"username": "x"}, None),
+    ("avatars", {"id": "x"}, None),
+    ("avatars", {"id": "x", "owner_id": "x"}, None),
+    ("avatars", {"id": "x", "is_active": True}, None),
+    ("avatars", {"owner_id": "x"}, None),
+    ("avatars", {"is_active": True, "owner_id": "x"}, {"created_at": 1, "id": 1}),
+    ("conversations", {"id": "x"}, None),
+    ("conversations", {"avatar_id": "x"}, {"started_at": 1, "id": 1}),
+    ("conversations", {"started_at": {"$gt": 0}}, {"started_at": 1, "id": 1}),
+    ("conversations", {"avatar_id": {"$in": ["x", "y"]}, "status": "ended"}, {"started_at": 1, "id": 1}),
+    ("conversations", {"status": "ended", "archived_at": None, "ended_at": {"$lt": 0}}, {"ended_at": 1}),
+    ("conversation_archive", {"conversation_id": {"$in": ["x", "y"]}}, None),
+    ("message_buckets", {"conversation_id": "x"}, {"bucket": 1}),
+    ("message_buckets", {"conversation_id": "x", "last_at": {"$gt": 0}}, {"bucket": -1}),
+    ("message_buckets", {"conversation_id": "x", "bucket": {"$gte": 0}}, {"bucket": 1}),
+    ("message_buckets", {"conversation_id": {"$in": ["x", "y"]}}, {"conversation_id": 1, "bucket": 1}),
+    ("message_buckets", {"avatar_id": "x", "$text": {"$search": "x"}}, None),
+    ("summaries", {"id": "x"}, None),
+    ("summaries", {"conversation_id": "x"}, None),
+    ("summaries", {"avatar_id": "x"}, {"generated_at": -1, "id": -1}),
+    ("summaries", {"owner_id": "x"}, {"generated_at": -1, "id": -1}),
+    ("summaries", {"owner_id": "x", "generated_at": {"$gte": 0, "$lt": 1}}, {"generated_at": -1, "id": -1}),
+    ("summaries", {"owner_id": None}, None),
+    ("summaries", {"owner_id": "x", "generated_at": {"$gte": 0}}, {"generated_at": 1, "id": 1}),
+    ("summaries", {"avatar_id": "x", "$text": {"$search": "x"}}, None),
+    ("summary_jobs", {"id": "x"}, None),
+    ("summary_jobs", {"dedupe_key": "x"}, None),
+    ("summary_jobs", {"status": "running", "started_at": {"$lt": 0}}, None),
+    ("analytics_rollups", {"avatar_id": "x", "granularity": "day", "period_start": 0}, None),
+    ("analytics_rollups", {"avatar_id": {"$in": ["x", "y"]}, "granularity": "day", "period_start": {"$gte": 0, "$lt": 1}}, None),
+    ("status_checks", {"timestamp": {"$gt": 0}}, {"timestamp": 1, "id": 1}),
+]
+
+
+async def ensure_indexes(db):
+    for collection, models in INDEXES.items():
+        await db[collection].create_indexes(models)
+    logger.info("Ensured indexes on %d collections", len(INDEXES))
+
+
+def _plan_stages(plan: dict):
+    yield plan.get("stage")
+    for child in plan.get("inputStages", []) + [plan[key] for key in ("inputStage", "queryPlan") if key in plan]:
+        yield from _plan_stages(child)
+
+
+async def verify_query_plans(db):
+    """Explain every entry in QUERY_SHAPES and fail if any falls back to a COLLSCAN."""
+    offenders = []
+    for collection, query_filter, sort in QUERY_SHAPES:
+        find = {"find": collection, "filter": query_filter}
+        if sort:
+            find["sort"] = sort
+        explained = await db.command({"explain": find, "verbosity": "queryPlanner"})
+        stages = set(_plan_stages(explained["queryPlanner"]["winningPlan"]))
+        if "COLLSCAN" in stages:
+            offenders.append(f"{collection} {query_filter} sort={sort}")
+
+    if offenders:
+        raise RuntimeError("Queries without index support: " + "; ".join(offenders))
+    logger.info("Verified index usage for %d query shapes", len(QUERY_SHAPES))
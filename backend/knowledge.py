@@ -0,0 +1,189 @@
+import asyncio
+import hashlib
+import logging
+import re
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from caches import TTLCache
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9']+")
+SENTENCE_PATTERN = re.compile(r"(?<=[.!?])\s+|\n{2,}")
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def chunk_text(text: str, max_words: int = 80, overlap: int = 20) -> List[str]:
+    """Split text into chunks of whole sentences, about ``max_words`` long and overlapping by ``overlap`` words."""
+    chunks = []
+    current: List[str] = []
+    for sentence in SENTENCE_PATTERN.split(text or ""):
+        words = sentence.split()
+        if not words:
+            continue
+        if current and len(current) + len(words) > max_words:
+            chunks.append(" ".join(current))
+            current = current[-overlap:] if overlap else []
+        current.extend(words)
+        # A single sentence longer than a chunk is cut into windows
+        while len(current) > max_words:
+            chunks.append(" ".join(current[:max_words]))
+            current = current[max_words - overlap:] if overlap else current[max_words:]
+    if current:
+        chunks.append(" ".join(current))
+    return chunks
+
+
+class KnowledgeIndex:
+    """Hashed TF-IDF vectors for one avatar's knowledge base chunks.
+
+    Terms are hashed into ``features`` columns, so the index needs no
+    vocabulary. A chunk touches only a few dozen of them, so rows are kept
+    sparse in CSR form: chunk ``i`` owns ``indices[indptr[i]:indptr[i + 1]]``
+    and the matching unit-normalised ``weights``. The raw term ``counts``
+    ride alongside, so a rebuild only tokenizes chunks it has not seen
+    before and then recomputes the IDF weights.
+    """
+
+    def __init__(self, chunks: List[str], rows: List[Tuple[np.ndarray, np.ndarray]], features: int):
+        self.chunks = chunks
+        self.features = features
+        self.indptr = np.zeros(len(chunks) + 1, dtype=np.int64)
+        np.cumsum([len(columns) for columns, _ in rows], out=self.indptr[1:])
+        self.indices = np.concatenate([columns for columns, _ in rows]).astype(np.int32) if rows else np.empty(0, dtype=np.int32)
+        self.counts = np.concatenate([counts for _, counts in rows]) if rows else np.empty(0, dtype=np.float32)
+        self._row_ids = np.repeat(np.arange(len(chunks), dtype=np.int32), np.diff(self.indptr))
+
+        document_frequency = np.bincount(self.indices, minlength=features)
+        self.idf = (np.log((1 + len(chunks)) / (1 + document_frequency)) + 1).astype(np.float32)
+        weights = np.log1p(self.counts) * self.idf[self.indices]
+        norms = np.sqrt(np.bincount(self._row_ids, weights=weights * weights, minlength=len(chunks)))
+        self.weights = (weights / np.where(norms == 0, 1, norms)[self._row_ids]).astype(np.float32)
+
+    def _rows(self) -> List[Tuple[np.ndarray, np.ndarray]]:
+        return [
+            (self.indices[start:end], self.counts[start:end])
+            for start, end in zip(self.indptr[:-1], self.indptr[1:])
+        ]
+
+    @staticmethod
+    def _count(text: str, features: int) -> Tuple[np.ndarray, np.ndarray]:
+        columns = np.fromiter((zlib.crc32(token.encode()) % features for token in tokenize(text)), dtype=np.int64)
+        columns, counts = np.unique(columns, return_counts=True)
+        return columns, counts.astype(np.float32)
+
+    @classmethod
+    def build(cls, text: str, features: int = 2048, previous: Optional["KnowledgeIndex"] = None, **chunking) -> "KnowledgeIndex":
+        chunks = chunk_text(text, **chunking)
+        reusable = {}
+        if previous is not None and previous.features == features:
+            reusable = dict(zip(previous.chunks, previous._rows()))
+        rows = [reusable.get(chunk) or cls._count(chunk, features) for chunk in chunks]
+        return cls(chunks, rows, features)
+
+    def search(self, query: str, k: int = 3) -> List[Tuple[str, float]]:
+        """Return up to ``k`` (chunk, cosine similarity) pairs, best first, skipping chunks with no overlap."""
+        if not self.chunks:
+            return []
+        columns, counts = self._count(query, self.features)
+        vector = np.zeros(self.features, dtype=np.float32)
+        vector[columns] = np.log1p(counts) * self.idf[columns]
+        norm = np.linalg.norm(vector)
+        if norm == 0:
+            return []
+        scores = np.bincount(self._row_ids, weights=self.weights * vector[self.indices], minlength=len(self.chunks)) / norm
+        k = min(k, len(self.chunks))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.chunks[index], float(scores[index])) for index in top if scores[index] > 0]
+
+    @property
+    def nbytes(self) -> int:
+        return sum(array.nbytes for array in (self.indptr, self.indices, self.counts, self.weights, self._row_ids, self.idf))
+
+
+class KnowledgeBase:
+    """Per-avatar retrieval indexes, held in an LRU and rebuilt when ``knowledge_base`` changes.
+
+    Indexes are keyed by avatar id and tagged with a digest of the text they
+    were built from, so a stale index (for instance one built before another
+    worker updated the avatar) is noticed on the next search and rebuilt
+    incrementally from the old one, off the event loop.
+    """
+
+    def __init__(self, cache: TTLCache, features: int = 2048, max_words: int = 80, overlap: int = 20):
+        self._cache = cache
+        self.features = features
+        self.chunking = {"max_words": max_words, "overlap": overlap}
+        self.builds = 0
+        self._refreshing: Dict[str, asyncio.Task] = {}
+
+    @staticmethod
+    def _digest(text: str) -> str:
+        return hashlib.sha1(text.encode()).hexdigest()
+
+    def _stale(self, avatar: dict) -> Tuple[Optional[str], Optional[Tuple[str, KnowledgeIndex]]]:
+        # Returns the digest to build for (None if the cached index is current) and the cached entry
+        text = avatar.get("knowledge_base") or ""
+        cached = self._cache.get(avatar["id"])
+        if not text.strip():
+            self._cache.invalidate(avatar["id"])
+            return None, None
+        digest = self._digest(text)
+        return (None if cached is not None and cached[0] == digest else digest), cached
+
+    def _build(self, avatar: dict, previous: Optional[Tuple[str, KnowledgeIndex]]) -> KnowledgeIndex:
+        return KnowledgeIndex.build(
+            avatar["knowledge_base"], self.features, previous=previous[1] if previous else None, **self.chunking
+        )
+
+    def _store(self, avatar_id: str, digest: str, index: KnowledgeIndex):
+        self.builds += 1
+        self._cache.set(avatar_id, (digest, index))
+
+    async def refresh(self, avatar: dict):
+        """Build the avatar's index now, off the event loop, rather than on its next message."""
+        digest, cached = self._stale(avatar)
+        if digest is not None:
+            self._store(avatar["id"], digest, await asyncio.to_thread(self._build, avatar, cached))
+
+    async def _refresh_in_background(self, avatar: dict):
+        try:
+            await self.refresh(avatar)
+        except Exception:
+            logger.exception("Building the knowledge index of avatar %s failed", avatar["id"])
+        finally:
+            self._refreshing.pop(avatar["id"], None)
+
+    def _refresh_later(self, avatar: dict):
+        # One background build per avatar at a time
+        if avatar["id"] not in self._refreshing:
+            self._refreshing[avatar["id"]] = asyncio.create_task(self._refresh_in_background(avatar))
+
+    def search(self, avatar: dict, query: str, k: int = 3) -> List[str]:
+        """Best-matching chunks of the avatar's knowledge base, best first.
+
+        Never builds on the event loop: a missing or outdated index is
+        rebuilt in the background, and until it is ready the search answers
+        from the outdated index, or with no context when there is none.
+        """
+        digest, cached = self._stale(avatar)
+        if digest is not None:
+            self._refresh_later(avatar)
+        if cached is None:
+            return []
+        return [chunk for chunk, _ in cached[1].search(query, k)]
+
+    def stats(self) -> dict:
+        return {
+            **self._cache.stats(),
+            "builds": self.builds,
+            "refreshing": len(self._refreshing),
+            "bytes": sum(index.nbytes for _, index in self._cache.values()),
+        }
@@ -0,0 +1,505 @@
+import asyncio
+import logging
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from caches import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Characters of the newest message kept on the conversation for list views
+PREVIEW_LENGTH = 100
+
+
+def _last_message_fields(message: dict) -> dict:
+    return {
+        "last_message_at": message["timestamp"],
+        "last_message_preview": message["content"][:PREVIEW_LENGTH],
+    }
+
+
+def select_messages(messages: List[dict], last: Optional[int] = None, since: Optional[datetime] = None) -> List[dict]:
+    """Narrow ordered messages to those after ``since``, then to the last ``last`` of them."""
+    if since is not None:
+        messages = [message for message in messages if message["timestamp"] > since]
+    if last is not None:
+        messages = messages[-last:] if last else []
+    return messages
+
+
+def bucket_messages(bucket: dict) -> List[dict]:
+    """A bucket's messages, each with its ``seq``: the bucket's ``start`` plus its position in the bucket."""
+    return [dict(message, seq=bucket["start"] + position) for position, message in enumerate(bucket["messages"])]
+
+
+class MessageStore:
+    """Conversation messages kept in bounded bucket documents.
+
+    Each bucket of the ``message_buckets`` collection holds at most
+    ``bucket_size`` consecutive messages of one conversation, from sequence
+    number ``start`` on; a message's ``seq`` is its bucket's ``start`` plus
+    its position, so the bucket write that stores messages is also the one
+    that numbers them and a failed write can leave no gap. Only the newest
+    bucket takes appends; once an append does not fit it is ``sealed``, which
+    fixes its count and so the ``start`` of the next one. No single document
+    grows without bound and history reads only touch the buckets they need.
+    The conversation carries its ``message_count`` and the newest message's
+    time and preview so listings never read buckets. Those are not part of
+    the append: they are collected per conversation and written ``delay``
+    seconds later in one ``bulk_write``, with ``$max`` so a retried or
+    reordered write never moves them back. ``flush`` writes them early for
+    readers that need them current. Buckets carry the conversation's
+    ``avatar_id`` so they can be searched per avatar.
+
+    ``on_append(conversation, messages)`` runs alongside each bucket write,
+    for bookkeeping that should not add a round trip to every message.
+    ``after_append(conversation)`` runs once the conversation document
+    reflects its appended messages, once per conversation and flush.
+
+    An append is then a single round trip: ``resolve`` (conversation id to
+    avatar id, typically cached) stands in for reading the conversation,
+    and ``heads`` remembers each conversation's newest bucket and how many
+    messages this worker last saw in it. An ``update_one`` that expects
+    that count numbers the messages without reading anything back; when
+    another worker has appended in between, the append falls back to a
+    ``find_one_and_update`` that returns the count, one more round trip.
+    """
+
+    def __init__(self, db, bucket_size: int = 100, on_append: Optional[Callable[[dict, List[dict]], Awaitable]] = None,
+                 after_append: Optional[Callable[[dict], Awaitable]] = None,
+                 resolve: Optional[Callable[[str], Awaitable[Optional[str]]]] = None, heads: Optional[TTLCache] = None,
+                 delay: float = 0.05):
+        self.conversations = db.conversations
+        self.buckets = db.message_buckets
+        self.bucket_size = bucket_size
+        self.on_append = on_append
+        self.after_append = after_append
+        self._resolve = resolve
+        self.heads = heads
+        self.delay = delay
+        # Per conversation not yet updated: (conversation, message_count, newest message fields)
+        self._latest: Dict[str, Tuple[dict, int, dict]] = {}
+        self._timer: Optional[asyncio.Task] = None
+
+    async def append(self, conversation_id: str, messages: List[dict]) -> Optional[dict]:
+        """Append messages in order, or return None if the conversation does not exist.
+
+        Returns ``{"id", "avatar_id", "seqs"}`` with the sequence number each
+        message got; messages that fit one bucket get consecutive ones.
+        """
+        if self._resolve is None:
+            conversation = await self.conversations.find_one({"id": conversation_id}, {"_id": 0, "id": 1, "avatar_id": 1})
+        else:
+            avatar_id = await self._resolve(conversation_id)
+            conversation = {"id": conversation_id, "avatar_id": avatar_id} if avatar_id is not None else None
+        if conversation is None:
+            return None
+        if self.on_append is None:
+            seqs = await self._push_all(conversation, messages)
+        else:
+            seqs, _ = await asyncio.gather(self._push_all(conversation, messages), self.on_append(conversation, messages))
+        latest = self._latest.get(conversation_id)
+        if latest is None or latest[1] <= seqs[-1]:
+            self._latest[conversation_id] = (conversation, seqs[-1] + 1, _last_message_fields(messages[-1]))
+        if self._timer is None:
+            self._timer = asyncio.create_task(self._flush_later())
+        return {"id": conversation_id, "avatar_id": conversation["avatar_id"], "seqs": seqs}
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.delay)
+        self._timer = None
+        await self.flush()
+
+    async def flush(self, conversation_ids: Optional[List[str]] = None):
+        """Bring the conversations' ``message_count`` and newest message fields up to date; with ``conversation_ids``, only those."""
+        if conversation_ids is None:
+            latest, self._latest = self._latest, {}
+        else:
+            latest = {
+                conversation_id: self._latest.pop(conversation_id)
+                for conversation_id in dict.fromkeys(conversation_ids) if conversation_id in self._latest
+            }
+        if not latest:
+            return
+        try:
+            await self.conversations.bulk_write([
+                UpdateOne(
+                    {"id": conversation_id},
+                    {"$max": {"message_count": message_count, "last_message_at": fields["last_message_at"]},
+                     "$set": {"last_message_preview": fields["last_message_preview"]}},
+                )
+                for conversation_id, (_, message_count, fields) in latest.items()
+            ], ordered=False)
+        except Exception:
+            # Retried with the next flush unless an append has already queued a newer count
+            for conversation_id, entry in latest.items():
+                if conversation_id not in self._latest:
+                    self._latest[conversation_id] = entry
+            logger.exception("Updating %d conversations after their appends failed", len(latest))
+            return
+        if self.after_append is not None:
+            await asyncio.gather(*(self.after_append(conversation) for conversation, _, _ in latest.values()))
+
+    def pending(self, avatar_id: str) -> List[str]:
+        """Conversations of ``avatar_id`` whose documents do not reflect their latest appends yet."""
+        return [conversation_id for conversation_id, (conversation, _, _) in self._latest.items() if conversation["avatar_id"] == avatar_id]
+
+    async def drain(self):
+        """Write the conversation counts ``delay`` is holding back; ``WriteBehindBuffer.drain`` calls this last."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        await self.flush()
+
+    async def append_many(self, messages_by_conversation: Dict[str, List[dict]]) -> Dict[str, Optional[dict]]:
+        """``append`` to many conversations at once; the conversations are written concurrently."""
+        conversation_ids = list(messages_by_conversation)
+        appended = await asyncio.gather(
+            *(self.append(conversation_id, messages_by_conversation[conversation_id]) for conversation_id in conversation_ids)
+        )
+        return dict(zip(conversation_ids, appended))
+
+    async def _push_all(self, conversation: dict, messages: List[dict]) -> List[int]:
+        seqs = []
+        for offset in range(0, len(messages), self.bucket_size):
+            chunk = messages[offset:offset + self.bucket_size]
+            first = await self._push(conversation, chunk)
+            seqs.extend(range(first, first + len(chunk)))
+        return seqs
+
+    async def _head(self, conversation_id: str) -> Tuple[int, int]:
+        # The newest bucket and its start; the next one to open if the conversation has none
+        newest = await self.buckets.find_one(
+            {"conversation_id": conversation_id}, {"_id": 0, "bucket": 1, "start": 1}, sort=[("bucket", -1)]
+        )
+        if newest is not None:
+            return newest["bucket"], newest["start"]
+        # None yet, or all archived before archiving kept the newest one: carry on after message_count.
+        # Opening bucket ceil(count / size) keeps every start at or below bucket * bucket_size
+        conversation = await self.conversations.find_one({"id": conversation_id}, {"_id": 0, "message_count": 1})
+        count = conversation.get("message_count", 0) if conversation else 0
+        return -(-count // self.bucket_size), count
+
+    def _push_update(self, conversation: dict, messages: List[dict], start: int) -> dict:
+        return {
+            "$push": {"messages": {"$each": messages}},
+            "$inc": {"count": len(messages)},
+            "$min": {"first_at": min(message["timestamp"] for message in messages)},
+            "$max": {"last_at": max(message["timestamp"] for message in messages)},
+            "$setOnInsert": {"avatar_id": conversation["avatar_id"], "start": start},
+        }
+
+    async def _push(self, conversation: dict, messages: List[dict]) -> int:
+        """Push up to ``bucket_size`` messages into one bucket; returns the ``seq`` of the first."""
+        conversation_id = conversation["id"]
+        head = self.heads.get(conversation_id) if self.heads is not None else None
+        if head is not None:
+            bucket, start, count = head
+            if count + len(messages) <= self.bucket_size:
+                # Matches only if no one has appended since this worker did, and then the seqs follow from count
+                result = await self.buckets.update_one(
+                    {"conversation_id": conversation_id, "bucket": bucket, "sealed": {"$ne": True}, "count": count},
+                    self._push_update(conversation, messages, start),
+                )
+                if result.modified_count:
+                    self.heads.set(conversation_id, (bucket, start, count + len(messages)))
+                    return start + count
+        else:
+            bucket, start = await self._head(conversation_id)
+
+        room = self.bucket_size - len(messages)
+        while True:
+            try:
+                document = await self.buckets.find_one_and_update(
+                    {"conversation_id": conversation_id, "bucket": bucket, "sealed": {"$ne": True}, "count": {"$lte": room}},
+                    self._push_update(conversation, messages, start),
+                    # _id stays in, so the document is found again by it once count has moved past the filter
+                    projection={"start": 1, "count": 1},
+                    upsert=True,
+                    return_document=ReturnDocument.AFTER,
+                )
+            except DuplicateKeyError:
+                # The bucket exists but is sealed or lacks room: seal it, which makes its count final, and open the next
+                full = await self.buckets.find_one_and_update(
+                    {
+                        "conversation_id": conversation_id,
+                        "bucket": bucket,
+                        "$or": [{"sealed": True}, {"count": {"$gt": room}}],
+                    },
+                    {"$set": {"sealed": True}},
+                    projection={"_id": 0, "start": 1, "count": 1},
+                )
+                if full is None:
+                    # Opened by a concurrent append with room to spare, or archived; look again
+                    bucket, start = await self._head(conversation_id)
+                else:
+                    bucket, start = bucket + 1, full["start"] + full["count"]
+                continue
+            if self.heads is not None:
+                self.heads.set(conversation_id, (bucket, document["start"], document["count"]))
+            return document["start"] + document["count"] - len(messages)
+
+    async def read(self, conversation_id: str, last: Optional[int] = None, since: Optional[datetime] = None) -> List[dict]:
+        """Return messages in order, optionally only the last N and/or those after ``since``."""
+        query = {"conversation_id": conversation_id}
+        if since is not None:
+            query["last_at"] = {"$gt": since}
+
+        if last is None:
+            messages = []
+            async for bucket in self.buckets.find(query, {"_id": 0, "start": 1, "messages": 1}).sort("bucket", 1):
+                messages.extend(bucket_messages(bucket))
+        else:
+            # Walk buckets newest first and stop once enough messages are collected
+            chunks = []
+            collected = 0
+            async for bucket in self.buckets.find(query, {"_id": 0, "start": 1, "messages": 1}).sort("bucket", -1):
+                chunks.append(bucket_messages(bucket))
+                collected += len(bucket["messages"])
+                if since is None and collected >= last:
+                    break
+            messages = [message for chunk in reversed(chunks) for message in chunk]
+
+        return select_messages(messages, last, since)
+
+    async def read_from(self, conversation_id: str, seq: int) -> List[dict]:
+        """Return messages with sequence number ``seq`` onwards, reading only the buckets that hold them."""
+        messages = []
+        # A bucket starts at or below bucket * bucket_size and holds at most bucket_size messages,
+        # so seq is in bucket seq // bucket_size or a later one
+        query = {"conversation_id": conversation_id, "bucket": {"$gte": seq // self.bucket_size}}
+        async for bucket in self.buckets.find(query, {"_id": 0, "start": 1, "messages": 1}).sort("bucket", 1):
+            messages.extend(message for message in bucket_messages(bucket) if message["seq"] >= seq)
+        return messages
+
+    async def read_many(self, conversation_ids: List[str]) -> Dict[str, List[dict]]:
+        messages = {conversation_id: [] for conversation_id in conversation_ids}
+        cursor = self.buckets.find(
+            {"conversation_id": {"$in": conversation_ids}}, {"_id": 0, "conversation_id": 1, "start": 1, "messages": 1}
+        ).sort(
+            [("conversation_id", 1), ("bucket", 1)]
+        )
+        async for bucket in cursor:
+            messages[bucket["conversation_id"]].extend(bucket_messages(bucket))
+        return messages
+
+    async def migrate_embedded(self):
+        """Move legacy ``conversations.messages`` arrays into buckets. Safe to re-run."""
+        migrated = 0
+        async for conversation in self.conversations.find({"message_count": {"$exists": False}}, {"id": 1, "avatar_id": 1, "messages": 1}):
+            embedded = conversation.get("messages", [])
+            for bucket, start in enumerate(range(0, len(embedded), self.bucket_size)):
+                chunk = embedded[start:start + self.bucket_size]
+                await self.buckets.update_one(
+                    {"conversation_id": conversation["id"], "bucket": bucket},
+                    {"$set": {
+                        "avatar_id": conversation["avatar_id"],
+                        "start": start,
+                        "messages": chunk,
+                        "count": len(chunk),
+                        # Only the newest bucket takes appends
+                        "sealed": start + self.bucket_size < len(embedded),
+                        "first_at": chunk[0]["timestamp"],
+                        "last_at": chunk[-1]["timestamp"],
+                    }},
+                    upsert=True,
+                )
+            denormalized = {"message_count": len(embedded)}
+            if embedded:
+                denormalized.update(_last_message_fields(embedded[-1]))
+            await self.conversations.update_one(
+                {"_id": conversation["_id"]},
+                {"$set": denormalized, "$unset": {"messages": ""}},
+            )
+            migrated += 1
+        if migrated:
+            logger.info("Moved embedded messages of %d conversations into buckets", migrated)
+
+    async def backfill_avatar_ids(self):
+        """Copy ``avatar_id`` onto buckets written before buckets carried it. Safe to re-run."""
+        backfilled = 0
+        for conversation_id in await self.buckets.distinct("conversation_id", {"avatar_id": None}):
+            conversation = await self.conversations.find_one({"id": conversation_id}, {"_id": 0, "avatar_id": 1})
+            if conversation:
+                await self.buckets.update_many(
+                    {"conversation_id": conversation_id, "avatar_id": None},
+                    {"$set": {"avatar_id": conversation["avatar_id"]}},
+                )
+                backfilled += 1
+        if backfilled:
+            logger.info("Backfilled avatar_id on the buckets of %d conversations", backfilled)
+
+    async def backfill_starts(self):
+        """Set ``start`` on buckets written when bucket ``n`` always began at ``seq`` n * bucket_size. Safe to re-run.
+
+        Their messages carry a stored ``seq``, which ``bucket_messages`` now
+        derives from ``start`` instead.
+        """
+        buckets = await self.buckets.distinct("bucket", {"start": {"$exists": False}})
+        for bucket in buckets:
+            await self.buckets.update_many(
+                {"bucket": bucket, "start": {"$exists": False}}, {"$set": {"start": bucket * self.bucket_size}}
+            )
+        if buckets:
+            logger.info("Backfilled start on buckets numbered up to %d", max(buckets))
+
+
+class WriteBehindBuffer:
+    """Coalesces appends from many requests into batched ``MessageStore.append_many`` calls.
+
+    Messages wait in memory per conversation until ``max_messages`` are
+    pending or the oldest has waited ``max_delay`` seconds. Every waiting
+    conversation is then written concurrently, each with one ``$push $each``
+    of all its waiting messages. Flushes
+    run one at a time, so a conversation's messages keep their order across
+    batches. A read that must see a conversation's latest messages flushes
+    just that conversation first.
+
+    With ``durability="ack"`` an append returns once its batch is written,
+    trading up to ``max_delay`` of latency for fewer writes. With ``"async"``
+    it returns as soon as the messages are buffered: anything not yet flushed
+    is lost if the process dies, and other workers only see the messages
+    after the flush. In that mode ``resolve`` (conversation id to avatar id)
+    stands in for the existence check the write would have done, and the
+    conversation returned only carries ``id`` and ``avatar_id``, not ``seqs``.
+    """
+
+    def __init__(self, store: MessageStore, max_messages: int = 100, max_delay: float = 0.02,
+                 durability: str = "ack", resolve: Optional[Callable[[str], Awaitable[Optional[str]]]] = None,
+                 enabled: bool = True):
+        if durability not in ("ack", "async"):
+            raise ValueError(f"Unknown durability {durability!r}; expected 'ack' or 'async'")
+        if durability == "async" and resolve is None:
+            raise ValueError("Async durability needs a resolve callable for the existence check")
+        self._store = store
+        self.max_messages = max_messages
+        self.max_delay = max_delay
+        self.durability = durability
+        self._resolve = resolve
+        self.enabled = enabled
+        self._pending: Dict[str, List[dict]] = {}
+        self._waiters: Dict[str, List[asyncio.Future]] = {}
+        self._count = 0
+        self._timer: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+        # Conversations whose messages the running flush is writing
+        self._in_flight: Set[str] = set()
+        # Avatar of each buffered or in-flight conversation, known with async durability
+        self._avatar_ids: Dict[str, str] = {}
+        self._flushes = 0
+        self._flushed = 0
+        self._failed = 0
+
+    async def append(self, conversation_id: str, messages: List[dict]) -> Optional[dict]:
+        """Same contract as ``MessageStore.append``, but the write may be batched with others."""
+        if not self.enabled:
+            return await self._store.append(conversation_id, messages)
+
+        if self.durability == "async":
+            avatar_id = await self._resolve(conversation_id)
+            if avatar_id is None:
+                return None
+            self._avatar_ids[conversation_id] = avatar_id
+        self._pending.setdefault(conversation_id, []).extend(messages)
+        self._count += len(messages)
+        future = None
+        if self.durability == "ack":
+            future = asyncio.get_running_loop().create_future()
+            self._waiters.setdefault(conversation_id, []).append(future)
+
+        if self._count >= self.max_messages:
+            # Writes this batch now; in async mode it also holds back callers while the database catches up
+            await self._write_buffered(None)
+        elif self._timer is None:
+            self._timer = asyncio.create_task(self._flush_later())
+
+        if future is not None:
+            return await future
+        return {"id": conversation_id, "avatar_id": avatar_id}
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.max_delay)
+        # Cleared before flushing: while set, the timer is only sleeping and safe to cancel
+        self._timer = None
+        await self._write_buffered(None)
+
+    async def flush(self, conversation_ids: Optional[List[str]] = None):
+        """Write what is buffered now; with ``conversation_ids``, only those conversations.
+
+        Returns once every message of those conversations appended before the
+        call is written, including messages a flush already in progress is
+        writing, and their conversation documents count them (``MessageStore.flush``),
+        so a read that follows sees them.
+        """
+        await self._write_buffered(conversation_ids)
+        await self._store.flush(conversation_ids)
+
+    async def _write_buffered(self, conversation_ids: Optional[List[str]]):
+        if conversation_ids is not None and not any(
+            conversation_id in self._pending or conversation_id in self._in_flight for conversation_id in conversation_ids
+        ):
+            return
+        async with self._lock:
+            if conversation_ids is None:
+                selected = list(self._pending)
+            else:
+                selected = [conversation_id for conversation_id in dict.fromkeys(conversation_ids) if conversation_id in self._pending]
+            if not selected:
+                return
+            pending = {conversation_id: self._pending.pop(conversation_id) for conversation_id in selected}
+            waiters = {conversation_id: self._waiters.pop(conversation_id, []) for conversation_id in selected}
+            count = sum(len(messages) for messages in pending.values())
+            self._count -= count
+            self._in_flight = set(pending)
+            try:
+                conversations = await self._store.append_many(pending)
+            except Exception as error:
+                self._failed += count
+                futures = [future for futures in waiters.values() for future in futures]
+                if futures:
+                    for future in futures:
+                        if not future.done():
+                            future.set_exception(error)
+                else:
+                    logger.exception("Lost %d buffered messages of %d conversations", count, len(pending))
+                return
+            finally:
+                self._in_flight = set()
+                for conversation_id in pending:
+                    if conversation_id not in self._pending:
+                        self._avatar_ids.pop(conversation_id, None)
+            self._flushes += 1
+            self._flushed += count
+            for conversation_id, futures in waiters.items():
+                for future in futures:
+                    # A caller that went away leaves a cancelled future; its messages are written regardless
+                    if not future.done():
+                        future.set_result(conversations[conversation_id])
+
+    async def flush_avatar(self, avatar_id: str):
+        """``flush`` the conversations of one avatar, so its listing counts every message accepted so far."""
+        await self.flush([
+            conversation_id for conversation_id, owner in list(self._avatar_ids.items()) if owner == avatar_id
+        ] + self._store.pending(avatar_id))
+
+    async def drain(self):
+        """Write every buffered message without waiting for ``max_delay``, then the conversation counts they queued."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        await self._write_buffered(None)
+        await self._store.drain()
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "durability": self.durability,
+            "pending": self._count,
+            "flushes": self._flushes,
+            "flushed": self._flushed,
+            "failed": self._failed,
+            "messages_per_flush": self._flushed / self._flushes if self._flushes else 0.0,
+        }
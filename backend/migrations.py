@@ -0,0 +1,27 @@
+import logging
+from datetime import datetime
+from typing import Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+
+async def run_once(collection, name: str, migration: Callable[[datetime], Awaitable[None]]) -> bool:
+    """Run ``migration`` unless a completed marker named ``name`` is in ``collection``; returns whether it ran.
+
+    Data migrations scan whole collections, so they run on the first boot
+    that knows about them instead of on every boot. ``migration`` gets the
+    time the marker was first started, which stays fixed across retries, so
+    a migration interrupted by a crash can pick up the same cutover. Two
+    instances booting together may both run it; migrations must be safe to
+    re-run.
+    """
+    marker = await collection.find_one({"_id": name})
+    if marker is not None and marker.get("completed_at") is not None:
+        return False
+    if marker is None:
+        await collection.update_one({"_id": name}, {"$setOnInsert": {"started_at": datetime.utcnow()}}, upsert=True)
+        marker = await collection.find_one({"_id": name})
+    await migration(marker["started_at"])
+    await collection.update_one({"_id": name}, {"$set": {"completed_at": datetime.utcnow()}})
+    logger.info("Completed migration %s", name)
+    return True
@@ -0,0 +1,78 @@
+import base64
+from typing import Any, Callable, List, Optional, Tuple
+
+from bson import json_util
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# Response header carrying the opaque token for the next page
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+class InvalidCursor(ValueError):
+    """Raised when an ``after`` token cannot be decoded."""
+
+
+def encode_cursor(values: List[Any]) -> str:
+    return base64.urlsafe_b64encode(json_util.dumps(values).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(token: str) -> List[Any]:
+    # Tokens come from clients, and crafted extended JSON (e.g. {"$oid": "zz"} or {"$date": "x"})
+    # fails in the bson decoder with all sorts of errors, so any failure means an invalid cursor
+    try:
+        values = json_util.loads(base64.urlsafe_b64decode(token.encode('ascii')))
+    except Exception:
+        raise InvalidCursor(token)
+    # Sort keys are scalars; a document here would be spliced into the query as operators
+    if not isinstance(values, list) or any(isinstance(value, (dict, list)) for value in values):
+        raise InvalidCursor(token)
+    return values
+
+
+def keyset_filter(sort: List[Tuple[str, int]], values: List[Any]) -> dict:
+    """Build the filter selecting documents strictly after ``values`` in ``sort`` order."""
+    if len(values) != len(sort):
+        raise InvalidCursor(values)
+    clauses = []
+    for position, (field, direction) in enumerate(sort):
+        clause = {prefix: value for (prefix, _), value in zip(sort[:position], values)}
+        clause[field] = {"$gt" if direction > 0 else "$lt": values[position]}
+        clauses.append(clause)
+    return {"$or": clauses}
+
+
+async def fetch_page(
+    collection,
+    query: dict,
+    sort: List[Tuple[str, int]],
+    limit: int,
+    after: Optional[str],
+    build: Callable[[dict], Any],
+    projection: Optional[dict] = None,
+) -> Tuple[List[Any], Optional[str]]:
+    """Return one page of built items plus the token for the next page, if any.
+
+    ``sort`` must end with a unique field so every document has a distinct
+    position. Documents are streamed off the cursor and built one at a time.
+    """
+    if after:
+        query = {"$and": [query, keyset_filter(sort, decode_cursor(after))]}
+    # Mongo's _id never leaves the database layer, so do not fetch it
+    projection = {"_id": 0, **(projection or {})}
+
+    items = []
+    last_doc = None
+    has_more = False
+    async for doc in collection.find(query, projection).sort(sort).limit(limit + 1):
+        if len(items) == limit:
+            has_more = True
+            break
+        items.append(build(doc))
+        last_doc = doc
+
+    next_cursor = None
+    if has_more:
+        next_cursor = encode_cursor([last_doc[field] for field, _ in sort])
+    return items, next_cursor
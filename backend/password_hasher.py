@@ -0,0 +1,87 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+
+class HasherSaturated(Exception):
+    """Raised when the hashing queue is full and the call should be retried later."""
+
+
+class PasswordHasher:
+    """Runs bcrypt on a bounded thread pool so it never blocks the event loop.
+
+    bcrypt releases the GIL while it works, so a small thread pool gives real
+    parallelism. At most ``max_workers + max_queue`` calls are admitted at a
+    time; anything beyond that is rejected with ``HasherSaturated``.
+    """
+
+    def __init__(self, rounds: int = 12, max_workers: int = 2, max_queue: int = 64):
+        self.rounds = rounds
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="bcrypt")
+        self._in_flight = 0
+        self._completed = 0
+        self._rejected = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._hash_total = 0.0
+        self._hash_max = 0.0
+
+    async def hash(self, password: str) -> str:
+        hashed = await self._submit(
+            bcrypt.hashpw, password.encode('utf-8'), bcrypt.gensalt(rounds=self.rounds)
+        )
+        return hashed.decode('utf-8')
+
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        return await self._submit(
+            bcrypt.checkpw, password.encode('utf-8'), hashed_password.encode('utf-8')
+        )
+
+    async def _submit(self, fn, *args):
+        if self._in_flight >= self.max_workers + self.max_queue:
+            self._rejected += 1
+            raise HasherSaturated()
+
+        enqueued_at = time.perf_counter()
+
+        def run():
+            started_at = time.perf_counter()
+            result = fn(*args)
+            return result, started_at - enqueued_at, time.perf_counter() - started_at
+
+        self._in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            result, waited, worked = await loop.run_in_executor(self._executor, run)
+        finally:
+            self._in_flight -= 1
+
+        self._completed += 1
+        self._wait_total += waited
+        self._wait_max = max(self._wait_max, waited)
+        self._hash_total += worked
+        self._hash_max = max(self._hash_max, worked)
+        return result
+
+    def stats(self) -> dict:
+        completed = self._completed or 1
+        return {
+            "rounds": self.rounds,
+            "max_workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "in_flight": self._in_flight,
+            "queued": max(0, self._in_flight - self.max_workers),
+            "completed": self._completed,
+            "rejected": self._rejected,
+            "wait_ms_avg": self._wait_total / completed * 1000,
+            "wait_ms_max": self._wait_max * 1000,
+            "hash_ms_avg": self._hash_total / completed * 1000,
+            "hash_ms_max": self._hash_max * 1000,
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
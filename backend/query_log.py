@@ -0,0 +1,154 @@
+import logging
+import threading
+from contextvars import ContextVar
+from typing import Any, Optional
+
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+SERVER_TIMING_HEADER = b"server-timing"
+
+# Where each command keeps the filter it runs, for the slow-query log
+_FILTER_FIELDS = {
+    "find": "filter",
+    "count": "query",
+    "distinct": "query",
+    "findAndModify": "query",
+}
+_STATEMENT_FIELDS = {
+    "update": ("updates", "q"),
+    "delete": ("deletes", "q"),
+}
+
+
+def query_shape(value: Any) -> Any:
+    """Replace every literal in a filter with ``"?"`` so queries differing only in values look alike."""
+    if isinstance(value, dict):
+        return {key: query_shape(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        # $and/$or clauses keep their structure; lists of literals ($in) collapse to one marker
+        shapes = [query_shape(item) for item in value]
+        return shapes if any(isinstance(item, (dict, list)) for item in shapes) else "?"
+    return "?"
+
+
+def command_filter(command_name: str, command: dict) -> Optional[dict]:
+    if command_name in _FILTER_FIELDS:
+        return command.get(_FILTER_FIELDS[command_name])
+    if command_name in _STATEMENT_FIELDS:
+        field, key = _STATEMENT_FIELDS[command_name]
+        statements = command.get(field) or []
+        return statements[0].get(key) if statements else None
+    if command_name == "aggregate":
+        for stage in command.get("pipeline", []):
+            if "$match" in stage:
+                return stage["$match"]
+    return None
+
+
+def reply_counts(reply: dict) -> dict:
+    """Document counts the server reports back; docsExamined is only in its own slow log and profiler."""
+    counts = {}
+    cursor = reply.get("cursor")
+    if isinstance(cursor, dict):
+        counts["returned"] = len(cursor.get("firstBatch", cursor.get("nextBatch", [])))
+    for field in ("n", "nModified"):
+        if field in reply:
+            counts[field] = reply[field]
+    return counts
+
+
+class RequestTiming:
+    """Database time spent on behalf of one HTTP request."""
+
+    def __init__(self, scope: dict):
+        self.scope = scope
+        self.calls = 0
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def route(self) -> str:
+        # The router adds the matched route to the shared scope once it has dispatched
+        route = self.scope.get("route")
+        return getattr(route, "path", self.scope.get("path", "-"))
+
+    def record(self, seconds: float):
+        with self._lock:
+            self.calls += 1
+            self.seconds += seconds
+
+    def header(self) -> bytes:
+        return f'db;dur={self.seconds * 1000:.2f};desc="{self.calls} calls"'.encode("latin-1")
+
+
+# Set for the duration of each HTTP request; Motor copies it into the threads that run commands
+current_request: ContextVar[Optional[RequestTiming]] = ContextVar("current_request", default=None)
+
+
+class SlowQueryLog(monitoring.CommandListener):
+    """Adds each command's duration to the current request and logs the ones over ``threshold_ms``."""
+
+    def __init__(self, threshold_ms: float = 100.0):
+        self.threshold = threshold_ms / 1000
+        self._started = {}
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        if not isinstance(collection, str):
+            # getMore names its collection separately; admin commands have none
+            collection = event.command.get("collection", "$cmd")
+        self._started[(event.connection_id, event.request_id)] = (
+            collection, command_filter(event.command_name, event.command), current_request.get()
+        )
+
+    def succeeded(self, event):
+        self._finish(event, reply_counts(event.reply))
+
+    def failed(self, event):
+        self._finish(event, {"failure": str(event.failure)})
+
+    def _finish(self, event, details: dict):
+        collection, query, request = self._started.pop((event.connection_id, event.request_id), ("$cmd", None, None))
+        seconds = event.duration_micros / 1e6
+        if request is not None:
+            request.record(seconds)
+        if seconds >= self.threshold:
+            logger.warning(
+                "Slow query %.1fms %s.%s route=%s filter=%s %s",
+                seconds * 1000, collection, event.command_name,
+                request.route if request is not None else "-",
+                query_shape(query) if query is not None else "-",
+                " ".join(f"{key}={value}" for key, value in details.items()),
+            )
+
+
+class ServerTimingMiddleware:
+    """ASGI middleware that scopes ``current_request`` to each request and reports its DB time.
+
+    The ``Server-Timing`` header is written when the response starts, so a
+    streamed body only counts the queries made before its first chunk.
+    """
+
+    def __init__(self, app, enabled: bool = True):
+        self.app = app
+        self.enabled = enabled
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timing = RequestTiming(scope)
+
+        async def send_wrapper(message):
+            if self.enabled and message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", []), (SERVER_TIMING_HEADER, timing.header())]
+            await send(message)
+
+        token = current_request.set(timing)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current_request.reset(token)
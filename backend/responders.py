@@ -0,0 +1,51 @@
+import asyncio
+import importlib
+import re
+from abc import ABC, abstractmethod
+from typing import AsyncIterator, Sequence
+
+
+class ResponseGenerator(ABC):
+    """Produces an avatar's reply to a participant message, token by token.
+
+    ``context`` holds the knowledge base passages most relevant to the message, best first.
+    """
+
+    @abstractmethod
+    def stream(self, avatar: dict, message: dict, context: Sequence[str] = ()) -> AsyncIterator[str]:
+        """Yield the reply's tokens; usually written as an async generator."""
+
+    async def generate(self, avatar: dict, message: dict, context: Sequence[str] = ()) -> str:
+        return "".join([token async for token in self.stream(avatar, message, context)])
+
+
+class TemplateResponder(ResponseGenerator):
+    """Local mock that replies from the avatar's personality; needs no external service."""
+
+    def __init__(self, token_delay: float = 0.0):
+        self.token_delay = token_delay
+
+    async def stream(self, avatar: dict, message: dict, context: Sequence[str] = ()) -> AsyncIterator[str]:
+        reply = f"As {avatar['name']}, I understand your message about '{message['content'][:50]}...'. Let me respond based on my personality: {avatar['personality'][:100]}..."
+        if context:
+            reply += f" Here is what I know that may help: {context[0][:300]}"
+        for token in re.findall(r"\S+\s*", reply):
+            if self.token_delay:
+                await asyncio.sleep(self.token_delay)
+            yield token
+
+
+RESPONDERS = {
+    "template": TemplateResponder,
+}
+
+
+def load_responder(spec: str) -> ResponseGenerator:
+    """Build a responder from a registered name or a ``module:attribute`` import path."""
+    if spec in RESPONDERS:
+        return RESPONDERS[spec]()
+    module_name, _, attribute = spec.partition(":")
+    if not attribute:
+        raise ValueError(f"Unknown responder '{spec}'")
+    factory = getattr(importlib.import_module(module_name), attribute)
+    return factory()
@@ -0,0 +1,148 @@
+import asyncio
+import re
+from typing import List, Sequence, Tuple
+
+from archive import unpack
+from message_store import bucket_messages
+
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def search_terms(query: str) -> List[str]:
+    """Lowercased words of a ``$text`` query, leaving out negated ``-terms``."""
+    return [term.lower() for term in re.findall(r"(?<![\w-])-?\w+", query) if not term.startswith("-")]
+
+
+def _stem(term: str) -> str:
+    # Rough stand-in for the server's stemming: "warranties" should still match "warranty"
+    return term if len(term) <= 4 else term[:max(4, len(term) - 3)]
+
+
+def matched_terms(text: str, terms: Sequence[str]) -> int:
+    words = WORD_PATTERN.findall(text.lower())
+    return sum(1 for term in terms if any(word.startswith(_stem(term)) for word in words))
+
+
+def snippet(text: str, terms: Sequence[str], width: int = 160) -> str:
+    """Up to ``width`` characters of ``text`` around its first matching term."""
+    lowered = text.lower()
+    positions = [lowered.find(_stem(term)) for term in terms]
+    positions = [position for position in positions if position >= 0]
+    start = max(0, min(positions) - width // 4) if positions else 0
+    excerpt = text[start:start + width]
+    return ("..." if start else "") + excerpt + ("..." if start + width < len(text) else "")
+
+
+class ConversationSearch:
+    """Ranked full-text search over message buckets and summaries, one avatar at a time.
+
+    Both collections carry a compound text index with ``avatar_id`` as an
+    equality prefix, so each query only walks the index entries of one
+    avatar; searching several avatars runs one query per avatar and merges.
+    A bucket is matched as a whole, so its messages are re-checked against
+    the query terms and scored by the bucket score times the share of terms
+    they contain. Archives keep only a compressed payload, but a
+    conversation is archived only once its summary covers every message, so
+    archived conversations are found through their matching summaries: only
+    those archives are decompressed, and their messages scored by the
+    summary score the same way. An archived message whose terms its
+    summary does not mention is not found.
+    """
+
+    def __init__(self, db, max_depth: int = 500):
+        self.buckets = db.message_buckets
+        self.archive = db.conversation_archive
+        self.summaries = db.summaries
+        self.max_depth = max_depth
+
+    async def _find(self, collection, avatar_id: str, query: str, depth: int, projection: dict) -> List[dict]:
+        score = {"score": {"$meta": "textScore"}}
+        cursor = collection.find(
+            {"avatar_id": avatar_id, "$text": {"$search": query}}, {**projection, **score, "_id": 0}
+        )
+        return await cursor.sort([("score", {"$meta": "textScore"})]).limit(depth).to_list(depth)
+
+    @staticmethod
+    def _matching_messages(document: dict, messages: List[dict], terms: List[str]) -> List[dict]:
+        hits = []
+        for message in messages:
+            matched = matched_terms(message["content"], terms)
+            if matched:
+                hits.append({
+                    "kind": "message",
+                    "score": document["score"] * matched / len(terms),
+                    "avatar_id": document["avatar_id"],
+                    "conversation_id": document["conversation_id"],
+                    "seq": message["seq"],
+                    "sender": message["sender"],
+                    "timestamp": message["timestamp"],
+                    "snippet": snippet(message["content"], terms),
+                })
+        return hits
+
+    async def _message_hits(self, avatar_id: str, query: str, terms: List[str], depth: int) -> List[dict]:
+        hits = []
+        projection = {"conversation_id": 1, "avatar_id": 1, "start": 1, "messages": 1}
+        for bucket in await self._find(self.buckets, avatar_id, query, depth, projection):
+            hits.extend(self._matching_messages(bucket, bucket_messages(bucket), terms))
+        return hits
+
+    async def _archived_hits(self, avatar_id: str, query: str, terms: List[str], depth: int) -> List[dict]:
+        summaries = {
+            summary["conversation_id"]: summary
+            for summary in await self._find(self.summaries, avatar_id, query, depth, {"conversation_id": 1, "avatar_id": 1})
+        }
+        if not summaries:
+            return []
+        hits = []
+        async for archived in self.archive.find(
+            {"conversation_id": {"$in": list(summaries)}}, {"_id": 0, "conversation_id": 1, "payload": 1}
+        ):
+            hits.extend(self._matching_messages(summaries[archived["conversation_id"]], unpack(archived["payload"]), terms))
+        return hits
+
+    async def _summary_hits(self, avatar_id: str, query: str, terms: List[str], depth: int) -> List[dict]:
+        projection = {"id": 1, "conversation_id": 1, "avatar_id": 1, "summary_text": 1, "key_points": 1, "generated_at": 1}
+        hits = []
+        for summary in await self._find(self.summaries, avatar_id, query, depth, projection):
+            # Show whichever field matched: the summary itself, else its first matching key point
+            text = summary["summary_text"]
+            if not matched_terms(text, terms):
+                text = next((point for point in summary["key_points"] if matched_terms(point, terms)), text)
+            hits.append({
+                "kind": "summary",
+                "score": summary["score"],
+                "avatar_id": summary["avatar_id"],
+                "conversation_id": summary["conversation_id"],
+                "summary_id": summary["id"],
+                "timestamp": summary["generated_at"],
+                "snippet": snippet(text, terms),
+            })
+        return hits
+
+    async def search(
+        self, query: str, avatar_ids: Sequence[str], offset: int, limit: int, kinds: Sequence[str] = ("message", "summary")
+    ) -> Tuple[List[dict], bool]:
+        """Return hits ``offset`` to ``offset + limit`` by descending score, and whether more follow."""
+        terms = search_terms(query)
+        depth = min(offset + limit + 1, self.max_depth)
+        if not terms or not avatar_ids or offset >= depth:
+            return [], False
+
+        searches = []
+        for avatar_id in avatar_ids:
+            if "message" in kinds:
+                searches.append(self._message_hits(avatar_id, query, terms, depth))
+                searches.append(self._archived_hits(avatar_id, query, terms, depth))
+            if "summary" in kinds:
+                searches.append(self._summary_hits(avatar_id, query, terms, depth))
+        # A message can be both archived and still in a bucket whose delete lost a race; keep its best hit
+        best = {}
+        for hit in (hit for found in await asyncio.gather(*searches) for hit in found):
+            key = (hit["kind"], hit["conversation_id"], hit.get("seq"), hit.get("summary_id"))
+            if key not in best or hit["score"] > best[key]["score"]:
+                best[key] = hit
+        hits = list(best.values())
+        hits.sort(key=lambda hit: (-hit["score"], hit["conversation_id"], hit.get("seq", -1)))
+        hits = hits[:depth]
+        return hits[offset:offset + limit], len(hits) > offset + limit
@@ -0,0 +1,65 @@
+from functools import lru_cache
+from typing import Any, Iterable, List, Mapping, Optional, Type, TypeVar
+
+import orjson
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel
+
+ModelT = TypeVar("ModelT", bound=BaseModel)
+
+_set = object.__setattr__
+
+
+def _default(value: Any):
+    if isinstance(value, BaseModel):
+        # Field values live in __dict__ (private attributes and extras do not); orjson
+        # walks it natively, which is much cheaper than model_dump() per item
+        return value.__dict__
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+class TrustedJSONResponse(ORJSONResponse):
+    """orjson response for models built from our own collections.
+
+    Returning a response instance from a handler bypasses FastAPI's
+    ``response_model`` validation and ``jsonable_encoder`` pass, so only
+    use it for content that was written through the models in the first place.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+@lru_cache(maxsize=None)
+def _field_names(model: Type[BaseModel]) -> Optional[tuple]:
+    # None when the model needs more than its fields set, e.g. private attribute defaults
+    return None if model.__private_attributes__ else tuple(model.model_fields)
+
+
+def trusted(model: Type[ModelT], document: Mapping) -> ModelT:
+    """Build ``model`` from a stored document without validating it again; unknown keys are dropped."""
+    names = _field_names(model)
+    try:
+        if names is None:
+            raise KeyError
+        values = {name: document[name] for name in names}
+    except KeyError:
+        # Defaults to fill in: let pydantic do it
+        return model.model_construct(**document)
+    # The same state model_construct() leaves behind, minus its per-field bookkeeping
+    instance = model.__new__(model)
+    _set(instance, "__dict__", values)
+    _set(instance, "__pydantic_fields_set__", set(names))
+    _set(instance, "__pydantic_extra__", None)
+    _set(instance, "__pydantic_private__", None)
+    return instance
+
+
+def trusted_list(model: Type[ModelT], documents: Iterable[Mapping]) -> List[ModelT]:
+    return [trusted(model, document) for document in documents]
+
+
+def respond(content: Any, response: Optional[Any] = None, status_code: int = 200) -> TrustedJSONResponse:
+    """Serialize ``content``, carrying over headers set on the handler's injected ``Response``."""
+    headers = dict(response.headers) if response is not None else None
+    return TrustedJSONResponse(content, status_code=status_code, headers=headers)
@@ -1,36 +1,191 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Header, Query, Request, Response, WebSocket, WebSocketDisconnect, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import DuplicateKeyError
+import asyncio
+import json
 import os
 import logging
+import time
 from pathlib import Path
-from pydantic import BaseModel, Field
-from typing import List, Optional
+from pydantic import BaseModel, Field, ValidationError
+from typing import Any, Dict, List, Optional, Union
 import uuid
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import jwt
-import bcrypt
+
+from analytics import GRANULARITIES, AnalyticsRollups
+from archive import ConversationArchive, merge_messages
+from blobs import DIGEST_PATTERN, LocalBlobStore, S3BlobStore, parse_data_url, parse_range
+from caches import AvatarCache, LocalInvalidationChannel, MongoInvalidationChannel, TTLCache
+from exports import MEDIA_TYPE as EXPORT_MEDIA_TYPE, gzip_chunks, ndjson_batches
+from indexes import ensure_indexes, verify_query_plans
+from knowledge import KnowledgeBase
+from message_store import MessageStore, WriteBehindBuffer, select_messages
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, MetricsMiddleware, MetricsRegistry, MongoCommandMetrics, stats_collector
+from migrations import run_once
+from pagination import (
+    DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, NEXT_CURSOR_HEADER, InvalidCursor, decode_cursor, encode_cursor, fetch_page, keyset_filter,
+)
+from password_hasher import PasswordHasher, HasherSaturated
+from query_log import ServerTimingMiddleware, SlowQueryLog
+from responders import load_responder
+from search import ConversationSearch
+from serialization import respond, trusted, trusted_list
+from summary_jobs import SummaryJobQueue
+from versions import ResourceVersions, entity_tag, http_date, is_fresh
 
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# Prometheus metrics served at /metrics
+metrics_registry = MetricsRegistry()
+
 # MongoDB connection
 mongo_url = os.environ.get('MONGO_URL', 'mongodb://localhost:27017')
-client = AsyncIOMotorClient(mongo_url)
+# Commands slower than SLOW_QUERY_MS are logged with the route that issued them
+slow_query_log = SlowQueryLog(threshold_ms=float(os.environ.get('SLOW_QUERY_MS', '100')))
+client = AsyncIOMotorClient(mongo_url, event_listeners=[MongoCommandMetrics(metrics_registry), slow_query_log])
 db = client[os.environ.get('DB_NAME', 'zeny_ai')]
 
+# Per-avatar hourly and daily counters behind the analytics endpoint; message
+# counts are written in batches every ANALYTICS_FLUSH_SECONDS
+analytics = AnalyticsRollups(db.analytics_rollups, delay=float(os.environ.get('ANALYTICS_FLUSH_SECONDS', '1')))
+# Longest series one analytics query may return, in periods
+MAX_ANALYTICS_PERIODS = int(os.environ.get('MAX_ANALYTICS_PERIODS', '1000'))
+
+# Version counters behind the ETags of list endpoints; bumps from message appends
+# are coalesced over RESOURCE_VERSION_DELAY_MS
+resource_versions = ResourceVersions(
+    db.resource_versions, delay=float(os.environ.get('RESOURCE_VERSION_DELAY_MS', '50')) / 1000
+)
+
+# Bumped only once the conversation documents count the new messages, so a listing never pairs the new version with old content
+async def bump_conversation_listing(conversation: dict):
+    resource_versions.bump_later(f"conversations:{conversation['avatar_id']}")
+
+# The avatar id of a conversation never changes
+conversation_avatar_cache = TTLCache(
+    maxsize=int(os.environ.get('CONVERSATION_CACHE_SIZE', '16384')),
+    ttl=float(os.environ.get('CONVERSATION_CACHE_TTL', '3600')),
+)
+
+async def get_conversation_avatar_id(conversation_id: str) -> Optional[str]:
+    avatar_id = conversation_avatar_cache.get(conversation_id)
+    if avatar_id is None:
+        conversation = await db.conversations.find_one({"id": conversation_id}, {"avatar_id": 1})
+        if conversation:
+            avatar_id = conversation["avatar_id"]
+            conversation_avatar_cache.set(conversation_id, avatar_id)
+    return avatar_id
+
+# Conversation messages live in bounded buckets outside the conversation document.
+# Each worker remembers the newest bucket of MESSAGE_HEAD_CACHE_SIZE conversations;
+# the TTL must stay far below ARCHIVE_AFTER_DAYS, as archiving deletes older buckets.
+# Message counts and previews on the conversations trail by up to CONVERSATION_UPDATE_DELAY_MS
+message_store = MessageStore(
+    db,
+    bucket_size=int(os.environ.get('MESSAGE_BUCKET_SIZE', '100')),
+    on_append=analytics.messages_added,
+    after_append=bump_conversation_listing,
+    resolve=get_conversation_avatar_id,
+    heads=TTLCache(
+        maxsize=int(os.environ.get('MESSAGE_HEAD_CACHE_SIZE', '16384')),
+        ttl=float(os.environ.get('MESSAGE_HEAD_CACHE_TTL', '60')),
+    ),
+    delay=float(os.environ.get('CONVERSATION_UPDATE_DELAY_MS', '50')) / 1000,
+)
+
+# Messages of conversations ended ARCHIVE_AFTER_DAYS ago (and summarized) move to a
+# compressed archive; checked every ARCHIVE_INTERVAL_SECONDS, 0 turns it off
+conversation_archive = ConversationArchive(
+    db, message_store, after=timedelta(days=float(os.environ.get('ARCHIVE_AFTER_DAYS', '30')))
+)
+ARCHIVE_INTERVAL_SECONDS = float(os.environ.get('ARCHIVE_INTERVAL_SECONDS', '3600'))
+
+# Avatar images are kept by content hash outside the avatar documents;
+# BLOB_STORE=s3 uses BLOB_S3_BUCKET, and BLOB_S3_ENDPOINT for S3-compatible servers
+if os.environ.get('BLOB_STORE', 'local') == 's3':
+    blob_store = S3BlobStore(os.environ['BLOB_S3_BUCKET'], endpoint_url=os.environ.get('BLOB_S3_ENDPOINT'))
+else:
+    blob_store = LocalBlobStore(Path(os.environ.get('BLOB_ROOT', str(ROOT_DIR / 'blobs'))))
+MAX_AVATAR_IMAGE_BYTES = int(os.environ.get('MAX_AVATAR_IMAGE_BYTES', str(5 * 1024 * 1024)))
+# Raster formats only: an SVG is a document that can run script when opened from /api/images
+AVATAR_IMAGE_TYPES = {"image/png", "image/jpeg", "image/gif", "image/webp"}
+
+# Generates avatar replies; 'template' is a local mock, or pass a module:attribute path
+responder = load_responder(os.environ.get('AVATAR_RESPONDER', 'template'))
+
 # JWT Configuration
 JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY', 'your-secret-key-change-in-production')
 JWT_ALGORITHM = "HS256"
 JWT_EXPIRATION_TIME = timedelta(hours=24)
 
+# Fail startup when a known query shape falls back to a collection scan (test mode)
+VERIFY_QUERY_PLANS = os.environ.get('VERIFY_QUERY_PLANS', 'false').lower() == 'true'
+
 # Admin Configuration
 ADMIN_USERNAME = os.environ.get('ADMIN_USERNAME', 'admin')
 ADMIN_PASSWORD = os.environ.get('ADMIN_PASSWORD', 'admin')
 
+# Password hashing pool
+password_hasher = PasswordHasher(
+    rounds=int(os.environ.get('BCRYPT_ROUNDS', '12')),
+    max_workers=int(os.environ.get('PASSWORD_HASH_WORKERS', '2')),
+    max_queue=int(os.environ.get('PASSWORD_HASH_QUEUE', '64')),
+)
+
+# Authenticated principals keyed by bearer token
+principal_cache = TTLCache(
+    maxsize=int(os.environ.get('PRINCIPAL_CACHE_SIZE', '4096')),
+    ttl=float(os.environ.get('PRINCIPAL_CACHE_TTL', '60')),
+)
+
+# Avatars are read on nearly every conversational request; with several uvicorn
+# workers set CACHE_INVALIDATION=mongo so an update in one clears all of them
+if os.environ.get('CACHE_INVALIDATION', 'local') == 'mongo':
+    cache_invalidation_channel = MongoInvalidationChannel(db)
+else:
+    cache_invalidation_channel = LocalInvalidationChannel()
+
+# A user's cached principals are dropped on every worker via the key "user:<username>"
+def drop_cached_principals(key):
+    if isinstance(key, str) and key.startswith("user:"):
+        username = key[len("user:"):]
+        principal_cache.invalidate_where(lambda token, user: user.username == username)
+
+cache_invalidation_channel.subscribe(drop_cached_principals)
+
+avatar_cache = AvatarCache(
+    db.avatars,
+    TTLCache(
+        maxsize=int(os.environ.get('AVATAR_CACHE_SIZE', '1024')),
+        ttl=float(os.environ.get('AVATAR_CACHE_TTL', '300')),
+    ),
+    cache_invalidation_channel,
+)
+
+# Full-text search over messages and summaries; results past SEARCH_MAX_DEPTH are not reachable
+conversation_search = ConversationSearch(db, max_depth=int(os.environ.get('SEARCH_MAX_DEPTH', '500')))
+
+# Upper bound on items in one bulk message import
+MAX_BULK_MESSAGES = int(os.environ.get('MAX_BULK_MESSAGES', '10000'))
+
+# Retrieval over each avatar's knowledge_base; indexes are rebuilt when the text changes
+knowledge_base = KnowledgeBase(
+    TTLCache(
+        maxsize=int(os.environ.get('KNOWLEDGE_INDEX_CACHE_SIZE', '256')),
+        ttl=float(os.environ.get('KNOWLEDGE_INDEX_TTL', '3600')),
+    ),
+    features=int(os.environ.get('KNOWLEDGE_FEATURES', '2048')),
+)
+KNOWLEDGE_TOP_K = int(os.environ.get('KNOWLEDGE_TOP_K', '3'))
+
 # Security
 security = HTTPBearer()
 
@@ -58,7 +213,8 @@ class Avatar(BaseModel):
     description: str
     owner_id: str
     knowledge_base: Optional[str] = None
-    avatar_image: Optional[str] = None
+    avatar_image: Optional[str] = None  # External image URL; uploaded images are served by hash
+    avatar_image_hash: Optional[str] = None
     created_at: datetime = Field(default_factory=datetime.utcnow)
     is_active: bool = True
 
@@ -86,6 +242,17 @@ class Conversation(BaseModel):
     ended_at: Optional[datetime] = None
     status: str = "active"
 
+class ConversationListItem(BaseModel):
+    id: str
+    avatar_id: str
+    participant_name: str
+    started_at: datetime
+    ended_at: Optional[datetime] = None
+    status: str = "active"
+    message_count: int = 0
+    last_message_at: Optional[datetime] = None
+    last_message_preview: Optional[str] = None
+
 class ConversationCreate(BaseModel):
     avatar_id: str
     participant_name: str
@@ -95,13 +262,88 @@ class Message(BaseModel):
     content: str
     timestamp: datetime = Field(default_factory=datetime.utcnow)
 
+class StoredMessage(Message):
+    seq: int
+
+class BulkMessage(Message):
+    conversation_id: str
+
+class BulkMessageRequest(BaseModel):
+    # Validated one by one so a bad item fails alone instead of rejecting the batch
+    items: List[Dict[str, Any]]
+    generate_replies: bool = False
+
+class BulkMessageResult(BaseModel):
+    index: int
+    status: str  # "created", "invalid" or "not_found"
+    conversation_id: Optional[str] = None
+    seq: Optional[int] = None
+    reply_seq: Optional[int] = None
+    detail: Optional[str] = None
+
+class BulkMessageResponse(BaseModel):
+    created: int
+    failed: int
+    results: List[BulkMessageResult]
+
 class Summary(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     avatar_id: str
+    # Copied from the avatar so a user's summaries can be listed without touching avatars
+    owner_id: Optional[str] = None
     conversation_id: str
     summary_text: str
     key_points: List[str]
     generated_at: datetime = Field(default_factory=datetime.utcnow)
+    # Watermark: messages with seq below this have been folded into the summary
+    message_count: int = 0
+    participant_message_count: int = 0
+    avatar_message_count: int = 0
+    first_message_preview: Optional[str] = None
+    last_message_preview: Optional[str] = None
+    updated_at: Optional[datetime] = None
+
+class SearchHit(BaseModel):
+    kind: str  # "message" or "summary"
+    score: float
+    avatar_id: str
+    conversation_id: str
+    snippet: str
+    summary_id: Optional[str] = None
+    seq: Optional[int] = None
+    sender: Optional[str] = None
+    timestamp: Optional[datetime] = None
+
+class AnalyticsCounters(BaseModel):
+    conversations_started: int
+    conversations_ended: int
+    participant_messages: int
+    avatar_messages: int
+    ended_message_count: int
+    ended_duration_seconds: float
+    average_messages_per_conversation: Optional[float] = None
+    average_duration_seconds: Optional[float] = None
+
+class AnalyticsPeriod(AnalyticsCounters):
+    period_start: datetime
+
+class AnalyticsReport(BaseModel):
+    granularity: str
+    start: datetime
+    end: datetime
+    totals: AnalyticsCounters
+    series: List[AnalyticsPeriod]
+
+class SummaryJob(BaseModel):
+    id: str
+    conversation_id: str
+    status: str
+    stage: Optional[str] = None
+    summary_id: Optional[str] = None
+    error: Optional[str] = None
+    queued_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
 
 # Authentication Models
 class User(BaseModel):
@@ -130,11 +372,17 @@ class AdminCredentialsUpdate(BaseModel):
     new_password: str
 
 # Authentication Helper Functions
-def hash_password(password: str) -> str:
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+async def hash_password(password: str) -> str:
+    try:
+        return await password_hasher.hash(password)
+    except HasherSaturated:
+        raise HTTPException(status_code=503, detail="Server busy, please retry", headers={"Retry-After": "1"})
 
-def verify_password(password: str, hashed_password: str) -> bool:
-    return bcrypt.checkpw(password.encode('utf-8'), hashed_password.encode('utf-8'))
+async def verify_password(password: str, hashed_password: str) -> bool:
+    try:
+        return await password_hasher.verify(password, hashed_password)
+    except HasherSaturated:
+        raise HTTPException(status_code=503, detail="Server busy, please retry", headers={"Retry-After": "1"})
 
 def create_access_token(data: dict):
     to_encode = data.copy()
@@ -144,29 +392,169 @@ def create_access_token(data: dict):
     return encoded_jwt
 
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    token = credentials.credentials
+    cached_user = principal_cache.get(token)
+    if cached_user is not None:
+        return cached_user
+
     try:
-        payload = jwt.decode(credentials.credentials, JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM])
+        payload = jwt.decode(token, JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM])
         username: str = payload.get("sub")
         if username is None:
             raise HTTPException(status_code=401, detail="Invalid authentication credentials")
     except jwt.PyJWTError:
         raise HTTPException(status_code=401, detail="Invalid authentication credentials")
     
-    user = await db.users.find_one({"username": username})
+    user = await db.users.find_one({"username": username}, {"_id": 0, "hashed_password": 0})
     if user is None:
         raise HTTPException(status_code=401, detail="User not found")
-    return User(**user)
+    user_obj = trusted(User, user)
+    # Never keep a principal around past its token's expiry
+    expires_in = payload["exp"] - time.time() if "exp" in payload else None
+    principal_cache.set(token, user_obj, ttl=expires_in)
+    return user_obj
 
 async def get_admin_user(current_user: User = Depends(get_current_user)):
     if not current_user.is_admin:
         raise HTTPException(status_code=403, detail="Admin access required")
     return current_user
 
+# Cached lookups for the conversation hot path
+async def get_owned_avatar(avatar_id: str, owner_id: str) -> Optional[dict]:
+    avatar = await avatar_cache.get(avatar_id)
+    return avatar if avatar and avatar["owner_id"] == owner_id else None
+
+# Optional write-behind batching of message appends. MESSAGE_BUFFER_DURABILITY=ack
+# answers once the batch is written; async answers once buffered and can lose
+# up to MESSAGE_BUFFER_DELAY_MS of messages if the process dies
+message_buffer = WriteBehindBuffer(
+    message_store,
+    max_messages=int(os.environ.get('MESSAGE_BUFFER_SIZE', '100')),
+    max_delay=float(os.environ.get('MESSAGE_BUFFER_DELAY_MS', '20')) / 1000,
+    durability=os.environ.get('MESSAGE_BUFFER_DURABILITY', 'ack'),
+    resolve=get_conversation_avatar_id,
+    enabled=os.environ.get('MESSAGE_WRITE_BEHIND', 'false').lower() == 'true',
+)
+
+async def read_conversation_messages(conversations: List[dict]) -> Dict[str, List[dict]]:
+    # Hot buckets, plus the archived messages of conversations that have been archived
+    messages = await message_store.read_many([conversation["id"] for conversation in conversations])
+    archived_ids = [conversation["id"] for conversation in conversations if conversation.get("archived_at")]
+    if archived_ids:
+        for conversation_id, archived in (await conversation_archive.read_many(archived_ids)).items():
+            messages[conversation_id] = merge_messages(archived, messages[conversation_id])
+    return messages
+
+# Conditional GET: sets the validators and returns a 304 to send instead when the client's copy is current
+def not_modified(request: Request, response: Response, etag: str, last_modified: Optional[datetime] = None) -> Optional[Response]:
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if last_modified is not None:
+        headers["Last-Modified"] = http_date(last_modified)
+    response.headers.update(headers)
+    if is_fresh(request.headers, etag, last_modified):
+        return Response(status_code=304, headers=headers)
+    return None
+
+async def scope_not_modified(request: Request, response: Response, scope: str) -> Optional[Response]:
+    # List responses change only when their scope is bumped; the query string picks the page
+    version, updated_at = await resource_versions.get(scope)
+    return not_modified(request, response, entity_tag(scope, version, request.url.query), updated_at)
+
+# Keyset pagination for list endpoints; the next-page token goes in a response header
+async def paginate(response: Response, collection, query: dict, sort, limit: int, after: Optional[str], build, projection: Optional[dict] = None):
+    try:
+        items, next_cursor = await fetch_page(collection, query, sort, limit, after, build, projection)
+    except InvalidCursor:
+        raise HTTPException(status_code=400, detail="Invalid pagination cursor")
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return items
+
+# Stored datetimes are naive UTC, but query parameters may carry an offset ("...Z" from toISOString)
+def naive_utc(moment: Optional[datetime]) -> Optional[datetime]:
+    if moment is None or moment.tzinfo is None:
+        return moment
+    return moment.astimezone(timezone.utc).replace(tzinfo=None)
+
+# Half-open [start, end) filter on a datetime field, empty when neither bound is given
+def date_range(field: str, start: Optional[datetime], end: Optional[datetime]) -> dict:
+    bounds = {}
+    if start:
+        bounds["$gte"] = naive_utc(start)
+    if end:
+        bounds["$lt"] = naive_utc(end)
+    return {field: bounds} if bounds else {}
+
+# Drop duplicate summaries left by the old check-then-insert race, keeping each
+# conversation's newest, so the unique conversation_id index can be built
+async def dedupe_summaries():
+    if "conversation_unique" in await db.summaries.index_information():
+        return
+    duplicates = db.summaries.aggregate([
+        {"$group": {"_id": "$conversation_id", "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}},
+    ])
+    async for group in duplicates:
+        summaries = await db.summaries.find(
+            {"conversation_id": group["_id"]},
+            {"_id": 0, "id": 1, "avatar_id": 1, "owner_id": 1, "generated_at": 1, "updated_at": 1},
+        ).to_list(None)
+        newest, *stale = sorted(
+            summaries, key=lambda summary: summary.get("updated_at") or summary["generated_at"], reverse=True
+        )
+        await db.summaries.delete_many({"id": {"$in": [summary["id"] for summary in stale]}})
+        await resource_versions.bump(*summary_scopes(newest))
+        logger.info("Dropped %d duplicate summaries of conversation %s", len(stale), group["_id"])
+
+# Fill in owner_id on summaries written before it was denormalized
+async def backfill_summary_owners():
+    for avatar_id in await db.summaries.distinct("avatar_id", {"owner_id": None}):
+        avatar = await avatar_cache.get(avatar_id)
+        if avatar:
+            await db.summaries.update_many(
+                {"avatar_id": avatar_id, "owner_id": None},
+                {"$set": {"owner_id": avatar["owner_id"]}}
+            )
+            await resource_versions.bump(f"summaries:owner:{avatar['owner_id']}")
+
+# Uploaded avatar images arrive as data URLs; store the bytes by hash and keep only the hash
+async def offload_avatar_image(fields: dict):
+    try:
+        decoded = parse_data_url(fields["avatar_image"])
+    except ValueError as error:
+        raise HTTPException(status_code=400, detail=f"Invalid avatar_image: {error}")
+    if decoded is None:
+        fields["avatar_image_hash"] = None
+        return
+    data, content_type = decoded
+    content_type = content_type.lower()
+    if content_type not in AVATAR_IMAGE_TYPES:
+        raise HTTPException(
+            status_code=400, detail=f"avatar_image must be one of {', '.join(sorted(AVATAR_IMAGE_TYPES))}"
+        )
+    if len(data) > MAX_AVATAR_IMAGE_BYTES:
+        raise HTTPException(status_code=413, detail=f"avatar_image is larger than {MAX_AVATAR_IMAGE_BYTES} bytes")
+    fields["avatar_image_hash"] = await blob_store.put(data, content_type)
+    fields["avatar_image"] = None
+
+# Move images stored inline before the blob store existed
+async def offload_inline_avatar_images():
+    async for avatar in db.avatars.find({"avatar_image": {"$regex": "^data:"}}, {"_id": 0, "id": 1, "owner_id": 1, "avatar_image": 1}):
+        fields = {"avatar_image": avatar["avatar_image"]}
+        try:
+            await offload_avatar_image(fields)
+        except HTTPException as error:
+            logger.warning("Left inline image of avatar %s in place: %s", avatar["id"], error.detail)
+            continue
+        await db.avatars.update_one({"id": avatar["id"]}, {"$set": fields, "$inc": {"version": 1}})
+        await avatar_cache.invalidate(avatar["id"])
+        await resource_versions.bump(f"avatars:{avatar['owner_id']}")
+
 # Initialize admin user on startup
 async def init_admin_user():
     admin_user = await db.users.find_one({"username": ADMIN_USERNAME})
     if not admin_user:
-        hashed_password = hash_password(ADMIN_PASSWORD)
+        hashed_password = await hash_password(ADMIN_PASSWORD)
         admin_user_obj = User(
             username=ADMIN_USERNAME,
             email="admin@zeny.ai",
@@ -186,8 +574,8 @@ async def root():
 # Authentication Endpoints
 @api_router.post("/auth/login", response_model=Token)
 async def login(user_login: UserLogin):
-    user = await db.users.find_one({"username": user_login.username})
-    if not user or not verify_password(user_login.password, user["hashed_password"]):
+    user = await db.users.find_one({"username": user_login.username}, {"_id": 0})
+    if not user or not await verify_password(user_login.password, user["hashed_password"]):
         raise HTTPException(status_code=401, detail="Invalid username or password")
     
     access_token = create_access_token(data={"sub": user["username"]})
@@ -205,7 +593,7 @@ async def register(user_create: UserCreate):
     if existing_user:
         raise HTTPException(status_code=400, detail="Username already exists")
     
-    hashed_password = hash_password(user_create.password)
+    hashed_password = await hash_password(user_create.password)
     user_obj = User(
         username=user_create.username,
         email=user_create.email,
@@ -221,7 +609,7 @@ async def register(user_create: UserCreate):
 
 @api_router.get("/auth/me", response_model=User)
 async def get_me(current_user: User = Depends(get_current_user)):
-    return current_user
+    return respond(current_user)
 
 @api_router.put("/auth/admin/credentials")
 async def update_admin_credentials(
@@ -231,7 +619,7 @@ async def update_admin_credentials(
     global ADMIN_USERNAME, ADMIN_PASSWORD
     
     # Update the admin user in database
-    hashed_password = hash_password(credentials.new_password)
+    hashed_password = await hash_password(credentials.new_password)
     await db.users.update_one(
         {"username": current_user.username},
         {"$set": {
@@ -240,12 +628,35 @@ async def update_admin_credentials(
         }}
     )
     
+    # Drop cached principals for the old username on every worker so its tokens stop resolving
+    await cache_invalidation_channel.publish(f"user:{current_user.username}")
+    
     # Update environment variables (for current session)
     ADMIN_USERNAME = credentials.new_username
     ADMIN_PASSWORD = credentials.new_password
     
     return {"message": "Admin credentials updated successfully"}
 
+# Admin Diagnostics
+def component_stats():
+    return {
+        "password_hasher": password_hasher.stats(),
+        "principal_cache": principal_cache.stats(),
+        "avatar_cache": avatar_cache.stats(),
+        "conversation_avatar_cache": conversation_avatar_cache.stats(),
+        "message_head_cache": message_store.heads.stats(),
+        "knowledge_base": knowledge_base.stats(),
+        "summary_jobs": summary_jobs.stats(),
+        "message_buffer": message_buffer.stats(),
+        "conversation_archive": conversation_archive.stats(),
+    }
+
+metrics_registry.add_collector(stats_collector("zeny", component_stats))
+
+@api_router.get("/admin/stats")
+async def get_admin_stats(current_user: User = Depends(get_admin_user)):
+    return component_stats()
+
 @api_router.post("/status", response_model=StatusCheck)
 async def create_status_check(input: StatusCheckCreate):
     status_dict = input.dict()
@@ -254,216 +665,699 @@ async def create_status_check(input: StatusCheckCreate):
     return status_obj
 
 @api_router.get("/status", response_model=List[StatusCheck])
-async def get_status_checks():
-    status_checks = await db.status_checks.find().to_list(1000)
-    return [StatusCheck(**status_check) for status_check in status_checks]
+async def get_status_checks(
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+):
+    sort = [("timestamp", 1), ("id", 1)]
+    checks = await paginate(response, db.status_checks, {}, sort, limit, after, lambda doc: trusted(StatusCheck, doc))
+    return respond(checks, response)
 
 # Avatar Management Endpoints
 @api_router.post("/avatars", response_model=Avatar)
 async def create_avatar(avatar_data: AvatarCreate, current_user: User = Depends(get_current_user)):
     avatar_dict = avatar_data.dict()
     avatar_dict["owner_id"] = current_user.id  # Use authenticated user's ID
+    if avatar_dict.get("avatar_image"):
+        await offload_avatar_image(avatar_dict)
     avatar_obj = Avatar(**avatar_dict)
-    await db.avatars.insert_one(avatar_obj.dict())
+    await db.avatars.insert_one({**avatar_obj.dict(), "version": 1})
+    await resource_versions.bump(f"avatars:{current_user.id}")
+    await knowledge_base.refresh(avatar_obj.dict())
     return avatar_obj
 
 @api_router.get("/avatars", response_model=List[Avatar])
-async def get_avatars(current_user: User = Depends(get_current_user)):
+async def get_avatars(
+    request: Request,
+    response: Response,
+    current_user: User = Depends(get_current_user),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+):
+    unchanged = await scope_not_modified(request, response, f"avatars:{current_user.id}")
+    if unchanged:
+        return unchanged
     # Return avatars owned by the current user
     query = {"is_active": True, "owner_id": current_user.id}
-    avatars = await db.avatars.find(query).to_list(1000)
-    return [Avatar(**avatar) for avatar in avatars]
+    sort = [("created_at", 1), ("id", 1)]
+    avatars = await paginate(response, db.avatars, query, sort, limit, after, lambda doc: trusted(Avatar, doc))
+    return respond(avatars, response)
 
 @api_router.get("/avatars/{avatar_id}", response_model=Avatar)
-async def get_avatar(avatar_id: str, current_user: User = Depends(get_current_user)):
-    avatar = await db.avatars.find_one({"id": avatar_id, "owner_id": current_user.id})
+async def get_avatar(avatar_id: str, request: Request, response: Response, current_user: User = Depends(get_current_user)):
+    avatar = await get_owned_avatar(avatar_id, current_user.id)
     if not avatar:
         raise HTTPException(status_code=404, detail="Avatar not found")
-    return Avatar(**avatar)
+    etag = entity_tag(avatar_id, avatar.get("version", 0))
+    unchanged = not_modified(request, response, etag, avatar.get("updated_at") or avatar["created_at"])
+    if unchanged:
+        return unchanged
+    return respond(trusted(Avatar, avatar), response)
 
 @api_router.put("/avatars/{avatar_id}", response_model=Avatar)
 async def update_avatar(avatar_id: str, avatar_update: AvatarUpdate, current_user: User = Depends(get_current_user)):
-    avatar = await db.avatars.find_one({"id": avatar_id, "owner_id": current_user.id})
+    avatar = await get_owned_avatar(avatar_id, current_user.id)
     if not avatar:
         raise HTTPException(status_code=404, detail="Avatar not found")
     
     update_data = {k: v for k, v in avatar_update.dict().items() if v is not None}
+    if "avatar_image" in update_data:
+        await offload_avatar_image(update_data)
     if update_data:
-        await db.avatars.update_one({"id": avatar_id}, {"$set": update_data})
+        await db.avatars.update_one(
+            {"id": avatar_id}, {"$set": {**update_data, "updated_at": datetime.utcnow()}, "$inc": {"version": 1}}
+        )
+        await avatar_cache.invalidate(avatar_id)
+        await resource_versions.bump(f"avatars:{current_user.id}")
     
-    updated_avatar = await db.avatars.find_one({"id": avatar_id})
-    return Avatar(**updated_avatar)
+    updated_avatar = await avatar_cache.get(avatar_id)
+    if "knowledge_base" in update_data:
+        # Only chunks that changed are re-vectorized
+        await knowledge_base.refresh(updated_avatar)
+    return respond(trusted(Avatar, updated_avatar))
 
 @api_router.delete("/avatars/{avatar_id}")
 async def delete_avatar(avatar_id: str, current_user: User = Depends(get_current_user)):
     result = await db.avatars.update_one(
         {"id": avatar_id, "owner_id": current_user.id}, 
-        {"$set": {"is_active": False}}
+        {"$set": {"is_active": False, "updated_at": datetime.utcnow()}, "$inc": {"version": 1}}
     )
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Avatar not found")
+    await avatar_cache.invalidate(avatar_id)
+    await resource_versions.bump(f"avatars:{current_user.id}")
     return {"message": "Avatar deleted successfully"}
 
+# Content-addressed, so a digest's bytes never change and can be cached for good
+@api_router.get("/images/{digest}")
+async def get_image(digest: str, request: Request, range_header: Optional[str] = Header(None, alias="Range")):
+    blob = await blob_store.stat(digest) if DIGEST_PATTERN.match(digest) else None
+    if blob is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    headers = {
+        "ETag": f'"{digest}"',
+        "Cache-Control": "public, max-age=31536000, immutable",
+        "Accept-Ranges": "bytes",
+        # Served as the stored type and never run: blobs stored before the type check may be SVG
+        "X-Content-Type-Options": "nosniff",
+        "Content-Security-Policy": "default-src 'none'",
+    }
+    if is_fresh(request.headers, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    try:
+        byte_range = parse_range(range_header, blob["size"]) if range_header else None
+    except ValueError:
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{blob['size']}"})
+    if byte_range is None:
+        return Response(await blob_store.read(digest), media_type=blob["content_type"], headers=headers)
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{blob['size']}"
+    return Response(await blob_store.read(digest, start, end), status_code=206, media_type=blob["content_type"], headers=headers)
+
 # Conversation Management Endpoints
 @api_router.post("/conversations", response_model=Conversation)
 async def create_conversation(conversation_data: ConversationCreate):
-    avatar = await db.avatars.find_one({"id": conversation_data.avatar_id, "is_active": True})
-    if not avatar:
+    avatar = await avatar_cache.get(conversation_data.avatar_id)
+    if not avatar or not avatar.get("is_active"):
         raise HTTPException(status_code=404, detail="Avatar not found")
     
     conversation_dict = conversation_data.dict()
     conversation_dict["messages"] = []
     conversation_obj = Conversation(**conversation_dict)
-    await db.conversations.insert_one(conversation_obj.dict())
+    # Messages are stored by message_store; the document only tracks how many there are
+    await db.conversations.insert_one({**conversation_obj.dict(exclude={"messages"}), "message_count": 0})
+    await analytics.conversation_started(conversation_obj.avatar_id, conversation_obj.started_at)
+    await resource_versions.bump(f"conversations:{conversation_obj.avatar_id}")
     return conversation_obj
 
-@api_router.get("/conversations", response_model=List[Conversation])
-async def get_conversations(avatar_id: Optional[str] = None):
+@api_router.get("/conversations", response_model=List[Union[Conversation, ConversationListItem]])
+async def get_conversations(
+    request: Request,
+    response: Response,
+    avatar_id: Optional[str] = None,
+    view: str = Query("full", pattern="^(full|summary)$"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+):
     query = {}
     if avatar_id:
         query["avatar_id"] = avatar_id
-    conversations = await db.conversations.find(query).to_list(1000)
-    return [Conversation(**conversation) for conversation in conversations]
+        # Unfiltered listings have no scope: one counter bumped by every message would be a write hotspot
+        await message_buffer.flush_avatar(avatar_id)
+        unchanged = await scope_not_modified(request, response, f"conversations:{avatar_id}")
+        if unchanged:
+            return unchanged
+    else:
+        # Message counts this worker has not written to the conversations yet, whichever they are
+        await message_store.flush()
+    sort = [("started_at", 1), ("id", 1)]
+    if view == "summary":
+        # List view: only the denormalized fields, never any message bodies
+        projection = {field: 1 for field in ConversationListItem.model_fields}
+        items = await paginate(
+            response, db.conversations, query, sort, limit, after, lambda doc: trusted(ConversationListItem, doc), projection
+        )
+        return respond(items, response)
+
+    conversations = await paginate(response, db.conversations, query, sort, limit, after, lambda doc: doc)
+    await message_buffer.flush([conversation["id"] for conversation in conversations])
+    messages = await read_conversation_messages(conversations)
+    return respond(
+        [trusted(Conversation, {**conversation, "messages": messages[conversation["id"]]}) for conversation in conversations],
+        response,
+    )
 
 @api_router.get("/conversations/{conversation_id}", response_model=Conversation)
-async def get_conversation(conversation_id: str):
-    conversation = await db.conversations.find_one({"id": conversation_id})
+async def get_conversation(conversation_id: str, request: Request, response: Response):
+    await message_buffer.flush([conversation_id])
+    conversation = await db.conversations.find_one({"id": conversation_id}, {"_id": 0})
     if not conversation:
         raise HTTPException(status_code=404, detail="Conversation not found")
-    return Conversation(**conversation)
+    # message_count and status are the conversation's version: appends bump one, ending sets the other
+    etag = entity_tag(conversation_id, conversation.get("message_count", 0), conversation["status"])
+    last_modified = conversation.get("ended_at") or conversation.get("last_message_at") or conversation["started_at"]
+    unchanged = not_modified(request, response, etag, last_modified)
+    if unchanged:
+        return unchanged
+    conversation["messages"] = (await read_conversation_messages([conversation]))[conversation_id]
+    if len(conversation["messages"]) != conversation.get("message_count", 0):
+        # An append's messages are written but message_count has not caught up; don't cache them under the old version
+        for header in ("ETag", "Last-Modified"):
+            del response.headers[header]
+    return respond(trusted(Conversation, conversation), response)
 
-@api_router.post("/conversations/{conversation_id}/messages")
-async def add_message(conversation_id: str, message: Message):
-    conversation = await db.conversations.find_one({"id": conversation_id})
+@api_router.get("/conversations/{conversation_id}/messages", response_model=List[StoredMessage])
+async def get_messages(
+    conversation_id: str,
+    last: Optional[int] = Query(None, ge=0, le=MAX_PAGE_SIZE),
+    since: Optional[datetime] = None,
+):
+    since = naive_utc(since)
+    await message_buffer.flush([conversation_id])
+    conversation = await db.conversations.find_one({"id": conversation_id}, {"_id": 0, "id": 1, "archived_at": 1})
     if not conversation:
         raise HTTPException(status_code=404, detail="Conversation not found")
-    
+    if conversation.get("archived_at"):
+        messages = select_messages((await read_conversation_messages([conversation]))[conversation_id], last, since)
+    else:
+        messages = await message_store.read(conversation_id, last=last, since=since)
+    return respond(trusted_list(StoredMessage, messages))
+
+@api_router.post("/conversations/{conversation_id}/messages")
+async def add_message(conversation_id: str, message: Message):
     message_dict = message.dict()
+    messages = [message_dict]
     
-    # Add the message to the conversation
-    await db.conversations.update_one(
-        {"id": conversation_id},
-        {"$push": {"messages": message_dict}}
-    )
-    
-    # If it's from a participant, generate AI response
+    # If it's from a participant, generate AI response up front so both messages go in one write
     if message.sender != "avatar":
-        avatar = await db.avatars.find_one({"id": conversation["avatar_id"]})
+        avatar_id = await get_conversation_avatar_id(conversation_id)
+        if not avatar_id:
+            raise HTTPException(status_code=404, detail="Conversation not found")
+        avatar = await avatar_cache.get(avatar_id)
         if avatar:
-            # Simple AI response generation (mock for now)
-            ai_response = f"As {avatar['name']}, I understand your message about '{message.content[:50]}...'. Let me respond based on my personality: {avatar['personality'][:100]}..."
+            context = knowledge_base.search(avatar, message.content, KNOWLEDGE_TOP_K)
+            ai_response = await responder.generate(avatar, message_dict, context)
             
             ai_message = Message(
                 sender="avatar",
                 content=ai_response
             )
-            
-            await db.conversations.update_one(
-                {"id": conversation_id},
-                {"$push": {"messages": ai_message.dict()}}
-            )
+            messages.append(ai_message.dict())
+    
+    # Add the messages to the conversation; an unknown conversation comes back as None
+    conversation = await message_buffer.append(conversation_id, messages)
+    if not conversation:
+        raise HTTPException(status_code=404, detail="Conversation not found")
     
     return {"message": "Message added successfully"}
 
+def bulk_result(index: int, status: str, conversation_id: Optional[str], seq: Optional[int] = None, detail: Optional[str] = None) -> dict:
+    return {"index": index, "status": status, "conversation_id": conversation_id, "seq": seq, "reply_seq": None, "detail": detail}
+
+@api_router.post("/messages/bulk", response_model=BulkMessageResponse)
+async def bulk_add_messages(request: BulkMessageRequest, current_user: User = Depends(get_current_user)):
+    if len(request.items) > MAX_BULK_MESSAGES:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BULK_MESSAGES} messages per request")
+
+    results: List[Optional[dict]] = [None] * len(request.items)
+    valid = []
+    for index, item in enumerate(request.items):
+        try:
+            valid.append((index, BulkMessage(**item)))
+        except ValidationError as error:
+            first = error.errors()[0]
+            detail = f"{'.'.join(str(part) for part in first['loc'])}: {first['msg']}"
+            results[index] = bulk_result(index, "invalid", item.get("conversation_id"), detail=detail)
+
+    # One query resolves every conversation; only the caller's own can be written to
+    avatars = {}
+    conversation_ids = list({message.conversation_id for _, message in valid})
+    async for conversation in db.conversations.find({"id": {"$in": conversation_ids}}, {"_id": 0, "id": 1, "avatar_id": 1}):
+        avatar = await get_owned_avatar(conversation["avatar_id"], current_user.id)
+        if avatar:
+            avatars[conversation["id"]] = avatar
+
+    # Per conversation, in request order: (item index, is_reply, message)
+    batches: Dict[str, list] = {}
+    for index, message in valid:
+        avatar = avatars.get(message.conversation_id)
+        if avatar is None:
+            results[index] = bulk_result(index, "not_found", message.conversation_id, detail="Conversation not found")
+            continue
+        message_dict = message.dict(exclude={"conversation_id"})
+        batch = batches.setdefault(message.conversation_id, [])
+        batch.append((index, False, message_dict))
+        if request.generate_replies and message.sender != "avatar":
+            context = knowledge_base.search(avatar, message.content, KNOWLEDGE_TOP_K)
+            reply = await responder.generate(avatar, message_dict, context)
+            batch.append((index, True, Message(sender="avatar", content=reply).dict()))
+
+    # Buffered messages for these conversations go first so sequence numbers follow arrival
+    await message_buffer.flush(list(batches))
+    conversations = await message_store.append_many(
+        {conversation_id: [message for _, _, message in batch] for conversation_id, batch in batches.items()}
+    )
+    for conversation_id, batch in batches.items():
+        conversation = conversations[conversation_id]
+        for position, (index, is_reply, _) in enumerate(batch):
+            if conversation is None:
+                # Deleted between the lookup and the write
+                results[index] = bulk_result(index, "not_found", conversation_id, detail="Conversation not found")
+            elif is_reply:
+                results[index]["reply_seq"] = conversation["seqs"][position]
+            else:
+                results[index] = bulk_result(index, "created", conversation_id, seq=conversation["seqs"][position])
+
+    created = sum(1 for result in results if result["status"] == "created")
+    return respond({"created": created, "failed": len(results) - created, "results": trusted_list(BulkMessageResult, results)})
+
+async def stream_avatar_reply(conversation: dict, message_dict: dict):
+    # Yields ("token", text) while the reply is generated, then ("done", message) once it is stored
+    if message_dict["sender"] == "avatar":
+        return
+    avatar = await avatar_cache.get(conversation["avatar_id"])
+    if not avatar:
+        return
+
+    context = knowledge_base.search(avatar, message_dict["content"], KNOWLEDGE_TOP_K)
+    tokens = []
+    ai_message = None
+    try:
+        async for token in responder.stream(avatar, message_dict, context):
+            tokens.append(token)
+            yield "token", token
+    finally:
+        # Keep whatever was generated even if the client went away mid-stream
+        if tokens:
+            ai_message = Message(sender="avatar", content="".join(tokens)).dict()
+            await asyncio.shield(message_buffer.append(conversation["id"], [ai_message]))
+    if ai_message:
+        yield "done", ai_message
+
+@api_router.post("/conversations/{conversation_id}/messages/stream")
+async def stream_message(conversation_id: str, message: Message):
+    message_dict = message.dict()
+    conversation = await message_buffer.append(conversation_id, [message_dict])
+    if not conversation:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+
+    async def events():
+        async for event, data in stream_avatar_reply(conversation, message_dict):
+            yield f"event: {event}\ndata: {json.dumps(jsonable_encoder(data))}\n\n"
+        yield "event: end\ndata: {}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@api_router.websocket("/conversations/{conversation_id}/ws")
+async def conversation_socket(websocket: WebSocket, conversation_id: str):
+    await websocket.accept()
+    try:
+        while True:
+            try:
+                message_dict = Message(**await websocket.receive_json()).dict()
+            except (ValueError, TypeError) as error:
+                await websocket.send_json({"type": "error", "detail": str(error)})
+                continue
+
+            conversation = await message_buffer.append(conversation_id, [message_dict])
+            if not conversation:
+                await websocket.send_json({"type": "error", "detail": "Conversation not found"})
+                await websocket.close(code=4404)
+                return
+
+            async for event, data in stream_avatar_reply(conversation, message_dict):
+                await websocket.send_json(jsonable_encoder({"type": event, "data": data}))
+            await websocket.send_json({"type": "end"})
+    except WebSocketDisconnect:
+        pass
+
 @api_router.put("/conversations/{conversation_id}/end")
 async def end_conversation(conversation_id: str):
-    result = await db.conversations.update_one(
+    await message_buffer.flush([conversation_id])
+    ended_at = datetime.utcnow()
+    # The previous state tells whether this call is the one that ended it, for the rollups
+    previous = await db.conversations.find_one_and_update(
         {"id": conversation_id},
-        {"$set": {"status": "ended", "ended_at": datetime.utcnow()}}
+        {"$set": {"status": "ended", "ended_at": ended_at}},
+        projection={"_id": 0, "avatar_id": 1, "status": 1, "started_at": 1, "message_count": 1},
     )
-    if result.matched_count == 0:
+    if previous is None:
         raise HTTPException(status_code=404, detail="Conversation not found")
+    await resource_versions.bump(f"conversations:{previous['avatar_id']}")
+    if previous.get("status") != "ended":
+        await analytics.conversation_ended(
+            previous["avatar_id"], previous["started_at"], ended_at, previous.get("message_count", 0)
+        )
+    await summary_jobs.enqueue(conversation_id)
     return {"message": "Conversation ended successfully"}
 
 # Summary Management Endpoints
-@api_router.post("/conversations/{conversation_id}/summary", response_model=Summary)
-async def generate_summary(conversation_id: str):
-    conversation = await db.conversations.find_one({"id": conversation_id})
+def summary_scopes(summary: dict) -> List[str]:
+    # The listings a summary appears in: its avatar's, and its owner's across avatars
+    scopes = [f"summaries:avatar:{summary['avatar_id']}"]
+    if summary.get("owner_id"):
+        scopes.append(f"summaries:owner:{summary['owner_id']}")
+    return scopes
+
+async def summarize_conversation(job: dict, report_stage) -> str:
+    # Summary job handler: folds messages added since the last run into the summary, returning its id
+    conversation_id = job["conversation_id"]
+    await message_buffer.flush([conversation_id])
+    conversation = await db.conversations.find_one({"id": conversation_id}, {"_id": 0})
     if not conversation:
-        raise HTTPException(status_code=404, detail="Conversation not found")
+        raise ValueError("Conversation not found")
     
-    # Check if summary already exists
-    existing_summary = await db.summaries.find_one({"conversation_id": conversation_id})
-    if existing_summary:
-        return Summary(**existing_summary)
+    existing_summary = await db.summaries.find_one({"conversation_id": conversation_id}, {"_id": 0})
+    summary = existing_summary or {}
+    watermark = summary.get("message_count", 0)
+    if existing_summary and watermark >= conversation.get("message_count", 0):
+        return existing_summary["id"]
+    
+    await report_stage("reading messages")
+    new_messages = await message_store.read_from(conversation_id, watermark)
     
     # Generate summary (mock implementation)
-    messages = conversation.get("messages", [])
-    participant_messages = [msg for msg in messages if msg["sender"] != "avatar"]
-    avatar_messages = [msg for msg in messages if msg["sender"] == "avatar"]
+    await report_stage("summarizing")
+    total_messages = watermark + len(new_messages)
+    participant_count = summary.get("participant_message_count", 0) + sum(1 for msg in new_messages if msg["sender"] != "avatar")
+    avatar_count = summary.get("avatar_message_count", 0) + sum(1 for msg in new_messages if msg["sender"] == "avatar")
+    first_message_preview = summary.get("first_message_preview") or (new_messages[0]["content"][:50] if new_messages else None)
+    last_message_preview = new_messages[-1]["content"][:50] if new_messages else summary.get("last_message_preview")
     
-    summary_text = f"Conversation between avatar and {conversation['participant_name']} with {len(messages)} total messages. "
-    summary_text += f"Participant sent {len(participant_messages)} messages, avatar responded {len(avatar_messages)} times."
+    summary_text = f"Conversation between avatar and {conversation['participant_name']} with {total_messages} total messages. "
+    summary_text += f"Participant sent {participant_count} messages, avatar responded {avatar_count} times."
     
     key_points = [
         f"Conversation started at {conversation['started_at']}",
-        f"Total messages exchanged: {len(messages)}",
+        f"Total messages exchanged: {total_messages}",
         f"Participant: {conversation['participant_name']}",
         f"Avatar ID: {conversation['avatar_id']}"
     ]
     
-    if messages:
-        key_points.append(f"First message: {messages[0]['content'][:50]}...")
-        key_points.append(f"Last message: {messages[-1]['content'][:50]}...")
+    if total_messages:
+        key_points.append(f"First message: {first_message_preview}...")
+        key_points.append(f"Last message: {last_message_preview}...")
     
+    fields = {
+        "summary_text": summary_text,
+        "key_points": key_points,
+        "message_count": total_messages,
+        "participant_message_count": participant_count,
+        "avatar_message_count": avatar_count,
+        "first_message_preview": first_message_preview,
+        "last_message_preview": last_message_preview,
+    }
+    
+    await report_stage("saving")
+    if existing_summary:
+        # Only advance from the watermark we read; a concurrent run that got there first wins.
+        # Summaries written before watermarks existed have no message_count at all.
+        read_watermark = watermark if "message_count" in summary else {"$exists": False}
+        result = await db.summaries.update_one(
+            {"id": existing_summary["id"], "message_count": read_watermark},
+            {"$set": {**fields, "updated_at": datetime.utcnow()}},
+        )
+        if result.modified_count:
+            await resource_versions.bump(*summary_scopes(existing_summary))
+        return existing_summary["id"]
+    
+    avatar = await avatar_cache.get(conversation["avatar_id"])
     summary_obj = Summary(
         avatar_id=conversation["avatar_id"],
+        owner_id=avatar["owner_id"] if avatar else None,
         conversation_id=conversation_id,
-        summary_text=summary_text,
-        key_points=key_points
+        **fields
     )
-    
-    await db.summaries.insert_one(summary_obj.dict())
-    return summary_obj
+    try:
+        await db.summaries.insert_one(summary_obj.dict())
+    except DuplicateKeyError:
+        # Another worker summarized this conversation first
+        existing_summary = await db.summaries.find_one({"conversation_id": conversation_id}, {"id": 1})
+        return existing_summary["id"]
+    await resource_versions.bump(*summary_scopes(summary_obj.dict()))
+    return summary_obj.id
+
+summary_jobs = SummaryJobQueue(
+    db.summary_jobs,
+    summarize_conversation,
+    concurrency=int(os.environ.get('SUMMARY_WORKERS', '2')),
+    # How often each process requeues jobs abandoned by a worker that died mid-run
+    reap_interval=timedelta(seconds=int(os.environ.get('SUMMARY_JOB_REAP_SECONDS', '60'))),
+)
+
+@api_router.post("/conversations/{conversation_id}/summary", response_model=SummaryJob, status_code=status.HTTP_202_ACCEPTED)
+async def generate_summary(conversation_id: str):
+    conversation = await db.conversations.find_one({"id": conversation_id}, {"_id": 1})
+    if not conversation:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    return await summary_jobs.enqueue(conversation_id)
+
+@api_router.get("/summary-jobs/{job_id}", response_model=SummaryJob)
+async def get_summary_job(job_id: str):
+    job = await summary_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Summary job not found")
+    return respond(trusted(SummaryJob, job))
 
 @api_router.get("/summaries", response_model=List[Summary])
-async def get_summaries(current_user: User = Depends(get_current_user), avatar_id: Optional[str] = None):
-    query = {}
+async def get_summaries(
+    request: Request,
+    response: Response,
+    current_user: User = Depends(get_current_user),
+    avatar_id: Optional[str] = None,
+    generated_after: Optional[datetime] = None,
+    generated_before: Optional[datetime] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+):
     if avatar_id:
         # Verify avatar belongs to current user
-        avatar = await db.avatars.find_one({"id": avatar_id, "owner_id": current_user.id})
+        avatar = await get_owned_avatar(avatar_id, current_user.id)
         if not avatar:
             raise HTTPException(status_code=404, detail="Avatar not found")
-        query["avatar_id"] = avatar_id
+        query = {"avatar_id": avatar_id}
+        scope = f"summaries:avatar:{avatar_id}"
     else:
-        # Get all avatars belonging to current user
-        user_avatars = await db.avatars.find({"owner_id": current_user.id}).to_list(1000)
-        avatar_ids = [avatar["id"] for avatar in user_avatars]
-        if avatar_ids:
-            query["avatar_id"] = {"$in": avatar_ids}
-        else:
-            return []  # No avatars, no summaries
+        # Summaries carry their avatar's owner, so one indexed range scan covers every avatar
+        query = {"owner_id": current_user.id}
+        scope = f"summaries:owner:{current_user.id}"
+    unchanged = await scope_not_modified(request, response, scope)
+    if unchanged:
+        return unchanged
+    
+    query.update(date_range("generated_at", generated_after, generated_before))
     
-    summaries = await db.summaries.find(query).sort("generated_at", -1).to_list(1000)
-    return [Summary(**summary) for summary in summaries]
+    sort = [("generated_at", -1), ("id", -1)]
+    summaries = await paginate(response, db.summaries, query, sort, limit, after, lambda doc: trusted(Summary, doc))
+    return respond(summaries, response)
 
 @api_router.get("/summaries/{summary_id}", response_model=Summary)
-async def get_summary(summary_id: str):
-    summary = await db.summaries.find_one({"id": summary_id})
+async def get_summary(summary_id: str, request: Request, response: Response):
+    summary = await db.summaries.find_one({"id": summary_id}, {"_id": 0})
     if not summary:
         raise HTTPException(status_code=404, detail="Summary not found")
-    return Summary(**summary)
+    # A summary only changes when it is advanced to a later message_count
+    last_modified = summary.get("updated_at") or summary["generated_at"]
+    unchanged = not_modified(request, response, entity_tag(summary_id, summary.get("message_count"), last_modified), last_modified)
+    if unchanged:
+        return unchanged
+    return respond(trusted(Summary, summary), response)
 
 @api_router.get("/avatars/{avatar_id}/summaries", response_model=List[Summary])
-async def get_avatar_summaries(avatar_id: str):
-    avatar = await db.avatars.find_one({"id": avatar_id})
+async def get_avatar_summaries(
+    avatar_id: str,
+    request: Request,
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+):
+    avatar = await avatar_cache.get(avatar_id)
     if not avatar:
         raise HTTPException(status_code=404, detail="Avatar not found")
+    unchanged = await scope_not_modified(request, response, f"summaries:avatar:{avatar_id}")
+    if unchanged:
+        return unchanged
     
-    summaries = await db.summaries.find({"avatar_id": avatar_id}).sort("generated_at", -1).to_list(1000)
-    return [Summary(**summary) for summary in summaries]
+    sort = [("generated_at", -1), ("id", -1)]
+    summaries = await paginate(
+        response, db.summaries, {"avatar_id": avatar_id}, sort, limit, after, lambda doc: trusted(Summary, doc)
+    )
+    return respond(summaries, response)
+
+# Search Endpoints
+@api_router.get("/search", response_model=List[SearchHit])
+async def search(
+    response: Response,
+    q: str = Query(..., min_length=1, max_length=200),
+    current_user: User = Depends(get_current_user),
+    avatar_id: Optional[str] = None,
+    kind: str = Query("all", pattern="^(all|message|summary)$"),
+    limit: int = Query(20, ge=1, le=100),
+    after: Optional[str] = None,
+):
+    if avatar_id:
+        if not await get_owned_avatar(avatar_id, current_user.id):
+            raise HTTPException(status_code=404, detail="Avatar not found")
+        avatar_ids = [avatar_id]
+    else:
+        avatar_ids = [avatar["id"] async for avatar in db.avatars.find({"owner_id": current_user.id}, {"_id": 0, "id": 1})]
+
+    # Hits are ranked by score, so the cursor is an offset into the ranking
+    try:
+        offset = decode_cursor(after)[0] if after else 0
+        if not isinstance(offset, int) or offset < 0:
+            raise InvalidCursor(after)
+    except (InvalidCursor, IndexError):
+        raise HTTPException(status_code=400, detail="Invalid pagination cursor")
+    kinds = ("message", "summary") if kind == "all" else (kind,)
+    hits, has_more = await conversation_search.search(q, avatar_ids, offset, limit, kinds)
+    if has_more:
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor([offset + limit])
+    return respond(trusted_list(SearchHit, hits), response)
+
+# Analytics Endpoints
+@api_router.get("/analytics", response_model=AnalyticsReport)
+async def get_analytics(
+    current_user: User = Depends(get_current_user),
+    avatar_id: Optional[str] = None,
+    granularity: str = Query("day", pattern="^(hour|day)$"),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+):
+    if avatar_id:
+        if not await get_owned_avatar(avatar_id, current_user.id):
+            raise HTTPException(status_code=404, detail="Avatar not found")
+        avatar_ids = [avatar_id]
+    else:
+        avatar_ids = [avatar["id"] async for avatar in db.avatars.find({"owner_id": current_user.id}, {"_id": 0, "id": 1})]
+
+    # Read from the rollups only, so the cost follows the number of periods, not the history size
+    step = GRANULARITIES[granularity]
+    # Rollup periods are stored as naive UTC; compare both bounds the same way, whichever carried an offset
+    end = naive_utc(end) or datetime.utcnow()
+    start = naive_utc(start) or end - 30 * step
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    if (end - start) / step > MAX_ANALYTICS_PERIODS:
+        raise HTTPException(status_code=400, detail=f"Range spans more than {MAX_ANALYTICS_PERIODS} periods")
+    report = await analytics.series(avatar_ids, granularity, start, end)
+    return respond(trusted(AnalyticsReport, {"granularity": granularity, "start": start, "end": end, **report}))
+
+# Export Endpoints
+def resume_after(query: dict, sort, after: Optional[str]) -> dict:
+    if not after:
+        return query
+    try:
+        return {"$and": [query, keyset_filter(sort, decode_cursor(after))]}
+    except InvalidCursor:
+        raise HTTPException(status_code=400, detail="Invalid export cursor")
+
+def export_response(cursor, sort, compress: bool, expand=None) -> StreamingResponse:
+    # NDJSON straight off the cursor; each line's _cursor resumes the export after it
+    chunks = ndjson_batches(cursor, [field for field, _ in sort], expand)
+    headers = {"Cache-Control": "no-cache"}
+    if compress:
+        chunks = gzip_chunks(chunks)
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(chunks, media_type=EXPORT_MEDIA_TYPE, headers=headers)
+
+@api_router.get("/export/conversations")
+async def export_conversations(
+    current_user: User = Depends(get_current_user),
+    avatar_id: Optional[str] = None,
+    status: Optional[str] = Query(None, pattern="^(active|ended)$"),
+    started_after: Optional[datetime] = None,
+    started_before: Optional[datetime] = None,
+    include_messages: bool = True,
+    compress: bool = False,
+    after: Optional[str] = None,
+):
+    if avatar_id:
+        if not await get_owned_avatar(avatar_id, current_user.id):
+            raise HTTPException(status_code=404, detail="Avatar not found")
+        query = {"avatar_id": avatar_id}
+    else:
+        avatar_ids = [avatar["id"] async for avatar in db.avatars.find({"owner_id": current_user.id}, {"_id": 0, "id": 1})]
+        query = {"avatar_id": {"$in": avatar_ids}}
+    if status:
+        query["status"] = status
+    query.update(date_range("started_at", started_after, started_before))
+
+    sort = [("started_at", 1), ("id", 1)]
+    cursor = db.conversations.find(resume_after(query, sort, after), {"_id": 0}).sort(sort).batch_size(500)
+
+    async def with_messages(batch):
+        await message_buffer.flush([conversation["id"] for conversation in batch])
+        messages = await read_conversation_messages(batch)
+        return [{**conversation, "messages": messages[conversation["id"]]} for conversation in batch]
+
+    return export_response(cursor, sort, compress, with_messages if include_messages else None)
+
+@api_router.get("/export/summaries")
+async def export_summaries(
+    current_user: User = Depends(get_current_user),
+    avatar_id: Optional[str] = None,
+    generated_after: Optional[datetime] = None,
+    generated_before: Optional[datetime] = None,
+    compress: bool = False,
+    after: Optional[str] = None,
+):
+    if avatar_id:
+        if not await get_owned_avatar(avatar_id, current_user.id):
+            raise HTTPException(status_code=404, detail="Avatar not found")
+        query = {"avatar_id": avatar_id}
+    else:
+        query = {"owner_id": current_user.id}
+    query.update(date_range("generated_at", generated_after, generated_before))
+
+    sort = [("generated_at", 1), ("id", 1)]
+    cursor = db.summaries.find(resume_after(query, sort, after), {"_id": 0}).sort(sort).batch_size(500)
+    return export_response(cursor, sort, compress)
 
 # Include the router in the main app
 app.include_router(api_router)
 
+# Scraped by Prometheus, so it lives outside /api and needs no token
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    return Response(content=metrics_registry.render(), media_type=METRICS_CONTENT_TYPE)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER],
 )
 
+# Per-request DB time for the slow-query log, reported in a Server-Timing header unless disabled
+app.add_middleware(ServerTimingMiddleware, enabled=os.environ.get('SERVER_TIMING', 'true').lower() == 'true')
+
+# Added last so it wraps everything else and times the whole request
+app.add_middleware(MetricsMiddleware, registry=metrics_registry)
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -473,8 +1367,33 @@ logger = logging.getLogger(__name__)
 
 @app.on_event("startup")
 async def startup_event():
+    await dedupe_summaries()
+    await ensure_indexes(db)
+    await cache_invalidation_channel.start()
+    if VERIFY_QUERY_PLANS:
+        await verify_query_plans(db)
+    # Data migrations scan whole collections, so each runs once per database
+    await run_once(db.migrations, "buckets_from_embedded_messages", lambda started_at: message_store.migrate_embedded())
+    await run_once(db.migrations, "bucket_avatar_ids", lambda started_at: message_store.backfill_avatar_ids())
+    await run_once(db.migrations, "bucket_starts", lambda started_at: message_store.backfill_starts())
+    await run_once(db.migrations, "avatar_images_to_blobs", lambda started_at: offload_inline_avatar_images())
+    # Rollups count live from the first boot that runs this; older history is recomputed
+    await run_once(db.migrations, "analytics_rollups_backfill", lambda started_at: analytics.backfill(db, started_at))
+    await run_once(db.migrations, "archive_drop_search_contents", lambda started_at: conversation_archive.drop_search_contents())
+    await backfill_summary_owners()
+    await summary_jobs.start()
+    if ARCHIVE_INTERVAL_SECONDS > 0:
+        await conversation_archive.start(ARCHIVE_INTERVAL_SECONDS)
     await init_admin_user()
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    # Writers first, then the debounced counts and version bumps they queued, all before the client closes
+    await message_buffer.drain()
+    await conversation_archive.stop()
+    await summary_jobs.stop()
+    await analytics.drain()
+    await resource_versions.drain()
+    await cache_invalidation_channel.stop()
     client.close()
+    password_hasher.shutdown()
@@ -0,0 +1,176 @@
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Optional
+
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+
+class SummaryJobQueue:
+    """Background summary generation with at most one live job per conversation.
+
+    Jobs are persisted in ``collection`` and executed by ``concurrency`` asyncio
+    workers in this process. While a job is queued or running its unique
+    ``dedupe_key`` is the conversation id, so enqueueing a duplicate returns the
+    live job instead of creating another; once finished the key becomes the job id.
+
+    A job cancelled mid-run, as on shutdown, goes back to queued. One whose
+    process died stays running until its ``lease`` lapses; every
+    ``reap_interval`` each process requeues such jobs and runs them. Each
+    claim is tagged, so a run whose job was meanwhile requeued and claimed
+    again does not overwrite the newer run's outcome.
+    """
+
+    def __init__(self, collection, handler: Callable[[dict, Callable[[str], Awaitable[None]]], Awaitable[str]],
+                 concurrency: int = 2, lease: timedelta = timedelta(minutes=5),
+                 reap_interval: timedelta = timedelta(minutes=1)):
+        self._collection = collection
+        self._handler = handler
+        self.concurrency = concurrency
+        self.lease = lease
+        self.reap_interval = reap_interval
+        # Marks the jobs this process claimed, so stop() can hand back the ones it leaves unfinished
+        self.worker_id = str(uuid.uuid4())
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._workers = []
+        self._reaper: Optional[asyncio.Task] = None
+        self._running = 0
+        self._completed = 0
+        self._failed = 0
+        self._requeued = 0
+
+    async def start(self):
+        # Pick up jobs left behind by a previous process; running ones only once their lease lapsed
+        await self.requeue_stale()
+        async for job in self._collection.find({"status": "queued"}, {"id": 1}):
+            self._queue.put_nowait(job["id"])
+        self._workers = [asyncio.create_task(self._work()) for _ in range(self.concurrency)]
+        self._reaper = asyncio.create_task(self._reap())
+
+    async def stop(self):
+        tasks = self._workers + ([self._reaper] if self._reaper else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._workers = []
+        self._reaper = None
+        # A worker cancelled before it could requeue its job (e.g. mid-claim) leaves it running under this process
+        await self._collection.update_many(
+            {"status": "running", "claimed_by": self.worker_id},
+            {"$set": {"status": "queued", "stage": None, "claim": None, "claimed_by": None}},
+        )
+
+    async def requeue_stale(self) -> int:
+        """Requeue running jobs whose lease lapsed and queue them here; returns how many."""
+        stale = {"status": "running", "started_at": {"$lt": datetime.utcnow() - self.lease}}
+        requeued = 0
+        async for job in self._collection.find(stale, {"id": 1}):
+            # Conditional, so of several processes reaping at once only one queues each job
+            result = await self._collection.update_one(
+                {"id": job["id"], **stale}, {"$set": {"status": "queued", "stage": None, "claim": None, "claimed_by": None}}
+            )
+            if result.modified_count:
+                self._queue.put_nowait(job["id"])
+                requeued += 1
+        if requeued:
+            self._requeued += requeued
+            logger.warning("Requeued %d summary jobs whose lease lapsed", requeued)
+        return requeued
+
+    async def _reap(self):
+        while True:
+            await asyncio.sleep(self.reap_interval.total_seconds())
+            try:
+                await self.requeue_stale()
+            except Exception:
+                logger.exception("Requeueing stale summary jobs failed")
+
+    async def enqueue(self, conversation_id: str) -> dict:
+        job = {
+            "id": str(uuid.uuid4()),
+            "conversation_id": conversation_id,
+            "status": "queued",
+            "dedupe_key": conversation_id,
+            "stage": None,
+            "summary_id": None,
+            "error": None,
+            "queued_at": datetime.utcnow(),
+            "started_at": None,
+            "finished_at": None,
+        }
+        for _ in range(2):
+            try:
+                await self._collection.insert_one(dict(job))
+            except DuplicateKeyError:
+                # A job for this conversation is already queued or running
+                existing = await self._collection.find_one({"dedupe_key": conversation_id}, {"_id": 0})
+                if existing:
+                    return existing
+                # It finished between the insert and the lookup; try once more
+                continue
+            self._queue.put_nowait(job["id"])
+            return job
+        raise RuntimeError(f"Could not enqueue summary job for conversation {conversation_id}")
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        return await self._collection.find_one({"id": job_id}, {"_id": 0})
+
+    async def _work(self):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+            except Exception:
+                logger.exception("Summary job %s crashed", job_id)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job_id: str):
+        # Claim atomically so a job is never run twice
+        claim = {"status": "running", "started_at": datetime.utcnow(), "claim": str(uuid.uuid4()), "claimed_by": self.worker_id}
+        job = await self._collection.find_one_and_update(
+            {"id": job_id, "status": "queued"},
+            {"$set": claim},
+            projection={"_id": 0},
+        )
+        if job is None:
+            return
+        job.update(claim)
+        this_claim = {"id": job_id, "claim": claim["claim"]}
+
+        async def report_stage(stage: str):
+            await self._collection.update_one(this_claim, {"$set": {"stage": stage}})
+
+        self._running += 1
+        try:
+            summary_id = await self._handler(job, report_stage)
+        except asyncio.CancelledError:
+            # Left running, the job would hold its dedupe_key until the lease lapsed
+            await self._collection.update_one(
+                this_claim, {"$set": {"status": "queued", "stage": None, "claim": None, "claimed_by": None}}
+            )
+            raise
+        except Exception as error:
+            self._failed += 1
+            logger.exception("Summary job %s failed", job_id)
+            update = {"status": "failed", "error": str(error)}
+        else:
+            self._completed += 1
+            update = {"status": "completed", "summary_id": summary_id}
+        finally:
+            self._running -= 1
+        update.update({"dedupe_key": job_id, "stage": None, "finished_at": datetime.utcnow()})
+        await self._collection.update_one(this_claim, {"$set": update})
+
+    def stats(self) -> dict:
+        return {
+            "concurrency": self.concurrency,
+            "queued": self._queue.qsize(),
+            "running": self._running,
+            "completed": self._completed,
+            "failed": self._failed,
+            "requeued": self._requeued,
+        }
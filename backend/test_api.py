@@ -0,0 +1,163 @@
+import base64
+import os
+import tempfile
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from benchmarks import mongo_harness
+
+# In-process Mongo stand-in; must be installed before server is imported
+mongo_harness.install_fake()
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+os.environ["DB_NAME"] = "zeny_ai_test_api"
+os.environ["BLOB_ROOT"] = tempfile.mkdtemp(prefix="zeny-test-blobs-")
+
+import server  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(server.app) as test_client:
+        yield test_client
+
+
+def login(client, username, password):
+    response = client.post("/api/auth/login", json={"username": username, "password": password})
+    assert response.status_code == 200, response.text
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+@pytest.fixture(scope="module")
+def admin(client):
+    return login(client, server.ADMIN_USERNAME, server.ADMIN_PASSWORD)
+
+
+def test_renaming_the_admin_drops_its_principals_on_every_worker(client, admin):
+    published = []
+    server.cache_invalidation_channel.subscribe(published.append)
+    old_username, old_password = server.ADMIN_USERNAME, server.ADMIN_PASSWORD
+    assert client.get("/api/auth/me", headers=admin).status_code == 200
+
+    response = client.put(
+        "/api/auth/admin/credentials", json={"new_username": "renamed", "new_password": "secret"}, headers=admin
+    )
+    assert response.status_code == 200
+    assert f"user:{old_username}" in published
+    assert client.get("/api/auth/me", headers=admin).status_code == 401
+
+    renamed = login(client, "renamed", "secret")
+    client.put("/api/auth/admin/credentials", json={"new_username": old_username, "new_password": old_password}, headers=renamed)
+    admin.update(login(client, old_username, old_password))
+
+
+def test_invalidation_from_another_worker_drops_cached_principals(client, admin):
+    token = admin["Authorization"].split()[1]
+    assert client.get("/api/auth/me", headers=admin).status_code == 200
+    assert server.principal_cache.get(token) is not None
+    # What MongoInvalidationChannel delivers when another worker publishes
+    server.cache_invalidation_channel._deliver(f"user:{server.ADMIN_USERNAME}")
+    assert server.principal_cache.get(token) is None
+
+
+@pytest.mark.parametrize("raw", [b'[{"$oid": "zz"}]', b'[{"$date": "x"}, "id"]'])
+def test_crafted_cursor_is_a_bad_request(client, admin, raw):
+    after = base64.urlsafe_b64encode(raw).decode()
+    assert client.get("/api/avatars", params={"after": after}, headers=admin).status_code == 400
+
+
+@pytest.fixture(scope="module")
+def avatar(client, admin):
+    response = client.post(
+        "/api/avatars", json={"name": "Tester", "personality": "Calm", "description": "Test avatar"}, headers=admin
+    )
+    assert response.status_code == 200
+    return response.json()
+
+
+@pytest.fixture(scope="module")
+def conversation(client, avatar):
+    conversation = client.post("/api/conversations", json={"avatar_id": avatar["id"], "participant_name": "p"}).json()
+    response = client.post(f"/api/conversations/{conversation['id']}/messages", json={"sender": "participant", "content": "hello"})
+    assert response.status_code == 200
+    return conversation
+
+
+@pytest.mark.parametrize("since", ["2020-01-01T00:00:00Z", "2020-01-01T02:00:00+02:00", "2020-01-01T00:00:00"])
+def test_messages_since_accepts_offsets(client, conversation, since):
+    response = client.get(f"/api/conversations/{conversation['id']}/messages", params={"since": since})
+    assert response.status_code == 200
+    assert [message["sender"] for message in response.json()] == ["participant", "avatar"]
+
+
+def test_messages_since_an_aware_time_filters_in_utc(client, conversation):
+    messages = client.get(f"/api/conversations/{conversation['id']}/messages").json()
+    # The same instant as the last message, written with an offset: nothing is strictly after it
+    last = datetime.fromisoformat(messages[-1]["timestamp"]).replace(tzinfo=timezone.utc).astimezone(timezone(timedelta(hours=5)))
+    response = client.get(f"/api/conversations/{conversation['id']}/messages", params={"since": last.isoformat()})
+    assert response.status_code == 200
+    assert response.json() == []
+
+
+
+def test_analytics_compares_an_aware_start_with_the_default_end(client, admin):
+    start = (datetime.now(timezone.utc) - timedelta(days=10)).replace(microsecond=0)
+    response = client.get("/api/analytics", params={"start": start.isoformat()}, headers=admin)
+    assert response.status_code == 200, response.text
+    assert response.json()["start"] == start.replace(tzinfo=None).isoformat()
+
+
+@pytest.mark.parametrize("bounds", [
+    {"start": "2024-01-01T00:00:00Z", "end": "2024-01-02T00:00:00"},
+    {"start": "2024-01-01T00:00:00", "end": "2024-01-02T02:00:00+02:00"},
+])
+def test_analytics_compares_bounds_with_and_without_offsets(client, admin, bounds):
+    response = client.get("/api/analytics", params=bounds, headers=admin)
+    assert response.status_code == 200, response.text
+    assert (response.json()["start"], response.json()["end"]) == ("2024-01-01T00:00:00", "2024-01-02T00:00:00")
+
+
+PNG = base64.b64encode(b"\x89PNG\r\n\x1a\n" + bytes(range(32))).decode()
+
+
+def test_svg_avatar_images_are_rejected(client, admin):
+    svg = base64.b64encode(b'<svg xmlns="http://www.w3.org/2000/svg" onload="alert(1)"/>').decode()
+    response = client.post(
+        "/api/avatars",
+        json={"name": "Svg", "personality": "p", "description": "d", "avatar_image": f"data:image/svg+xml;base64,{svg}"},
+        headers=admin,
+    )
+    assert response.status_code == 400
+
+
+def test_images_are_served_with_no_sniffing_or_active_content(client, admin):
+    response = client.post(
+        "/api/avatars",
+        json={"name": "Png", "personality": "p", "description": "d", "avatar_image": f"data:IMAGE/PNG;base64,{PNG}"},
+        headers=admin,
+    )
+    assert response.status_code == 200, response.text
+    url = f"/api/images/{response.json()['avatar_image_hash']}"
+    full = client.get(url)
+    partial = client.get(url, headers={"Range": "bytes=0-7"})
+    cached = client.get(url, headers={"If-None-Match": full.headers["ETag"]})
+
+    assert full.content == base64.b64decode(PNG)
+    assert full.headers["Content-Type"] == "image/png"
+    assert (partial.status_code, partial.content) == (206, b"\x89PNG\r\n\x1a\n")
+    assert cached.status_code == 304
+    for served in (full, partial, cached):
+        assert served.headers["X-Content-Type-Options"] == "nosniff"
+        assert served.headers["Content-Security-Policy"] == "default-src 'none'"
+
+
+def test_a_conversation_is_not_modified_until_a_message_arrives(client, conversation):
+    url = f"/api/conversations/{conversation['id']}"
+    etag = client.get(url).headers["ETag"]
+    assert client.get(url, headers={"If-None-Match": etag}).status_code == 304
+
+    client.post(f"{url}/messages", json={"sender": "participant", "content": "again"})
+    changed = client.get(url, headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag
@@ -0,0 +1,82 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from pymongo import ASCENDING, TEXT, IndexModel
+
+from archive import ConversationArchive, merge_messages, pack, unpack
+from benchmarks.mongo_harness import LatencyClient, RoundTripRecorder
+from indexes import ensure_indexes
+from message_store import MessageStore
+
+
+def message(seq, content):
+    return {"seq": seq, "sender": "participant", "content": content, "timestamp": datetime(2024, 1, 1, 0, 0, seq)}
+
+
+async def make_archive(name):
+    db = LatencyClient(RoundTripRecorder())[name]
+    await ensure_indexes(db)
+    store = MessageStore(db, bucket_size=3)
+    return db, store, ConversationArchive(db, store, after=timedelta(days=30))
+
+
+async def ended_conversation(db, store, conversation_id, contents, summarized):
+    ended_at = datetime.utcnow() - timedelta(days=60)
+    await db.conversations.insert_one({
+        "id": conversation_id, "avatar_id": "a", "status": "ended", "archived_at": None, "ended_at": ended_at, "message_count": 0,
+    })
+    await store.append(conversation_id, [
+        {"sender": "participant", "content": content, "timestamp": datetime.utcnow()} for content in contents
+    ])
+    await store.flush()
+    await db.summaries.insert_one({"id": f"s-{conversation_id}", "conversation_id": conversation_id, "message_count": summarized})
+
+
+def test_pack_round_trips_messages_and_is_deterministic():
+    messages = [message(0, "hello"), message(1, "héllo again")]
+    assert unpack(pack(messages)) == messages
+    assert pack(messages) == pack(messages)
+
+
+def test_merge_prefers_hot_copies_and_orders_by_seq():
+    archived = [message(0, "a"), message(1, "b")]
+    hot = [message(1, "b (still hot)"), message(2, "c")]
+    assert [m["content"] for m in merge_messages(archived, hot)] == ["a", "b (still hot)", "c"]
+
+
+def test_only_fully_summarized_conversations_are_archived():
+    async def scenario():
+        db, store, archive = await make_archive("test_archive_due")
+        await ended_conversation(db, store, "done", ["one", "two", "three", "four"], summarized=4)
+        await ended_conversation(db, store, "behind", ["one", "two"], summarized=1)
+        archived = await archive.archive_due()
+        stored = await db.conversation_archive.find_one({"conversation_id": "done"}, {"_id": 0})
+        hot = {conversation_id: await store.read(conversation_id) for conversation_id in ("done", "behind")}
+        return archived, stored, hot, (await archive.read_many(["done", "behind"])), archive.stats()
+
+    archived, stored, hot, read, stats = asyncio.run(scenario())
+    assert archived == 1
+    assert "contents" not in stored
+    assert stored["message_count"] == 4
+    assert hot["done"] == [] and len(hot["behind"]) == 2
+    assert list(read) == ["done"]
+    assert [(m["seq"], m["content"]) for m in read["done"]] == [(0, "one"), (1, "two"), (2, "three"), (3, "four")]
+    assert stats["archived"] == 1
+    assert stats["stored_bytes"] == len(stored["payload"])
+
+
+def test_dropping_search_contents_removes_the_copy_and_its_index():
+    async def scenario():
+        db, store, archive = await make_archive("test_archive_drop_contents")
+        await db.conversation_archive.create_indexes([IndexModel([("avatar_id", ASCENDING), ("contents", TEXT)], name="avatar_text")])
+        await db.conversation_archive.insert_one(
+            {"conversation_id": "c", "avatar_id": "a", "payload": pack([message(0, "x")]), "contents": ["x"]}
+        )
+        await archive.drop_search_contents()
+        # Safe to re-run once there is nothing left to drop
+        await archive.drop_search_contents()
+        return await db.conversation_archive.find_one({"conversation_id": "c"}), await db.conversation_archive.index_information()
+
+    document, indexes = asyncio.run(scenario())
+    assert "contents" not in document
+    assert "avatar_text" not in indexes
@@ -0,0 +1,55 @@
+import asyncio
+
+import pytest
+
+from blobs import BlobStore, LocalBlobStore, parse_data_url, parse_range
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-9", (0, 9)),
+    ("bytes=90-", (90, 99)),
+    ("bytes=-10", (90, 99)),
+    ("bytes=-500", (0, 99)),
+    ("bytes=95-500", (95, 99)),
+    ("bytes=0-1,5-6", None),
+    ("items=0-1", None),
+    ("bytes=-", None),
+])
+def test_parse_range(header, expected):
+    assert parse_range(header, 100) == expected
+
+
+@pytest.mark.parametrize("header", ["bytes=100-", "bytes=9-3"])
+def test_unsatisfiable_ranges_raise(header):
+    with pytest.raises(ValueError):
+        parse_range(header, 100)
+
+
+def test_parse_data_url():
+    assert parse_data_url("data:image/png;base64,aGk=") == (b"hi", "image/png")
+    assert parse_data_url("data:;base64,aGk=") == (b"hi", "application/octet-stream")
+    assert parse_data_url("https://example.com/a.png") is None
+    with pytest.raises(ValueError):
+        parse_data_url("data:image/png,raw")
+    with pytest.raises(ValueError):
+        parse_data_url("data:image/png;base64,not base64!")
+
+
+def test_blob_store_is_abstract():
+    with pytest.raises(TypeError):
+        BlobStore()
+
+
+def test_local_blobs_are_stored_once_by_digest(tmp_path):
+    async def scenario():
+        store = LocalBlobStore(tmp_path)
+        digest = await store.put(b"0123456789", "image/png")
+        again = await store.put(b"0123456789", "image/png")
+        return digest, again, await store.stat(digest), await store.read(digest, 2, 4), await store.stat("0" * 64)
+
+    digest, again, stat, part, missing = asyncio.run(scenario())
+    assert digest == again == BlobStore.digest(b"0123456789")
+    assert stat == {"size": 10, "content_type": "image/png"}
+    assert part == b"234"
+    assert missing is None
+    assert sorted(path.name for path in tmp_path.rglob("*") if path.is_file()) == [digest, f"{digest}.type"]
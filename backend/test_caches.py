@@ -0,0 +1,68 @@
+import asyncio
+
+import caches
+from benchmarks.mongo_harness import LatencyClient, RoundTripRecorder
+from caches import AvatarCache, LocalInvalidationChannel, TTLCache
+
+
+def test_ttl_cache_evicts_the_least_recently_used():
+    cache = TTLCache(maxsize=2, ttl=10)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert (cache.get("a"), cache.get("b"), cache.get("c")) == (1, None, 3)
+    assert cache.stats()["evictions"] == 1
+
+
+def test_ttl_cache_entries_expire(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(caches.time, "monotonic", lambda: now[0])
+    cache = TTLCache(ttl=10)
+    cache.set("a", 1)
+    cache.set("b", 2, ttl=60)
+    now[0] += 11
+    # A per-entry ttl cannot outlive the cache's own
+    assert (cache.get("a"), cache.get("b")) == (None, None)
+
+
+async def make_cache(name):
+    recorder = RoundTripRecorder()
+    db = LatencyClient(recorder)[name]
+    await db.avatars.insert_one({"id": "a", "name": "Old"})
+    channel = LocalInvalidationChannel()
+    return db, recorder, channel, AvatarCache(db.avatars, TTLCache(), channel)
+
+
+def test_avatar_reads_go_through_the_cache_until_invalidated():
+    async def scenario():
+        db, recorder, _, cache = await make_cache("test_cache_read_through")
+        recorder.reset()
+        first, second = await cache.get("a"), await cache.get("a")
+        reads_before = recorder.counts[("avatars", "find_one")]
+        await db.avatars.update_one({"id": "a"}, {"$set": {"name": "New"}})
+        await cache.invalidate("a")
+        return first["name"], second["name"], reads_before, (await cache.get("a"))["name"]
+
+    assert asyncio.run(scenario()) == ("Old", "Old", 1, "New")
+
+
+def test_an_invalidation_during_a_read_is_not_undone():
+    async def scenario():
+        db, _, channel, cache = await make_cache("test_cache_read_race")
+        avatars = cache._collection
+        find_one = avatars.find_one
+
+        async def slow_find_one(*args, **kwargs):
+            avatar = await find_one(*args, **kwargs)
+            # The avatar changes, and another worker's invalidation arrives, while this read is in flight
+            await db.avatars.update_one({"id": "a"}, {"$set": {"name": "New"}})
+            channel._deliver("a")
+            return avatar
+
+        avatars.find_one = slow_find_one
+        stale = await cache.get("a")
+        avatars.find_one = find_one
+        return stale["name"], (await cache.get("a"))["name"]
+
+    assert asyncio.run(scenario()) == ("Old", "New")
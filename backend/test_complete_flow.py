@@ -5,6 +5,15 @@ import time
 # API base URL
 API_BASE = "http://localhost:8001/api"
 
+def wait_for_summary(job):
+    # Summary generation runs in the background; poll the job until it settles
+    while job['status'] in ('queued', 'running'):
+        time.sleep(0.5)
+        job = requests.get(f"{API_BASE}/summary-jobs/{job['id']}").json()
+    if job['status'] != 'completed':
+        return None
+    return requests.get(f"{API_BASE}/summaries/{job['summary_id']}").json()
+
 def test_complete_flow():
     print("=== Testing Complete Zeny AI Flow with Authentication ===")
     
@@ -93,11 +102,11 @@ def test_complete_flow():
     # Step 6: Generate summary
     print("\n6. Generating summary...")
     response = requests.post(f"{API_BASE}/conversations/{conversation_id}/summary")
-    if response.status_code != 200:
+    summary = wait_for_summary(response.json()) if response.status_code == 202 else None
+    if not summary:
         print(f"Summary generation failed: {response.text}")
         return
     
-    summary = response.json()
     print(f"✅ Generated summary:")
     print(f"Summary ID: {summary['id']}")
     print(f"Summary Text: {summary['summary_text']}")
@@ -0,0 +1,73 @@
+import asyncio
+from datetime import datetime
+
+from benchmarks.mongo_harness import LatencyClient, RoundTripRecorder
+from message_store import MessageStore, WriteBehindBuffer
+
+LATENCY = 0.05
+
+
+def message(content):
+    return {"sender": "participant", "content": content, "timestamp": datetime.utcnow()}
+
+
+async def make_store():
+    db = LatencyClient(RoundTripRecorder(LATENCY))["test_message_buffer"]
+    for conversation_id in ("c", "d"):
+        await db.conversations.insert_one({"id": conversation_id, "avatar_id": "a", "message_count": 0})
+    return MessageStore(db)
+
+
+async def resolve(conversation_id):
+    return "a"
+
+
+def test_flush_waits_for_a_flush_in_flight():
+    async def scenario():
+        store = await make_store()
+        buffer = WriteBehindBuffer(store, max_delay=0.01, durability="async", resolve=resolve)
+        await buffer.append("c", [message("hello")])
+        # Let the timer's flush take the message and start writing it
+        await asyncio.sleep(0.02)
+        assert "c" not in buffer._pending
+        await buffer.flush(["c"])
+        return await store.read("c")
+
+    assert [message["content"] for message in asyncio.run(scenario())] == ["hello"]
+
+
+def test_flush_writes_only_the_given_conversations():
+    async def scenario():
+        store = await make_store()
+        buffer = WriteBehindBuffer(store, max_delay=60, durability="async", resolve=resolve)
+        await buffer.append("c", [message("to c")])
+        await buffer.append("d", [message("to d")])
+        await buffer.flush(["c"])
+        written = await store.read("c"), await store.read("d"), buffer.stats()["pending"]
+        await buffer.drain()
+        return written + (await store.read("d"),)
+
+    c_messages, d_before_drain, pending, d_after_drain = asyncio.run(scenario())
+    assert [message["seq"] for message in c_messages] == [0]
+    assert d_before_drain == []
+    assert pending == 1
+    assert [message["content"] for message in d_after_drain] == ["to d"]
+
+
+def test_flush_avatar_leaves_other_avatars_buffered():
+    async def scenario():
+        store = await make_store()
+        avatars = {"c": "a", "d": "b"}
+
+        async def resolve_avatar(conversation_id):
+            return avatars[conversation_id]
+
+        buffer = WriteBehindBuffer(store, max_delay=60, durability="async", resolve=resolve_avatar)
+        await buffer.append("c", [message("to c")])
+        await buffer.append("d", [message("to d")])
+        await buffer.flush_avatar("a")
+        written = len(await store.read("c")), len(await store.read("d"))
+        await buffer.drain()
+        return written
+
+    assert asyncio.run(scenario()) == (1, 0)
@@ -0,0 +1,208 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from archive import ConversationArchive
+from benchmarks.mongo_harness import LatencyClient, RoundTripRecorder
+from caches import TTLCache
+from indexes import ensure_indexes
+from message_store import MessageStore
+
+
+def message(content):
+    return {"sender": "participant", "content": content, "timestamp": datetime.utcnow()}
+
+
+async def make_store(name, bucket_size=3, recorder=None, **options):
+    db = LatencyClient(recorder or RoundTripRecorder())[name]
+    await ensure_indexes(db)
+    await db.conversations.insert_one({"id": "c", "avatar_id": "a", "message_count": 0})
+    return db, MessageStore(db, bucket_size=bucket_size, **options)
+
+
+async def resolve(conversation_id):
+    return "a" if conversation_id == "c" else None
+
+
+def test_appends_number_messages_consecutively_across_buckets():
+    async def scenario():
+        db, store = await make_store("test_store_consecutive")
+        # The second pair does not fit the first bucket's last slot, which is sealed instead
+        seqs = [(await store.append("c", [message(f"{index}a"), message(f"{index}b")]))["seqs"] for index in range(3)]
+        buckets = await db.message_buckets.find({}, {"_id": 0, "bucket": 1, "start": 1, "count": 1, "sealed": 1}).to_list(None)
+        await store.flush()
+        return seqs, await store.read("c"), buckets, await db.conversations.find_one({"id": "c"})
+
+    seqs, messages, buckets, conversation = asyncio.run(scenario())
+    assert seqs == [[0, 1], [2, 3], [4, 5]]
+    assert [(message["seq"], message["content"]) for message in messages] == [
+        (0, "0a"), (1, "0b"), (2, "1a"), (3, "1b"), (4, "2a"), (5, "2b")
+    ]
+    assert sorted((bucket["bucket"], bucket["start"], bucket["count"], bucket.get("sealed", False)) for bucket in buckets) == [
+        (0, 0, 2, True), (1, 2, 2, True), (2, 4, 2, False)
+    ]
+    assert conversation["message_count"] == 6
+    assert conversation["last_message_preview"] == "2b"
+
+
+def test_a_failed_bucket_write_leaves_no_gap():
+    async def scenario():
+        db, store = await make_store("test_store_failed_write")
+        await store.append("c", [message("kept")])
+        push = store.buckets.find_one_and_update
+
+        async def fail(*args, **kwargs):
+            raise ConnectionError("primary stepped down")
+
+        store.buckets.find_one_and_update = fail
+        with pytest.raises(ConnectionError):
+            await store.append("c", [message("lost")])
+        store.buckets.find_one_and_update = push
+        appended = await store.append("c", [message("next")])
+        await store.flush()
+        return appended, await store.read("c"), await db.conversations.find_one({"id": "c"})
+
+    appended, messages, conversation = asyncio.run(scenario())
+    assert appended["seqs"] == [1]
+    assert [(message["seq"], message["content"]) for message in messages] == [(0, "kept"), (1, "next")]
+    assert conversation["message_count"] == 2
+
+
+def test_concurrent_appends_get_distinct_consecutive_numbers():
+    async def scenario():
+        db, store = await make_store("test_store_concurrent")
+        appended = await asyncio.gather(*(store.append("c", [message(f"m{index}")]) for index in range(20)))
+        return [seq for result in appended for seq in result["seqs"]], await store.read("c")
+
+    seqs, messages = asyncio.run(scenario())
+    assert sorted(seqs) == list(range(20))
+    assert [message["seq"] for message in messages] == list(range(20))
+
+
+def test_appends_larger_than_a_bucket_are_split():
+    async def scenario():
+        _, store = await make_store("test_store_large")
+        appended = await store.append("c", [message(str(index)) for index in range(7)])
+        return appended["seqs"], await store.read("c", last=4), await store.read_from("c", 5)
+
+    seqs, last, tail = asyncio.run(scenario())
+    assert seqs == list(range(7))
+    assert [message["content"] for message in last] == ["3", "4", "5", "6"]
+    assert [message["seq"] for message in tail] == [5, 6]
+
+
+def test_missing_conversation_writes_nothing():
+    async def scenario():
+        db, store = await make_store("test_store_missing")
+        return await store.append("nope", [message("x")]), await db.message_buckets.count_documents({})
+
+    assert asyncio.run(scenario()) == (None, 0)
+
+
+def test_appends_after_archiving_number_on_from_the_archive():
+    async def scenario():
+        db, store = await make_store("test_store_archived")
+        await store.append("c", [message(str(index)) for index in range(5)])
+        await db.conversations.update_one(
+            {"id": "c"}, {"$set": {"status": "ended", "archived_at": None, "ended_at": datetime.utcnow() - timedelta(days=60)}}
+        )
+        await db.summaries.insert_one({"conversation_id": "c", "message_count": 5})
+        archive = ConversationArchive(db, store, after=timedelta(days=30))
+        archived = await archive.archive_due()
+        appended = await store.append("c", [message("after")])
+        return archived, appended["seqs"], (await archive.read_many(["c"]))["c"], await store.read("c")
+
+    archived, seqs, archived_messages, hot = asyncio.run(scenario())
+    assert archived == 1
+    assert seqs == [5]
+    assert [message["seq"] for message in hot] == [5]
+    assert [message["seq"] for message in archived_messages] == [0, 1, 2, 3, 4]
+
+
+def test_backfill_starts_numbers_buckets_written_before_they_had_one():
+    async def scenario():
+        db, store = await make_store("test_store_backfill_starts")
+        for bucket in range(2):
+            await db.message_buckets.insert_one({
+                "conversation_id": "c", "bucket": bucket, "count": 3, "avatar_id": "a",
+                "messages": [dict(message(str(seq)), seq=seq) for seq in range(bucket * 3, bucket * 3 + 3)],
+            })
+        await store.backfill_starts()
+        return await store.read("c")
+
+    assert [message["seq"] for message in asyncio.run(scenario())] == list(range(6))
+
+
+def test_warm_appends_are_one_round_trip_and_conversation_updates_are_coalesced():
+    async def scenario():
+        recorder = RoundTripRecorder()
+        db, store = await make_store(
+            "test_store_round_trips", bucket_size=100, recorder=recorder, resolve=resolve, heads=TTLCache(), delay=60
+        )
+        await store.append("c", [message("first")])
+        recorder.reset()
+        for index in range(5):
+            await store.append("c", [message(f"m{index}")])
+        appends = dict(recorder.counts)
+        before_flush = await db.conversations.find_one({"id": "c"})
+        recorder.reset()
+        await store.flush(["c"])
+        return appends, before_flush, dict(recorder.counts), await db.conversations.find_one({"id": "c"})
+
+    appends, before_flush, flush, conversation = asyncio.run(scenario())
+    assert appends == {("message_buckets", "update_one"): 5}
+    assert before_flush["message_count"] == 0
+    assert flush == {("conversations", "bulk_write"): 1}
+    assert conversation["message_count"] == 6
+    assert conversation["last_message_preview"] == "m4"
+
+
+def test_a_sealed_remembered_head_is_moved_past():
+    async def scenario():
+        db, store = await make_store("test_store_stale_head", resolve=resolve, heads=TTLCache())
+        other = MessageStore(db, bucket_size=3, resolve=resolve, heads=TTLCache())
+        await store.append("c", [message("a")])
+        # Another worker fills and seals the bucket this one remembers as the newest
+        await other.append("c", [message("b"), message("c")])
+        await other.append("c", [message("d")])
+        await store.append("c", [message("e")])
+        return await store.read("c")
+
+    messages = asyncio.run(scenario())
+    assert [(message["seq"], message["content"]) for message in messages] == [(0, "a"), (1, "b"), (2, "c"), (3, "d"), (4, "e")]
+
+
+def test_listing_hook_runs_only_after_the_conversation_is_updated():
+    async def scenario():
+        db, store = await make_store("test_store_after_append", resolve=resolve, delay=60)
+        seen = []
+
+        async def after_append(conversation):
+            seen.append((await db.conversations.find_one({"id": conversation["id"]}))["message_count"])
+
+        store.after_append = after_append
+        await store.append("c", [message("x"), message("y")])
+        before_flush = list(seen)
+        await store.flush()
+        return before_flush, seen
+
+    assert asyncio.run(scenario()) == ([], [2])
+
+
+def test_a_failed_conversation_update_is_retried():
+    async def scenario():
+        db, store = await make_store("test_store_update_retry", resolve=resolve, delay=60)
+        await store.append("c", [message("x")])
+        write = store.conversations.bulk_write
+
+        async def fail(*args, **kwargs):
+            raise ConnectionError("primary stepped down")
+
+        store.conversations.bulk_write = fail
+        await store.flush()
+        store.conversations.bulk_write = write
+        await store.flush()
+        return await db.conversations.find_one({"id": "c"})
+
+    assert asyncio.run(scenario())["message_count"] == 1
@@ -0,0 +1,61 @@
+import asyncio
+import base64
+from datetime import datetime, timedelta
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+from pagination import InvalidCursor, decode_cursor, encode_cursor, fetch_page, keyset_filter
+
+
+def token(raw: str) -> str:
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def test_cursor_round_trips_datetimes_and_strings():
+    values = [datetime(2024, 5, 1, 12, 30), "id-1"]
+    assert decode_cursor(encode_cursor(values)) == values
+
+
+@pytest.mark.parametrize("raw", [
+    '[{"$oid": "zz"}]',
+    '[{"$date": "x"}]',
+    '[{"$binary": 5}]',
+    '{"$oid": "zz"}',
+    '{"not": "a list"}',
+    '[{"$ne": null}]',
+    '[[1, 2]]',
+    'not json',
+])
+def test_malformed_cursors_are_invalid(raw):
+    with pytest.raises(InvalidCursor):
+        decode_cursor(token(raw))
+
+
+def test_cursor_that_is_not_base64_is_invalid():
+    with pytest.raises(InvalidCursor):
+        decode_cursor("%%%")
+
+
+def test_keyset_filter_needs_one_value_per_sort_field():
+    with pytest.raises(InvalidCursor):
+        keyset_filter([("started_at", 1), ("id", 1)], ["x"])
+
+
+def test_pages_cover_every_document_once_with_ties_on_the_first_key():
+    async def scenario():
+        collection = AsyncMongoMockClient()["test_pagination"]["items"]
+        start = datetime(2024, 1, 1)
+        # Three documents share each timestamp, so only the id tiebreak orders them
+        await collection.insert_many(
+            [{"id": f"{index:02d}", "created_at": start + timedelta(minutes=index // 3)} for index in range(10)]
+        )
+        sort = [("created_at", 1), ("id", 1)]
+        seen, after = [], None
+        while True:
+            items, after = await fetch_page(collection, {}, sort, 4, after, lambda doc: doc["id"])
+            seen.extend(items)
+            if after is None:
+                return seen
+
+    assert asyncio.run(scenario()) == [f"{index:02d}" for index in range(10)]
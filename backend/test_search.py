@@ -0,0 +1,93 @@
+import asyncio
+from datetime import datetime
+
+from archive import pack
+from benchmarks.mongo_harness import LatencyClient, RoundTripRecorder
+from search import ConversationSearch, matched_terms, search_terms, snippet
+
+
+class TermMatchSearch(ConversationSearch):
+    """The in-process Mongo has no ``$text``; score documents by the query terms their strings contain."""
+
+    async def _find(self, collection, avatar_id, query, depth, projection):
+        terms = search_terms(query)
+        found = []
+        async for document in collection.find({"avatar_id": avatar_id}, {"_id": 0}):
+            score = matched_terms(" ".join(_strings(document)), terms)
+            if score:
+                found.append(dict({key: document[key] for key in projection if key in document}, score=float(score)))
+        found.sort(key=lambda document: -document["score"])
+        return found[:depth]
+
+
+def _strings(value):
+    if isinstance(value, str):
+        yield value
+    elif isinstance(value, dict):
+        for item in value.values():
+            yield from _strings(item)
+    elif isinstance(value, list):
+        for item in value:
+            yield from _strings(item)
+
+
+def message(seq, content):
+    return {"seq": seq, "sender": "participant", "content": content, "timestamp": datetime(2024, 1, 1)}
+
+
+def test_search_terms_leave_out_negated_words():
+    assert search_terms('Refund -shipping "warranty claim"') == ["refund", "warranty", "claim"]
+
+
+def test_matching_tolerates_plural_endings():
+    assert matched_terms("Two warranties expired", ["warranty", "refund"]) == 1
+
+
+def test_snippet_centres_on_the_first_match():
+    text = "x" * 300 + " the refund arrived " + "y" * 300
+    excerpt = snippet(text, ["refund"], width=80)
+    assert "refund" in excerpt
+    assert excerpt.startswith("...") and excerpt.endswith("...")
+
+
+def test_archived_messages_are_found_through_their_summary():
+    async def scenario():
+        db = LatencyClient(RoundTripRecorder())["test_search_archived"]
+        await db.conversation_archive.insert_many([
+            {"conversation_id": c, "avatar_id": "a", "payload": pack([message(0, "hi"), message(1, "my refund is late")])}
+            for c in ("summarized", "unmentioned")
+        ])
+        await db.summaries.insert_many([
+            {"id": "s1", "conversation_id": "summarized", "avatar_id": "a", "summary_text": "Asked about a refund",
+             "key_points": [], "generated_at": datetime(2024, 1, 2)},
+            {"id": "s2", "conversation_id": "unmentioned", "avatar_id": "a", "summary_text": "Small talk",
+             "key_points": [], "generated_at": datetime(2024, 1, 2)},
+        ])
+        return await TermMatchSearch(db).search("refund", ["a"], 0, 10, kinds=("message",))
+
+    hits, has_more = asyncio.run(scenario())
+    assert not has_more
+    assert [(hit["conversation_id"], hit["seq"]) for hit in hits] == [("summarized", 1)]
+    assert "refund" in hits[0]["snippet"]
+
+
+def test_hits_are_ranked_across_buckets_and_paged():
+    async def scenario():
+        db = LatencyClient(RoundTripRecorder())["test_search_ranked"]
+        await db.message_buckets.insert_many([
+            {"conversation_id": "c1", "avatar_id": "a", "bucket": 0, "start": 0,
+             "messages": [message(0, "refund please"), message(0, "warranty and refund")]},
+            {"conversation_id": "c2", "avatar_id": "a", "bucket": 0, "start": 0, "messages": [message(0, "no match here")]},
+            {"conversation_id": "c3", "avatar_id": "b", "bucket": 0, "start": 0, "messages": [message(0, "refund for b")]},
+        ])
+        search = TermMatchSearch(db)
+        return (
+            await search.search("refund warranty", ["a"], 0, 1, kinds=("message",)),
+            await search.search("refund warranty", ["a"], 1, 5, kinds=("message",)),
+            await search.search("-refund", ["a"], 0, 5),
+        )
+
+    first, rest, negated = asyncio.run(scenario())
+    assert [(hit["conversation_id"], hit["seq"]) for hit in first[0]] == [("c1", 1)] and first[1]
+    assert [(hit["conversation_id"], hit["seq"]) for hit in rest[0]] == [("c1", 0)] and not rest[1]
+    assert negated == ([], False)
@@ -0,0 +1,130 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from benchmarks.mongo_harness import LatencyClient, RoundTripRecorder
+from indexes import ensure_indexes
+from summary_jobs import SummaryJobQueue
+
+
+async def make_queue(name, handler, **options):
+    db = LatencyClient(RoundTripRecorder())[name]
+    await ensure_indexes(db)
+    return db, SummaryJobQueue(db.summary_jobs, handler, **options)
+
+
+async def wait_for(predicate, timeout=2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not await predicate():
+        assert asyncio.get_running_loop().time() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+
+def test_a_job_is_claimed_once():
+    async def scenario():
+        calls = []
+
+        async def handler(job, report_stage):
+            calls.append(job["id"])
+            await asyncio.sleep(0.02)
+            return "summary"
+
+        db, queue = await make_queue("test_jobs_claim", handler, concurrency=4)
+        job = await queue.enqueue("c")
+        # A duplicate id on the queue, as after a requeue that raced a claim
+        queue._queue.put_nowait(job["id"])
+        await queue.start()
+        await wait_for(lambda: _status(db, job["id"], "completed"))
+        await queue.stop()
+        return calls, job["id"], await queue.get(job["id"])
+
+    calls, job_id, job = asyncio.run(scenario())
+    assert calls == [job_id]
+    assert job["summary_id"] == "summary"
+    assert job["dedupe_key"] == job_id
+
+
+def test_stopping_mid_run_requeues_the_job():
+    async def scenario():
+        started = asyncio.Event()
+
+        async def handler(job, report_stage):
+            await report_stage("summarizing")
+            started.set()
+            await asyncio.sleep(60)
+
+        db, queue = await make_queue("test_jobs_stop", handler, concurrency=1)
+        await queue.start()
+        job = await queue.enqueue("c")
+        await started.wait()
+        await queue.stop()
+        # The dedupe_key now leads back to a job that will run again, not a dead one
+        return job["id"], await queue.get(job["id"]), await queue.enqueue("c")
+
+    job_id, job, again = asyncio.run(scenario())
+    assert job["status"] == "queued"
+    assert job["stage"] is None and job["claimed_by"] is None
+    assert again["id"] == job_id
+
+
+def test_stop_requeues_jobs_left_running_by_this_worker():
+    async def scenario():
+        async def handler(job, report_stage):
+            return "summary"
+
+        db, queue = await make_queue("test_jobs_stop_claimed", handler)
+        await db.summary_jobs.insert_many([
+            {"id": "mine", "dedupe_key": "a", "status": "running", "claimed_by": queue.worker_id, "started_at": datetime.utcnow()},
+            {"id": "theirs", "dedupe_key": "b", "status": "running", "claimed_by": "other", "started_at": datetime.utcnow()},
+        ])
+        await queue.stop()
+        return (await queue.get("mine"))["status"], (await queue.get("theirs"))["status"]
+
+    assert asyncio.run(scenario()) == ("queued", "running")
+
+
+def test_the_reaper_requeues_jobs_whose_lease_lapsed():
+    async def scenario():
+        async def handler(job, report_stage):
+            return "summary"
+
+        db, queue = await make_queue(
+            "test_jobs_reaper", handler, lease=timedelta(minutes=5), reap_interval=timedelta(milliseconds=20)
+        )
+        await queue.start()
+        # Claimed by a process that died after startup, so only the timer can pick it up
+        await db.summary_jobs.insert_many([
+            {"id": "stale", "conversation_id": "a", "dedupe_key": "a", "status": "running", "claimed_by": "dead",
+             "started_at": datetime.utcnow() - timedelta(minutes=10)},
+            {"id": "fresh", "conversation_id": "b", "dedupe_key": "b", "status": "running", "claimed_by": "alive",
+             "started_at": datetime.utcnow()},
+        ])
+        await wait_for(lambda: _status(db, "stale", "completed"))
+        await queue.stop()
+        return (await queue.get("fresh"))["status"], queue.stats()["requeued"]
+
+    assert asyncio.run(scenario()) == ("running", 1)
+
+
+def test_a_reaped_run_does_not_overwrite_the_newer_run():
+    async def scenario():
+        release = asyncio.Event()
+
+        async def handler(job, report_stage):
+            await release.wait()
+            return "late"
+
+        db, queue = await make_queue("test_jobs_overtaken", handler, concurrency=1)
+        job = await queue.enqueue("c")
+        run = asyncio.create_task(queue._run(job["id"]))
+        await wait_for(lambda: _status(db, job["id"], "running"))
+        # Its lease lapsed and another process claimed and finished it meanwhile
+        await db.summary_jobs.update_one({"id": job["id"]}, {"$set": {"claim": "other", "status": "completed", "summary_id": "first"}})
+        release.set()
+        await run
+        return await queue.get(job["id"])
+
+    assert asyncio.run(scenario())["summary_id"] == "first"
+
+
+async def _status(db, job_id, status):
+    return await db.summary_jobs.count_documents({"id": job_id, "status": status}) == 1
@@ -0,0 +1,91 @@
+import asyncio
+import time
+from datetime import datetime
+
+import pytest
+
+from benchmarks.mongo_harness import LatencyClient, RoundTripRecorder
+from versions import ResourceVersions, entity_tag, http_date, is_fresh
+
+MODIFIED = datetime(2024, 3, 1, 12, 0, 0, 500000)
+
+
+def test_entity_tags_change_with_any_part():
+    assert entity_tag("a", 1) == entity_tag("a", 1)
+    assert entity_tag("a", 1) != entity_tag("a", 2)
+    # Parts are separated, so shifting a boundary changes the tag
+    assert entity_tag("a1", 2) != entity_tag("a", 12)
+
+
+@pytest.mark.parametrize("if_none_match, fresh", [
+    ('"v1"', True),
+    ('"v0", "v1"', True),
+    ('W/"v1"', True),
+    ("*", True),
+    ('"v2"', False),
+])
+def test_if_none_match(if_none_match, fresh):
+    assert is_fresh({"if-none-match": if_none_match}, '"v1"') is fresh
+
+
+@pytest.mark.parametrize("if_modified_since, fresh", [
+    ("Fri, 01 Mar 2024 12:00:00 GMT", True),
+    ("Fri, 01 Mar 2024 13:00:00 GMT", True),
+    ("Fri, 01 Mar 2024 11:59:59 GMT", False),
+    ("Fri, 01 Mar 2024 14:00:00 +0200", True),
+    ("yesterday", False),
+])
+def test_if_modified_since_compares_whole_seconds_in_utc(if_modified_since, fresh):
+    assert is_fresh({"if-modified-since": if_modified_since}, '"v1"', MODIFIED) is fresh
+
+
+def test_unknown_zone_dates_are_read_as_utc_whatever_the_host_zone(monkeypatch):
+    monkeypatch.setenv("TZ", "America/New_York")
+    time.tzset()
+    try:
+        assert is_fresh({"if-modified-since": "Fri, 01 Mar 2024 12:00:00 -0000"}, '"v1"', MODIFIED)
+        assert not is_fresh({"if-modified-since": "Fri, 01 Mar 2024 11:59:59 -0000"}, '"v1"', MODIFIED)
+    finally:
+        monkeypatch.undo()
+        time.tzset()
+
+
+def test_if_none_match_wins_over_if_modified_since():
+    headers = {"if-none-match": '"v2"', "if-modified-since": http_date(MODIFIED)}
+    assert not is_fresh(headers, '"v1"', MODIFIED)
+
+
+def test_delayed_bumps_are_coalesced_and_written_before_a_read():
+    async def scenario():
+        recorder = RoundTripRecorder()
+        versions = ResourceVersions(LatencyClient(recorder)["test_versions"].resource_versions, delay=60)
+        unbumped = await versions.get("avatars:u")
+        await versions.bump("avatars:u")
+        recorder.reset()
+        for _ in range(5):
+            versions.bump_later("avatars:u", "conversations:a")
+        version, updated_at = await versions.get("avatars:u")
+        return unbumped, version, updated_at, dict(recorder.counts), (await versions.get("conversations:a"))[0]
+
+    unbumped, version, updated_at, trips, other = asyncio.run(scenario())
+    assert unbumped == (0, None)
+    assert version == 2 and updated_at is not None
+    assert trips[("resource_versions", "bulk_write")] == 1
+    assert other == 1
+
+
+def test_a_failed_delayed_bump_is_retried():
+    async def scenario():
+        versions = ResourceVersions(LatencyClient(RoundTripRecorder())["test_versions_retry"].resource_versions, delay=60)
+        bump = versions.bump
+
+        async def fail(*scopes):
+            raise ConnectionError("primary stepped down")
+
+        versions.bump_later("avatars:u")
+        versions.bump = fail
+        await versions.flush()
+        versions.bump = bump
+        return await versions.get("avatars:u")
+
+    assert asyncio.run(scenario())[0] == 1
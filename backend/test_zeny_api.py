@@ -5,6 +5,15 @@ import time
 # API base URL
 API_BASE = "http://localhost:8001/api"
 
+def wait_for_summary(job):
+    # Summary generation runs in the background; poll the job until it settles
+    while job['status'] in ('queued', 'running'):
+        time.sleep(0.5)
+        job = requests.get(f"{API_BASE}/summary-jobs/{job['id']}").json()
+    if job['status'] != 'completed':
+        return None
+    return requests.get(f"{API_BASE}/summaries/{job['summary_id']}").json()
+
 def test_avatars():
     print("=== Testing Avatar Management ===")
     
@@ -99,8 +108,8 @@ def test_summaries(conversation_id):
     print("1. Generating summary...")
     response = requests.post(f"{API_BASE}/conversations/{conversation_id}/summary")
     print(f"Generate Summary Response: {response.status_code}")
-    if response.status_code == 200:
-        summary = response.json()
+    summary = wait_for_summary(response.json()) if response.status_code == 202 else None
+    if summary:
         print(f"Generated summary (ID: {summary['id']})")
         print(f"Summary: {summary['summary_text']}")
         print("Key points:")
@@ -0,0 +1,109 @@
+import asyncio
+import hashlib
+import logging
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Mapping, Optional, Set, Tuple
+
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+
+def entity_tag(*parts) -> str:
+    """A strong ETag derived from whatever identifies one version of a response."""
+    return '"' + hashlib.sha1("\x1f".join(str(part) for part in parts).encode()).hexdigest() + '"'
+
+
+def http_date(moment: datetime) -> str:
+    # Stored datetimes are naive UTC
+    return format_datetime(moment.replace(tzinfo=timezone.utc), usegmt=True)
+
+
+def is_fresh(headers: Mapping[str, str], etag: str, last_modified: Optional[datetime] = None) -> bool:
+    """Whether the client's cached copy is current, so a 304 can be sent.
+
+    ``If-None-Match`` wins over ``If-Modified-Since`` when both are present,
+    as RFC 9110 requires.
+    """
+    if_none_match = headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags or f"W/{etag}" in tags
+    if_modified_since = headers.get("if-modified-since")
+    if if_modified_since and last_modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is not None:
+            # A "-0000" zone parses as naive; HTTP dates are always UTC either way
+            since = since.astimezone(timezone.utc).replace(tzinfo=None)
+        return last_modified.replace(microsecond=0) <= since
+    return False
+
+
+class ResourceVersions:
+    """Version counters for sets of resources, such as one owner's avatars.
+
+    Every write that changes a member of a set bumps its scope, so a list
+    endpoint can check a client's ETag against one small document instead
+    of re-running its query. Scopes never bumped read as version 0.
+
+    Hot paths call ``bump_later`` instead: scopes are collected for
+    ``delay`` seconds and bumped with one write, so a burst of messages to
+    one avatar's conversations costs one bump. Until it lands, other
+    workers may still answer 304 for the previous version; this worker
+    writes a pending bump before reading the scope.
+    """
+
+    def __init__(self, collection, delay: float = 0.05):
+        self._collection = collection
+        self.delay = delay
+        self._dirty: Set[str] = set()
+        self._timer: Optional[asyncio.Task] = None
+
+    async def bump(self, *scopes: str):
+        now = datetime.utcnow()
+        await self._collection.bulk_write(
+            [UpdateOne({"_id": scope}, {"$inc": {"version": 1}, "$set": {"updated_at": now}}, upsert=True) for scope in scopes],
+            ordered=False,
+        )
+
+    def bump_later(self, *scopes: str):
+        self._dirty.update(scopes)
+        if self._timer is None:
+            self._timer = asyncio.create_task(self._bump_later())
+
+    async def _bump_later(self):
+        await asyncio.sleep(self.delay)
+        self._timer = None
+        await self.flush()
+
+    async def flush(self):
+        """Bump every scope collected by ``bump_later`` so far."""
+        scopes, self._dirty = self._dirty, set()
+        if not scopes:
+            return
+        try:
+            await self.bump(*scopes)
+        except Exception:
+            # Dirty again: a lost bump would let clients keep a stale listing, and get() retries it first
+            self._dirty.update(scopes)
+            logger.exception("Bumping %d resource versions failed", len(scopes))
+
+    async def drain(self):
+        """Bump the scopes still waiting for their timer, so no ETag outlives a change made before shutdown."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        await self.flush()
+
+    async def get(self, scope: str) -> Tuple[int, Optional[datetime]]:
+        """The scope's version and when it last changed."""
+        if scope in self._dirty:
+            await self.flush()
+        document = await self._collection.find_one({"_id": scope})
+        if document is None:
+            return 0, None
+        return document["version"], document["updated_at"]
@@ -75,15 +75,62 @@ const AvatarChat = ({ user, onLogout }) => {
       content: newMessage
     };
 
+    const sentAt = new Date().toISOString();
+    setMessages((prev) => [
+      ...prev,
+      { ...message, timestamp: sentAt },
+      { sender: 'avatar', content: '', timestamp: sentAt }
+    ]);
+    setNewMessage('');
+
     try {
-      await axios.post(`${API}/conversations/${conversation.id}/messages`, message);
-      
-      // Fetch updated conversation to get all messages including AI response
-      const updatedConv = await axios.get(`${API}/conversations/${conversation.id}`);
-      setMessages(updatedConv.data.messages);
-      setNewMessage('');
+      // Stream the avatar's reply token by token over Server-Sent Events
+      const response = await fetch(`${API}/conversations/${conversation.id}/messages/stream`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify(message)
+      });
+      if (!response.ok) {
+        throw new Error(`Stream request failed with status ${response.status}`);
+      }
+
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const events = buffer.split('\n\n');
+        buffer = events.pop();
+        events.forEach((rawEvent) => handleStreamEvent(rawEvent));
+      }
     } catch (error) {
       console.error('Error sending message:', error);
+    } finally {
+      // Drop the reply placeholder if the avatar never answered
+      setMessages((prev) => {
+        const last = prev[prev.length - 1];
+        return last && last.sender === 'avatar' && !last.content ? prev.slice(0, -1) : prev;
+      });
+    }
+  };
+
+  const handleStreamEvent = (rawEvent) => {
+    const lines = rawEvent.split('\n');
+    const event = lines.find((line) => line.startsWith('event: '))?.slice(7);
+    const data = lines.find((line) => line.startsWith('data: '))?.slice(6);
+    if (!event || data === undefined) return;
+
+    if (event === 'token') {
+      const token = JSON.parse(data);
+      setMessages((prev) => {
+        const last = prev[prev.length - 1];
+        return [...prev.slice(0, -1), { ...last, content: last.content + token }];
+      });
+    } else if (event === 'done') {
+      const storedMessage = JSON.parse(data);
+      setMessages((prev) => [...prev.slice(0, -1), storedMessage]);
     }
   };
 
@@ -102,7 +149,16 @@ const AvatarChat = ({ user, onLogout }) => {
     if (!conversation) return;
 
     try {
-      const response = await axios.post(`${API}/conversations/${conversation.id}/summary`);
+      // Summaries are generated in the background; poll the job until it settles
+      let { data: job } = await axios.post(`${API}/conversations/${conversation.id}/summary`);
+      while (job.status === 'queued' || job.status === 'running') {
+        await new Promise((resolve) => setTimeout(resolve, 500));
+        ({ data: job } = await axios.get(`${API}/summary-jobs/${job.id}`));
+      }
+      if (job.status !== 'completed') {
+        throw new Error(job.error || 'Summary generation failed');
+      }
+      const response = await axios.get(`${API}/summaries/${job.summary_id}`);
       setSummary(response.data);
     } catch (error) {
       console.error('Error generating summary:', error);
@@ -138,7 +194,7 @@ const AvatarChat = ({ user, onLogout }) => {
               <ArrowLeft className="w-4 h-4" />
             </Button>
             <Avatar className="h-12 w-12">
-              <AvatarImage src={avatar.avatar_image} />
+              <AvatarImage src={avatar.avatar_image_hash ? `${API}/images/${avatar.avatar_image_hash}` : avatar.avatar_image} />
               <AvatarFallback>{avatar.name.charAt(0)}</AvatarFallback>
             </Avatar>
             <div>
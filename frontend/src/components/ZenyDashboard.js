@@ -13,6 +13,18 @@ import { useNavigate } from 'react-router-dom';
 const API_BASE = process.env.REACT_APP_API_URL || 'http://localhost:8001';
 const API = `${API_BASE}/api`;
 
+// List endpoints return one page at a time; follow X-Next-Cursor until the last one
+const fetchAllPages = async (url) => {
+  const items = [];
+  let after = null;
+  do {
+    const response = await axios.get(url, { params: { limit: 1000, ...(after ? { after } : {}) } });
+    items.push(...response.data);
+    after = response.headers['x-next-cursor'];
+  } while (after);
+  return items;
+};
+
 const ZenyDashboard = ({ user, onLogout }) => {
   const [avatars, setAvatars] = useState([]);
   const [summaries, setSummaries] = useState([]);
@@ -31,8 +43,7 @@ const ZenyDashboard = ({ user, onLogout }) => {
 
   const fetchAvatars = async () => {
     try {
-      const response = await axios.get(`${API}/avatars`);
-      setAvatars(response.data);
+      setAvatars(await fetchAllPages(`${API}/avatars`));
     } catch (error) {
       console.error('Error fetching avatars:', error);
     }
@@ -40,8 +51,8 @@ const ZenyDashboard = ({ user, onLogout }) => {
 
   const fetchSummaries = async () => {
     try {
-      const response = await axios.get(`${API}/summaries`);
-      setSummaries(response.data.slice(0, 5)); // Get latest 5 summaries
+      const response = await axios.get(`${API}/summaries`, { params: { limit: 5 } });
+      setSummaries(response.data); // Latest 5 summaries
     } catch (error) {
       console.error('Error fetching summaries:', error);
     }
@@ -161,7 +172,7 @@ const ZenyDashboard = ({ user, onLogout }) => {
                   <CardHeader>
                     <div className="flex items-center space-x-4">
                       <Avatar className="h-12 w-12">
-                        <AvatarImage src={avatar.avatar_image} />
+                        <AvatarImage src={avatar.avatar_image_hash ? `${API}/images/${avatar.avatar_image_hash}` : avatar.avatar_image} />
                         <AvatarFallback>{avatar.name.charAt(0)}</AvatarFallback>
                       </Avatar>
                       <div className="flex-1">